@@ -1,12 +1,13 @@
-import json, copy, pickle
+import os, json, copy, pickle, socket
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 from typing import TypedDict, Tuple, Dict, Set, Optional, List
 from typeguard import typechecked
 
 import pycouch.wrapper as wrapper
 
-from CSTB_core.engine.word_detect import sgRNAfastaSearch
-from CSTB_core.utils.io import sgRNAIndexWriter
 from CSTB_core.engine.wordIntegerIndexing import indexAndMayOccurence as computeMotifsIndex
 from CSTB_core.engine.wordIntegerIndexing import getEncoding
 import CSTB_database_manager.db.couch.taxon as taxonDBHandler
@@ -14,17 +15,33 @@ import CSTB_database_manager.db.couch.genome as genomeDBHandler
 import CSTB_database_manager.db.blast as blastDBHandler
 import CSTB_database_manager.db.couch.motifs as motifsDBHandler
 import CSTB_database_manager.db.index as indexDBHandler 
+import CSTB_database_manager.db.journal as journalHandler
+import CSTB_database_manager.db.fingerprint as fingerprintHandler
+import CSTB_database_manager.db.inverted as invertedHandler
 
 import CSTB_database_manager.utils.error as error
-from CSTB_core.utils.io import fileHash as fastaHash
 from CSTB_core.utils.io import Zfile as zFile
 from  CSTB_database_manager.db.couch.genome import GenomeEntity as tGenomeEntity
 # GL for sbatch, temporary hack
 import CSTB_database_manager.db.couch.tree as treeDBHandler
 import CSTB_database_manager.engine.taxonomic_tree as tTree
-from CSTB_core.utils.io import zFastaReader
+from CSTB_database_manager.engine.fasta_reader import FastaDigest, FastaRecords
+from CSTB_database_manager.engine.sgrna_search import sgRNArecordsSearch
+from CSTB_database_manager.engine.motif_stream import spillRecords, sliceMotifs, motifsIndex
+from CSTB_database_manager.engine.sorted_runs import SortedRuns
+from CSTB_database_manager.engine.motif_cache import MotifCache, MotifCacheWriter, CACHE_EXTENSION, encodeMotifs, decodeMotifs
+from CSTB_database_manager.engine.minhash import sketchCodes, NEAR_DUPLICATE_THRESHOLD
+from CSTB_database_manager.engine.similarity import sharedSgrnaMatrix
+from CSTB_database_manager.engine.bulk_build import VolumeRuns
 import logging
 
+def _searchFasta(fastaFile, uuid, stream=False, spillLocation=None):
+    """sgRNA search in a worker process, fasta records are streamed from file there"""
+    records = FastaRecords(fastaFile)
+    if stream:
+        return spillRecords(records, uuid, spillLocation)
+    return sgRNArecordsSearch(records, uuid)
+
 class ConfigType(TypedDict):
     url: str
     user: str
@@ -33,8 +50,12 @@ class ConfigType(TypedDict):
     genomedb_name: str
     treedb_name: str
     blastdb_path : str
+    blastdb_compressed: bool
     indexdb_path: str
     ete3_db: str
+    fingerprint_path: str
+    index_format: str
+    inverted_path: str
 
 @typechecked
 class DatabaseManager():
@@ -59,18 +80,30 @@ class DatabaseManager():
             logging.info(f"DatabaseManager:init:Warning no blast database specified")
             self.blastdb = None
         else:
-            self.blastdb = blastDBHandler.connect(config["blastdb_path"])
+            self.blastdb = blastDBHandler.connect(config["blastdb_path"], compressed=config.get("blastdb_compressed", False))
 
+        self.motifsdb = None
         if mapping_rules:
             self.motifsdb = motifsDBHandler.MotifsDB(self.wrapper, mapping_rules)
 
+        self.indexFormat = config.get("index_format", "text")
         if not "indexdb_path" in config:
             logging.warn("No index database specified")
             self.indexdb = None
         else:
-            self.indexdb = indexDBHandler.connect(config["indexdb_path"])
+            self.indexdb = indexDBHandler.connect(config["indexdb_path"], self.indexFormat)
 
         self.ete3_db_path = config['ete3_db']
+        self._fastaSummaries = {}
+        self._indexFolders = {}
+        self.journal = None
+        self.resume = False
+        self.fingerprints = None
+        if "fingerprint_path" in config:
+            self.setFingerprintCache(config["fingerprint_path"])
+        self.inverted = None
+        if "inverted_path" in config:
+            self.setInvertedIndex(config["inverted_path"])
 
     def _load_config(self, config_file:str)-> ConfigType:
         with open(config_file) as f:
@@ -93,22 +126,186 @@ class DatabaseManager():
     def setDebugMode(self, value=True):
         wrapper.DEBUG_MODE = value
 
-    def setMotifAgent(self, mappingRuleFile):
+    def setMotifAgent(self, mappingRuleFile, appendMode="bulk"):
         with open(mappingRuleFile, 'rb') as fp:
             self.wrapper.setKeyMappingRules(json.load(fp))
+        self.motifsdb = motifsDBHandler.MotifsDB(self.wrapper, mappingRuleFile, appendMode)
         logging.info(f"Loaded {len(self.wrapper.queue_mapper)} volumes mapping rules" )
     
+    def setBlastStaging(self, name: str = None):
+        """Write blast records of this run to a private staging fragment of blast database instead of database itself,
+        so that several runs can add genomes at once. Fragments are folded into database by mergeBlast.
+
+        :param name: fragment name, defaults to host name and process id
+        :type name: str, optional
+        """
+        if not self.blastdb:
+            raise error.BlastConnectionError("No blast database specified")
+        name = name if name else f"{socket.gethostname().split('.')[0]}_{os.getpid()}"
+        self.blastdb = blastDBHandler.stage(self.blastdb.location, name)
+        logging.info(f"Blast records staged in {self.blastdb.location}")
+
+    def mergeBlast(self) -> int:
+        """Fold staging fragments of finished runs into blast database, then format changed shards once
+
+        :return: number of records merged
+        :rtype: int
+        """
+        if not self.blastdb:
+            raise error.BlastConnectionError("No blast database specified")
+        merged = self.blastdb.merge()
+        self.blastdb.close()
+        logging.info(f"{merged} staged records merged into blast database")
+        return merged
+
+    def setJournal(self, journalFile, resume=False):
+        """Record completed ingestion stages of each fasta in a local journal, to be able to resume.
+        Stages found completed in journal are skipped only with resume, they are done again and journaled otherwise.
+        """
+        self.journal = journalHandler.connect(journalFile)
+        self.resume = resume
+        logging.info(f"Ingestion journal at {journalFile}{', resuming' if resume else ''}")
+
+    def setIndexFormat(self, indexFormat):
+        """Format of written index files, "text" (<uuid>.index) or "binary" (<uuid>.bindex)"""
+        if not indexFormat in indexDBHandler.FORMATS:
+            raise ValueError(f"Unknown index format {indexFormat}, must be one of {indexDBHandler.FORMATS}")
+        self.indexFormat = indexFormat
+        if self.indexdb:
+            self.indexdb.index_format = indexFormat
+
+    def _sgRNAIndexWriter(self, indexChunks, nbCodes, location, uuid, wLen):
+        """Write index file of a genome from sorted (codes, counts) chunks of nbCodes codes altogether, with its MinHash sketch.
+        Sketch is merged chunk by chunk, only the inverted index gets all codes at once.
+        """
+        if self.indexFormat == "binary":
+            fIndex = f"{location}/{uuid}{indexDBHandler.BINARY_EXTENSION}"
+            writer = indexDBHandler.writeBinaryIndexChunks
+        else:
+            fIndex = f"{location}/{uuid}{indexDBHandler.TEXT_EXTENSION}"
+            writer = indexDBHandler.writeTextIndexChunks
+        sketch = sketchCodes(np.zeros(0, dtype=np.uint64))
+        genomeCodes = []
+        def sketched(chunks):
+            nonlocal sketch
+            for codes, counts in chunks:
+                codes = np.asarray(codes, dtype=np.uint64)
+                sketch = np.minimum(sketch, sketchCodes(codes))
+                if self.inverted:
+                    genomeCodes.append(codes)
+                yield codes, counts
+        indexLen = writer(sketched(indexChunks), nbCodes, fIndex, wLen, getEncoding()[0])
+        self._sketchIndex(sketch, nbCodes, location, uuid)
+        if self.inverted:
+            # index file was just (re)written, postings of a genome indexed again are replaced
+            self.inverted.add(uuid, np.concatenate(genomeCodes) if genomeCodes else np.zeros(0, dtype=np.uint64), force=True)
+        return indexLen, fIndex
+
+    def _indexFolder(self, location):
+        if self.indexdb and os.path.abspath(self.indexdb.database_folder) == os.path.abspath(location):
+            return self.indexdb
+        if not location in self._indexFolders:
+            self._indexFolders[location] = indexDBHandler.IndexDB(location, self.indexFormat)
+        return self._indexFolders[location]
+
+    def _sketchIndex(self, sketch, nbCodes, location, uuid):
+        """Store MinHash sketch of a genome index and warn about already indexed near duplicate genomes"""
+        indexFolder = self._indexFolder(location)
+        indexFolder.storeSketch(uuid, sketch, nbCodes)
+        for other, jaccard in indexFolder.nearest(sketch, 3, exclude=uuid):
+            if jaccard >= NEAR_DUPLICATE_THRESHOLD:
+                logging.warn(f"databaseManager::_sketchIndex:{uuid} is a near duplicate of {other} (estimated Jaccard index {jaccard:.3f})")
+
+    def nearestGenomes(self, fasta: str, n: int = 5) -> List[Tuple[str, float]]:
+        """Indexed genomes closest to a fasta, by MinHash estimate of their sgRNA Jaccard index.
+        Sketch of the fasta genome is read from index database if it's already indexed, computed from its sgRNA otherwise.
+
+        :param fasta: Path to fasta file
+        :type fasta: str
+        :param n: number of genomes returned, defaults to 5
+        :type n: int, optional
+        :return: (uuid, estimated Jaccard index) by decreasing Jaccard index
+        :rtype: List[Tuple[str, float]]
+        """
+        if not self.indexdb:
+            raise error.IndexConnectionError("No index database specified in config")
+        genome = self.getGenomeEntity(self._fastaMd5(fasta))
+        uuid = genome._id if genome else None
+        if uuid and os.path.isfile(self.indexdb.sketchPath(uuid)):
+            sketch = indexDBHandler.readSketch(self.indexdb.sketchPath(uuid))[0]
+        else:
+            motifs = sgRNArecordsSearch(self._fastaRecords(fasta), uuid if uuid else "query")
+            sketch = sketchCodes(np.unique(encodeMotifs(list(motifs.keys()))))
+        return self.indexdb.nearest(sketch, n, exclude=uuid)
+
+    def setInvertedIndex(self, invertedFolder):
+        """Add each newly indexed genome to a local inverted index (sgRNA code -> genomes)"""
+        self.inverted = invertedHandler.connect(invertedFolder)
+        logging.info(f"Inverted index at {invertedFolder}, {len(self.inverted)} genomes")
+
+    def setFingerprintCache(self, fingerprintFile):
+        """Reuse fasta md5, sizes and headers of unchanged files from a local cache, and store new ones in it"""
+        self.fingerprints = fingerprintHandler.connect(fingerprintFile)
+        logging.info(f"Fasta fingerprint cache at {fingerprintFile}")
+
+    def isDone(self, fasta: str, stage: str) -> bool:
+        """Check in journal if an ingestion stage is already completed for fasta, always False when not resuming"""
+        if not (self.journal and self.resume):
+            return False
+        return self._journalIsDone(self._fastaMd5(fasta), stage)
+
+    def _journalIsDone(self, fasta_md5: str, stage: str) -> bool:
+        return bool(self.journal and self.resume and self.journal.isDone(fasta_md5, stage))
+
+    def _journalDone(self, fasta_md5: str, stage: str, uuid: str = None):
+        if self.journal:
+            self.journal.done(fasta_md5, stage, uuid)
+
     def getGenomeEntity(self, fastaMd5):#:str):
         return self.genomedb.get(fastaMd5)
 
+    def _readFasta(self, fasta: str) -> FastaDigest:
+        """md5, sizes and headers of fasta in a single streaming pass, kept for all stages. Sequences are not kept.
+        
+        :raises FileNotFoundError: Raise if fasta doesn't exist
+        """
+        digest = FastaDigest(fasta)
+        self._fastaSummaries[fasta] = digest
+        if self.fingerprints:
+            self.fingerprints.put(digest)
+        return digest
+
+    def _fastaSummary(self, fasta: str) -> FastaDigest:
+        """md5, sizes and headers of fasta, from fingerprint cache when file is unchanged, read once otherwise"""
+        if fasta in self._fastaSummaries:
+            return self._fastaSummaries[fasta]
+        if self.fingerprints:
+            summary = self.fingerprints.get(fasta)
+            if summary:
+                self._fastaSummaries[fasta] = summary
+                return summary
+        return self._readFasta(fasta)
+
+    def _fastaMd5(self, fasta: str) -> str:
+        return self._fastaSummary(fasta).md5
+
+    def _fastaRecords(self, fasta: str) -> FastaRecords:
+        """fasta records, streamed from file on each iteration"""
+        return FastaRecords(fasta)
+
     def addBlast(self, fastaList):
+        added = []
         for zFasta in fastaList:
-            fasta_md5 = fastaHash(zFasta)
+            fasta_md5 = self._fastaMd5(zFasta)
+            if self._journalIsDone(fasta_md5, "blast"):
+                logging.info(f"{zFasta} already in blast database according to journal")
+                continue
             genomElem = self.genomedb.get(fasta_md5)
-            for header, seq, _id  in zFastaReader(zFasta):
-                _header = f">{genomElem._id}|{header.replace(r'/^>//', '')}"
-                self.blastdb.add(_header, seq)
+            self.blastdb.appendFasta(zFasta, genomElem._id)
+            added.append( (fasta_md5, genomElem._id) )
         self.blastdb.close()
+        for fasta_md5, uuid in added:
+            self._journalDone(fasta_md5, "blast", uuid)
         
     def addGenome(self, fasta: str, name: str, taxid: int = None, gcf: str = None, acc: str = None):
         """
@@ -129,7 +326,7 @@ class DatabaseManager():
         logging.info(f"Add genome\nfasta : {fasta}\nname : {name}\ntaxid : {taxid}\ngcf: {gcf}\nacc: {acc}")
         fasta_name = fasta.split("/")[-1]
         try :
-            fasta_md5 = fastaHash(fasta)
+            fasta_md5 = self._fastaMd5(fasta)
         except FileNotFoundError:
             logging.error(f"Can't add your entry because fasta file is not found.")
             return    
@@ -193,21 +390,134 @@ class DatabaseManager():
 
         genome_return_status = genome_entity.store()
         taxon_return_status = taxon_entity.store()
+        if genome_return_status:
+            self._journalDone(fasta_md5, "genome", genome_entity._id)
 
         return genome_return_status
         
-    def bind(self, genome, taxon):
+    def addGenomes(self, genomeList: List[Tuple]) -> Dict[str, bool]:
+        """Batched version of addGenome for a whole slice of the genomes tsv. 
+        Genomes and taxons are resolved with a few $in mango queries, linked in memory with bind consistency rules 
+        and written with _bulk_docs. Entries rejected by addGenome are rejected the same way here.
+
+        :param genomeList: list of (fasta, name, taxid, gcf, acc) tuples
+        :type genomeList: List[Tuple]
+        :return: For each fasta, True if its genome document was written
+        :rtype: Dict[str, bool]
+        """
+        logging.info(f"Add {len(genomeList)} genomes in batch")
+        status = {}
+        entries = []
+        for (fasta, name, taxid, gcf, acc) in genomeList:
+            status[fasta] = False
+            try :
+                fasta_md5 = self._fastaMd5(fasta)
+            except FileNotFoundError:
+                logging.error(f"Can't add {fasta} because fasta file is not found.")
+                continue
+            entries.append( (fasta, fasta_md5, name, taxid, gcf, acc) )
+
+        genome_docs = self.genomedb.findByMd5([e[1] for e in entries])
+        taxid_docs = self.taxondb.findByTaxid([e[3] for e in entries if e[3]])
+        name_docs = self.taxondb.findByName([e[2] for e in entries if not e[3]])
+        fetched = {doc["_id"]: doc for docs_dict in (genome_docs, taxid_docs, name_docs) for docs in docs_dict.values() for doc in docs}
+        logging.info(f"{len(genome_docs)} fasta and {len(taxid_docs) + len(name_docs)} taxons already in database")
+
+        uuids = []
+        def next_uuid():
+            if not uuids:
+                uuids.extend(self.genomedb.generate_uuids(len(entries)))
+            return uuids.pop()
+
+        def staged_or(entity):
+            return staged.get(entity._id, entity) if entity else None
+
+        staged = {}
+        genome_fasta = {}
+        for (fasta, fasta_md5, name, taxid, gcf, acc) in entries:
+            logging.info(f"Add genome\nfasta : {fasta}\nname : {name}\ntaxid : {taxid}\ngcf: {gcf}\nacc: {acc}")
+            fasta_name = fasta.split("/")[-1]
+            try:
+                genome_entity = staged_or(self.genomedb.fromDocs(genome_docs.get(fasta_md5, []), gcf, acc))
+                taxon_docs = taxid_docs.get(taxid, []) if taxid else name_docs.get(name, [])
+                taxon_entity = staged_or(self.taxondb.fromDocs(taxon_docs, name, taxid))
+            except (error.DuplicateError, error.ConsistencyError) as e:
+                logging.error(f"Can't add your entry because {type(e).__name__}\nReason : \n{e}")
+                continue
+
+            if not genome_entity or not genome_entity.headers or not genome_entity.fasta_name:
+                try:
+                    size, headers = self._proceed_fasta(fasta)
+                except error.FastaHeaderConflict as e:
+                    logging.error(f"Can't add your entry because FastaHeaderConflict\n{e}")
+                    continue
+                if genome_entity:
+                    logging.warn(f"Your genome entry already exists but as old version (no headers and no fasta_name), the entry will be updated")
+                    genome_entity.update(headers = headers, fasta_name = fasta_name)
+                else:
+                    genome_entity = self.genomedb.createNewGenome(fasta_md5, size, headers, fasta_name, gcf, acc, next_uuid())
+
+            if not taxon_entity:
+                taxon_entity = self.taxondb.createNewTaxon(name, taxid, next_uuid())
+
+            try:
+                self.bind(genome_entity, taxon_entity, staged)
+            except (error.LinkError, error.VersionError) as e:
+                logging.error(f"Can't add your entry because {type(e).__name__}\nReason : \n{e}")
+                continue
+
+            # Later entries of the slice must see this one as stored
+            staged[genome_entity._id] = genome_entity
+            staged[taxon_entity._id] = taxon_entity
+            genome_fasta[genome_entity._id] = fasta
+            self._replaceDoc(genome_docs, fasta_md5, genome_entity.couchDoc)
+            if taxon_entity.taxid:
+                self._replaceDoc(taxid_docs, taxon_entity.taxid, taxon_entity.couchDoc)
+            self._replaceDoc(name_docs, taxon_entity.name, taxon_entity.couchDoc)
+
+        to_write = {"genome": [], "taxon": []}
+        for _id, entity in staged.items():
+            if _id in fetched and entity == type(entity)(entity.container, fetched[_id]):
+                logging.warn(f"Same document {_id} already exists in {entity.container.db_name}")
+                continue
+            to_write["genome" if _id in genome_fasta else "taxon"].append(entity)
+
+        for db, entities in ((self.genomedb, to_write["genome"]), (self.taxondb, to_write["taxon"])):
+            logging.info(f"Add {len(entities)} documents in {db.db_name}")
+            ok, err = db.bulk_add([entity.couchDoc for entity in entities])
+            for e in err:
+                logging.error(f"Can't write document {e['id']} in {db.db_name}\nReason : \n{e}")
+            if db is self.genomedb:
+                for o in ok:
+                    status[genome_fasta[o["id"]]] = True
+                    self._journalDone(self._fastaMd5(genome_fasta[o["id"]]), "genome", o["id"])
+
+        return status
+
+    def _replaceDoc(self, docs_dict, key, doc):
+        docs = [d for d in docs_dict.get(key, []) if d["_id"] != doc["_id"]]
+        docs_dict[key] = docs + [doc]
+
+    def _getTaxonFromID(self, _id, staged=None):
+        if staged and _id in staged:
+            return staged[_id]
+        return self.taxondb.getFromID(_id)
+
+    def bind(self, genome, taxon, staged=None):
         """Make the link between genome and taxon. Add genome uuid in taxon entry and taxon uuid in genome entry with consistency checks.
         
         :param genome: GenomeEntity that represents a genome couch entry
         :type genome: CSTB_database_manager.genome.GenomeEntity
         :param taxon: TaxonEntity that represents a taxon couch entry
         :type taxon: CSTB_database_manager.genome.TaxonEntity
+        :param staged: Entities already bound but not yet stored, considered as in database, defaults to None
+        :type staged: Dict -> {_id(str): Entity}, optional
         :raises error.VersionError: Raise if genome already exists as an older version of taxon. 
         :raises error.LinkError: Raise if links already exists and don't correspond.
         """
-        if genome.isInDB():
-            if taxon.isInDB():
+        staged = staged if staged else {}
+        if genome.isInDB() or genome._id in staged:
+            if taxon.isInDB() or taxon._id in staged:
                 if genome.taxon == taxon._id:
                     if taxon.current == genome._id:
                         logging.warn("Genome already exists as current version")
@@ -217,14 +527,14 @@ class DatabaseManager():
                         else:
                             raise error.LinkError("Taxon link in Genome but no Genome link in Taxon.")
                 else:
-                    current_taxon = self.taxondb.getFromID(genome.taxon)#Not really useful interrogation, just for print information
+                    current_taxon = self._getTaxonFromID(genome.taxon, staged)#Not really useful interrogation, just for print information
                     raise error.LinkError(f'Genome already exists but associated with an other Taxon (name : {current_taxon.name}, taxid : {current_taxon.taxid}). Update this taxon or delete genome if you really want to add it.')
                 
             else:
-                current_taxon = self.taxondb.getFromID(genome.taxon)#Not really useful interrogation, just for print information
+                current_taxon = self._getTaxonFromID(genome.taxon, staged)#Not really useful interrogation, just for print information
                 raise error.LinkError(f'Genome already exists but associated with an other Taxon (name : {current_taxon.name}, taxid : {current_taxon.taxid}). Update this taxon or delete genome if you really want to add it.')
         else:
-            if taxon.isInDB():
+            if taxon.isInDB() or taxon._id in staged:
                 logging.info(f'New genome version for Taxon (name: {taxon.name}, taxid {taxon.taxid}')
                 genome.taxon = taxon._id
                 taxon.current = genome._id
@@ -241,24 +551,12 @@ class DatabaseManager():
         
         :param fasta: Path to fasta file
         :type fasta: str
+        :raises error.FastaHeaderConflict: Raise if 2 fasta headers have same first word
         :return: 2 dictionnaries, first with size for each fasta subsequences and second with complete headers for each fasta subsequences
         """
-
-        dic_size = {}
-        dic_headers = {}
-
-        with zFile(fasta) as f: 
-            for l in f: 
-                if l.startswith('>'):
-                    ref = l.split(" ")[0].lstrip(">")
-                    complete_header = l.rstrip("\n").lstrip(">")
-                    if ref in dic_size:
-                        raise error.FastaHeaderConflict(f"Two fasta header have same first identifiant : {ref}. Change fasta headers to insert this genome.")
-                    dic_size[ref] = 0
-                    dic_headers[ref] = complete_header
-                else:
-                    dic_size[ref] += len(l.rstrip())           
-        return dic_size, dic_headers
+        digest = self._fastaSummary(fasta)
+        digest.checkHeaders()
+        return digest.size, digest.headers
 
     def _get_md5(self, fasta:str) -> str:
         hasher = hashlib.md5()
@@ -287,7 +585,7 @@ class DatabaseManager():
         """
         logging.info(f"= Remove genome\nfasta: {fasta}\n name : {name}\n taxid : {taxid}\n gcf : {gcf}\n acc : {acc}")
         try :
-            fasta_md5 = fastaHash(fasta)
+            fasta_md5 = self._fastaMd5(fasta)
         except FileNotFoundError:
             logging.error(f"Can't remove your entry because fasta file is not found.")
             return  
@@ -392,21 +690,259 @@ class DatabaseManager():
         tree_entity.store()
         
  
-    def addFastaMotifs(self, fastaFileList, batchSize=10000, indexLocation=None, cacheLocation=None):
-        for fastaFile in fastaFileList:
-            sgRNA_data, uuid, ans = self.addFastaMotif(fastaFile, batchSize)
-            if cacheLocation and not ans is None:
-                fPickle = cacheLocation + "/" + uuid + ".p"
-                pickle.dump(sgRNA_data, open(fPickle, "wb"), protocol=3)
-                logging.info(f"databaseManager::addFastaMotif:pickling of \"{len(sgRNA_data.keys())}\" sgnRNA motifs wrote to {fPickle}")
-       
-            if indexLocation:
-                indexLen = self.addIndexMotif(indexLocation, sgRNA_data, uuid)
-                logging.info(f"databaseManager::addFastaMotif:indexation of \"{indexLen}\" sgnRNA motifs wrote to {indexLocation}/{uuid}.index")
-       
+    def addFastaMotifs(self, fastaFileList, batchSize=10000, indexLocation=None, cacheLocation=None, jobs=1, stream=False, spillLocation=None, writers=1, sink=None):
+        """Compute sgRNA motifs of each fasta and insert them in motif, cache and index collections.
+        With more than one job, fasta are scanned by a pool of worker processes while the current process
+        uploads and writes results as they come, in fastaFileList order.
+        In stream mode, sgRNA are spilled on local disk by prefix instead of being gathered in a dictionnary, 
+        then uploaded, cached and indexed batch per batch.
+
+        :param fastaFileList: List of paths to fasta files
+        :type fastaFileList: List[str]
+        :param batchSize: Maximal number of keys in a couchDB volume collection insert
+        :type batchSize: int
+        :param indexLocation: folder where to write index files, defaults to None
+        :type indexLocation: str, optional
+        :param cacheLocation: folder of binary sgRNA caches, written after scan and read instead of scanning again, defaults to None
+        :type cacheLocation: str, optional
+        :param jobs: number of scanning processes, defaults to 1
+        :type jobs: int, optional
+        :param stream: bounded memory stream mode, defaults to False
+        :type stream: bool, optional
+        :param spillLocation: folder for stream mode temporary files, defaults to system temporary folder
+        :type spillLocation: str, optional
+        :param writers: number of volumes written simultaneously, defaults to 1
+        :type writers: int, optional
+        :param sink: callable receiving each sgRNA batch instead of motif collection insertion, see bulkBuildMotifs, defaults to None
+        :type sink: Callable, optional
+        """
+        stages = self._motifStages(indexLocation, cacheLocation)
+        todo = [ fastaFile for fastaFile in fastaFileList if not all(self.isDone(fastaFile, stage) for stage in stages) ]
+        if len(todo) < len(fastaFileList):
+            logging.info(f"databaseManager::addFastaMotifs:{len(fastaFileList) - len(todo)} fasta already done according to journal")
+        layout = f"{'stream' if stream else 'dict'}:{batchSize}"
+
+        toScan = []
+        for fastaFile in todo:
+            cache = self._openMotifCache(fastaFile, cacheLocation)
+            if not cache:
+                toScan.append(fastaFile)
+                continue
+            logging.info(f"databaseManager::addFastaMotifs:sgRNA motifs of {fastaFile} read from {cache.fCache}")
+            fasta_md5 = self._fastaMd5(fastaFile)
+            self._journalDone(fasta_md5, "cache", cache.uuid)
+            self._storeCachedMotifs(cache, batchSize, indexLocation, writers, fasta_md5, sink)
+            cache.close()
+
+        if jobs > 1:
+            scanned = self._scanFastaPool(toScan, jobs, stream, spillLocation)
+        else:
+            scanned = ( (fastaFile, *self._scanFasta(fastaFile, stream, spillLocation)) for fastaFile in toScan )
+
+        try:
+            for fastaFile, motifs, uuid in scanned:
+                try:
+                    batches = motifs.chunks(batchSize) if stream else sliceMotifs(motifs, batchSize)
+                    self._storeMotifBatches(batches, uuid, indexLocation, cacheLocation, writers, self._fastaMd5(fastaFile), layout, sink)
+                finally:
+                    if stream:
+                        motifs.close()
+        finally:
+            scanned.close()
+
+        if self.motifsdb and not sink:
+            self.motifsdb.throughputReport()
+        if self.inverted:
+            self.inverted.flush()
+
+    def bulkBuildMotifs(self, fastaFileList, workLocation=None, batchSize=10000, indexLocation=None, cacheLocation=None, jobs=1, stream=False, spillLocation=None, writers=1):
+        """Build motif volumes for many genomes at once, typically a release rebuild.
+        sgRNA of all fasta are routed to their volume and sorted on local disk, then each volume is loaded
+        in a single pass where every sgRNA document is written once with all its genomes, 
+        instead of one read-merge-write cycle per genome and sgRNA.
+        Cache and index collections are written during scan as with addFastaMotifs.
+
+        :param fastaFileList: List of paths to fasta files
+        :type fastaFileList: List[str]
+        :param workLocation: folder of sorted runs, needs room for all sgRNA locations, defaults to system temporary folder
+        :type workLocation: str, optional
+        :param batchSize: number of documents of a volume bulk insert, defaults to 10000
+        :type batchSize: int, optional
+        
+        Other parameters are the ones of addFastaMotifs.
+        """
+        if not self.motifsdb:
+            logging.error("databaseManager::bulkBuildMotifs:Bulk build requires mapping rules, see setMotifAgent")
+            return
+        stages = self._motifStages(indexLocation, cacheLocation)
+        todo = [ fastaFile for fastaFile in fastaFileList if not all(self.isDone(fastaFile, stage) for stage in stages) ]
+        runs = VolumeRuns(workLocation)
+        def sink(batch):
+            ranks = self.motifsdb.route(list(batch.keys())).tolist()
+            runs.add(batch, [ self.motifsdb._volumes[rank] if rank >= 0 else None for rank in ranks ])
+        try:
+            self.addFastaMotifs(todo, batchSize, indexLocation, cacheLocation, jobs, stream, spillLocation, writers, sink)
+            logging.info(f"databaseManager::bulkBuildMotifs:{runs.nb_hits} sgRNA locations of {len(todo)} fasta sorted in {runs.location}")
+            loaded = self.motifsdb.bulkLoad(runs, batchSize, writers)
+        finally:
+            runs.close()
+        failed = set().union(*( uuids for _, uuids in loaded.values() ))
+        if failed:
+            logging.error(f"databaseManager::bulkBuildMotifs:sgRNA documents of {len(failed)} genomes were not all written, their motifs stage is left undone")
+        for fastaFile in todo:
+            uuid = self._getFastaUuid(fastaFile)
+            if not uuid in failed:
+                self._journalDone(self._fastaMd5(fastaFile), "motifs", uuid)
+        self.motifsdb.throughputReport()
+
+    def _motifStages(self, indexLocation=None, cacheLocation=None):
+        stages = []
+        if self.motifsdb:
+            stages.append("motifs")
+        if cacheLocation:
+            stages.append("cache")
+        if indexLocation:
+            stages.append("index")
+        return stages
+
+    def _pendingMotifStages(self, fasta_md5, indexLocation=None, cacheLocation=None):
+        return [ stage for stage in self._motifStages(indexLocation, cacheLocation) if not self._journalIsDone(fasta_md5, stage) ]
+
+    def _openMotifCache(self, fastaFile, cacheLocation=None):
+        """Binary sgRNA cache of fasta genome, None if there is none"""
+        if not cacheLocation:
+            return None
+        fCache = f"{cacheLocation}/{self._getFastaUuid(fastaFile)}{CACHE_EXTENSION}"
+        if not os.path.isfile(fCache):
+            return None
+        try:
+            return MotifCache(fCache)
+        except ValueError as e:
+            logging.warn(f"databaseManager::_openMotifCache:{e}, sgRNA motifs will be computed again")
+            return None
+
+    def _storeCachedMotifs(self, cache, batchSize, indexLocation=None, writers=1, fasta_md5=None, sink=None):
+        """Insert and index sgRNA of a binary cache, without fasta scan. 
+        Index is read straight from cache codes when there is nothing to insert.
+        """
+        stages = self._pendingMotifStages(fasta_md5, indexLocation)
+        if "motifs" in stages:
+            self._storeMotifBatches(cache.chunks(batchSize), cache.uuid, indexLocation, None, writers, fasta_md5, f"cache:{batchSize}", sink)
+        elif "index" in stages:
+            self._writeMotifIndex([(cache.codes, cache.occurences())], len(cache), cache.wLen, cache.uuid, indexLocation, fasta_md5)
+
+    def _storeMotifBatches(self, batches, uuid, indexLocation=None, cacheLocation=None, writers=1, fasta_md5=None, layout=None, sink=None):
+        """Insert each sgRNA batch in motif collection and binary cache, and gather their index. 
+        Cache hits and index codes are sorted by runs on disk, so memory is bounded by batch size and not genome size.
+        Stages and motif batches already done according to journal are skipped.
+        With a sink, batches are handed to it instead of being inserted, motifs stage is then left to the caller.
+        """
+        stages = self._pendingMotifStages(fasta_md5, indexLocation, cacheLocation)
+        upload = "motifs" in stages and sink is None
+        if not self.motifsdb:
+            logging.warn(f"databaseManager::addFastaMotif:Without mapping rules, computed sgRNA motifs of {uuid} will not be inserted into database")
+        lastBatch = self.journal.lastBatch(fasta_md5, layout) if upload and self.journal and self.resume else -1
+        if lastBatch >= 0:
+            logging.info(f"databaseManager::addFastaMotif:Resuming {uuid} motifs insertion after batch {lastBatch}")
+        cacheWriter = MotifCacheWriter(f"{cacheLocation}/{uuid}{CACHE_EXTENSION}", uuid) if "cache" in stages else None
+        indexRuns = SortedRuns([np.uint64, np.uint32], indexLocation) if "index" in stages else None
+        wLen = None
+        try:
+            for rank, batch in enumerate(batches):
+                if upload and rank > lastBatch:
+                    logging.info(f"databaseManager::addFastaMotif:Attempting to insert {len(batch)} sets sgRNA keys")
+                    failed = sum( len(keys) for _, keys in self.motifsdb.insert(batch, writers).values() )
+                    if failed:
+                        logging.error(f"databaseManager::addFastaMotif:{failed} sgRNA of {uuid} batch {rank} were not inserted, following batches are skipped and motifs stage is left undone")
+                        upload = False
+                    elif self.journal:
+                        self.journal.ackBatch(fasta_md5, layout, rank)
+                if sink and "motifs" in stages:
+                    sink(batch)
+                if cacheWriter:
+                    cacheWriter.add(batch)
+                if indexRuns and batch:
+                    wLen = len(next(iter(batch)))
+                    indexRuns.add(*motifsIndex(batch))
+
+            if upload:
+                self._journalDone(fasta_md5, "motifs", uuid)
+
+            if cacheWriter:
+                nbMotifs = cacheWriter.close()
+                self._journalDone(fasta_md5, "cache", uuid)
+                logging.info(f"databaseManager::addFastaMotif:caching of \"{nbMotifs}\" sgnRNA motifs wrote to {cacheWriter.fCache}")
+
+            if indexRuns:
+                # sgRNA lie in a single batch, so codes are unique across runs
+                self._writeMotifIndex(indexRuns.merged(), indexRuns.size, wLen, uuid, indexLocation, fasta_md5)
+        finally:
+            if cacheWriter:
+                cacheWriter.discard()
+            if indexRuns:
+                indexRuns.close()
+
+    def _writeMotifIndex(self, indexChunks, nbCodes, wLen, uuid, indexLocation, fasta_md5=None):
+        if not nbCodes:
+            logging.warn(f"databaseManager::addFastaMotif:No sgRNA motifs to index for {uuid}")
+            return
+        indexLen, fIndex = self._sgRNAIndexWriter(indexChunks, nbCodes, indexLocation, uuid, wLen)
+        self._journalDone(fasta_md5, "index", uuid)
+        logging.info(f"databaseManager::addFastaMotif:indexation of \"{indexLen}\" sgnRNA motifs wrote to {fIndex}")
+
+    def _getFastaUuid(self, fastaFile):
+        fasta_md5 = self._fastaMd5(fastaFile)
+        if self.journal and self.journal.uuid(fasta_md5):
+            return self.journal.uuid(fasta_md5)
+        genomeEntity = self.getGenomeEntity(fasta_md5)
+        if not genomeEntity:
+            raise error.NoGenomeEntity(fastaFile)
+        return genomeEntity._id
+
+    def _scanFasta(self, fastaFile, stream=False, spillLocation=None):
+        uuid = self._getFastaUuid(fastaFile)
+        if stream:
+            return (spillRecords(self._fastaRecords(fastaFile), uuid, spillLocation), uuid)
+        return (sgRNArecordsSearch(self._fastaRecords(fastaFile), uuid), uuid)
+
+    def _scanFastaPool(self, fastaFileList, jobs, stream=False, spillLocation=None):
+        """Scan fasta files in a pool of worker processes. 
+        Genome uuids are resolved in current process. At most 2 * jobs scans are pending or waiting to be consumed,
+        so only a bounded number of sgRNA dictionnaries (or spills in stream mode) are held.
+
+        :return: generator of (fastaFile, sgRNA_data or MotifSpill, uuid), in fastaFileList order
+        """
+        maxPending = 2 * jobs
+        logging.info(f"databaseManager::_scanFastaPool:Scanning {len(fastaFileList)} fasta with {jobs} processes")
+        pending = deque()
+        try:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                fastaIter = iter(fastaFileList)
+                while True:
+                    while len(pending) < maxPending:
+                        fastaFile = next(fastaIter, None)
+                        if fastaFile is None:
+                            break
+                        uuid = self._getFastaUuid(fastaFile)
+                        pending.append( (fastaFile, uuid, executor.submit(_searchFasta, fastaFile, uuid, stream, spillLocation)) )
+                    if not pending:
+                        break
+                    fastaFile, uuid, future = pending.popleft()
+                    yield (fastaFile, future.result(), uuid)
+        finally:
+            # spills of scans never consumed, when the consumer stopped on error
+            if stream:
+                for _, _, future in pending:
+                    if not future.cancelled() and future.exception() is None:
+                        future.result().close()
+
     def addIndexMotif(self, location, sgnRNAdata, uuid):
         indexData, wLen = computeMotifsIndex(sgnRNAdata)
-        dataLen = sgRNAIndexWriter(indexData, f"{location}/{uuid}.index", wLen, getEncoding()[0])
+        codes = np.fromiter((datum[0] for datum in indexData), dtype=np.uint64, count=len(indexData))
+        counts = np.fromiter((datum[1] for datum in indexData), dtype=np.uint32, count=len(indexData))
+        dataLen, _ = self._sgRNAIndexWriter([(codes, counts)], len(indexData), location, uuid, wLen)
+        if self.inverted:
+            self.inverted.flush()
         #with open (location + '/' + uuid + '.index', 'w') as fp:
         #    fp.write(str(len(indexData)) + "\n")
         #    for datum in indexData:
@@ -414,27 +950,22 @@ class DatabaseManager():
         return dataLen
 
     def addFastaMotif(self, fastaFile, batchSize):   
-        fasta_md5 = fastaHash(fastaFile)
-        genomeEntity = self.getGenomeEntity(fasta_md5)
-        if not genomeEntity:
-            raise error.NoGenomeEntity(fastaFile)
-        uuid = genomeEntity._id
-        sgRNA_data = sgRNAfastaSearch(fastaFile, uuid)
+        sgRNA_data, uuid = self._scanFasta(fastaFile)
+        r = self.addMotifs(sgRNA_data, uuid, batchSize)
+        return (sgRNA_data, uuid, r)
+
+    def addMotifs(self, sgRNA_data, uuid, batchSize, writers=1):
         allKeys = list(sgRNA_data.keys())
-        if not self.wrapper.hasKeyMappingRules:
+        if not self.motifsdb:
             logging.warn(f"databaseManager::addFastaMotif:Without mapping rules, {len(allKeys)} computed sgRNA motifs will not be inserted into database")
-            return (sgRNA_data, uuid, None)
+            return None
         
-        logging.info(f"databaseManager::addFastaMotif:Slicing \"{uuid}\" to volDocAdd its {len(allKeys)} genomic sgRNA motif")       
-        for i in range(0,len(allKeys), batchSize):
-          
-            j = i + batchSize if i + batchSize < len(allKeys) else len(allKeys)
-            legit_keys = allKeys[i:j]
-            d = { k : sgRNA_data[k] for k in legit_keys }
-            logging.info(f"databaseManager::addFastaMotif:Attempting to volDocAdd {len(d.keys())} sets sgRNA keys")
-       
-            r = self.wrapper.volDocAdd(d)
-        return (sgRNA_data, uuid, r)
+        logging.info(f"databaseManager::addFastaMotif:Slicing \"{uuid}\" to insert its {len(allKeys)} genomic sgRNA motif")       
+        r = None
+        for d in sliceMotifs(sgRNA_data, batchSize):
+            logging.info(f"databaseManager::addFastaMotif:Attempting to insert {len(d.keys())} sets sgRNA keys")
+            r = self.motifsdb.insert(d, writers)
+        return r
     
     def addHeadersAndFastaName(self, fasta, gcf = None, acc = None):
         """Create for hack update to v2 format. Will update entries in genome collection to add fasta complete headers and fasta name.
@@ -448,7 +979,7 @@ class DatabaseManager():
         """
         fasta_name = fasta.split("/")[-1]
         try :
-            fasta_md5 = fastaHash(fasta)
+            fasta_md5 = self._fastaMd5(fasta)
         except FileNotFoundError:
             logging.error(f"Can't add your entry because fasta file is not found.")
             return       
@@ -556,54 +1087,132 @@ class DatabaseManager():
         return in_db1, in_db2
 
     def removeFromBlast(self, fastaList: List[str]):
-        """Remove entries from blast database from fasta files
+        """Remove entries from blast database from fasta files, genomes are looked up by fasta hash
         
         :param fastaList: List of paths to fasta files
         :type fastaList: List[str]
         """
-        logging.info("Remove from Blast database")
-        self.blastdb.set_remove_mode(True)
+        uuids = []
         for zFasta in fastaList:
-            fasta_md5 = fastaHash(zFasta)
+            fasta_md5 = self._fastaMd5(zFasta)
             genomElem = self.genomedb.get(fasta_md5)
             if not genomElem:
                 logging.error(f"{zFasta} is not stored in genome database")
-                return
-            for header, seq, _id  in zFastaReader(zFasta):
-                _header = f">{genomElem._id}|{header.replace(r'/^>//', '')}"
-                self.blastdb.remove(_header, seq)
-        self.blastdb.close()
-
-    def getEncodedSgrnaWithGenomes(self):
-        motif_dic = {}
-        similarity_dic = {}
-        for index in list(self.indexdb.all_ids)[:100]:
-            f = open(self.indexdb.database_folder + "/" + index + ".index")
-            f.readline()
-            for l in f:
-                motif = int(l.split()[0])
-                if not motif in motif_dic:
-                    motif_dic[motif] = [motif]
-                else:
-                    for already_present_uuid in motif_dic[motif]:
-                        pair = (motif, already_present_uuid)
-                        if not pair in similarity_dic:
-                            similarity_dic[pair] = 1
-                        similarity_dic[pair] += 1
-            f.close()
-
-        return motif_dic, similarity_dic
-
-
-
-
-
-
-
-
+                continue
+            uuids.append(genomElem._id)
+        self.removeGenomesFromBlast(uuids)
 
+    def removeGenomesFromBlast(self, uuids: List[str]) -> int:
+        """Remove all records of genomes from blast database, by genome uuid. Genome fasta are not needed.
 
+        :param uuids: genomes uuids
+        :type uuids: List[str]
+        :return: number of records removed
+        :rtype: int
+        """
+        logging.info("Remove from Blast database")
+        removed = self.blastdb.removeGenomes(uuids)
+        self.blastdb.close()
+        logging.info(f"{removed} records of {len(uuids)} genomes removed from blast database")
+        return removed
 
-        
-        
+    def removeFromInvertedIndex(self, uuids: List[str]) -> int:
+        """Remove genomes from local inverted index, see setInvertedIndex
 
+        :param uuids: genomes uuids
+        :type uuids: List[str]
+        :return: number of genomes removed
+        :rtype: int
+        """
+        if not self.inverted:
+            logging.error("databaseManager::removeFromInvertedIndex:No inverted index specified, see setInvertedIndex")
+            return 0
+        removed = self.inverted.remove(uuids)
+        logging.info(f"{removed} of {len(uuids)} genomes removed from inverted index")
+        return removed
+
+    def removeFromMotifs(self, uuids: List[str], indexLocation: str = None, cacheLocation: str = None, writers: int = 1, batchSize: int = 2000) -> Dict[str, Tuple[int, int, List[str]]]:
+        """Remove genomes from motif collection. sgRNA keys of each genome are read from its binary sgRNA cache
+        or its index file, so only the documents of these keys are read and rewritten, volume by volume.
+
+        :param uuids: genomes uuids
+        :type uuids: List[str]
+        :param indexLocation: folder of index files, defaults to index database folder
+        :type indexLocation: str, optional
+        :param cacheLocation: folder of binary sgRNA caches, looked up before index files, defaults to None
+        :type cacheLocation: str, optional
+        :param writers: number of volumes processed simultaneously, defaults to 1
+        :type writers: int, optional
+        :param batchSize: number of keys by request, defaults to 2000
+        :type batchSize: int, optional
+        :return: number of updated and deleted documents, and keys of documents still carrying removed genomes, by volume
+        :rtype: Dict[str, Tuple[int, int, List[str]]]
+        """
+        if not self.motifsdb:
+            logging.error("databaseManager::removeFromMotifs:Motif removal requires mapping rules, see setMotifAgent")
+            return {}
+        codes = {}
+        found = {}
+        for uuid in uuids:
+            motifCodes = self._motifCodes(uuid, indexLocation, cacheLocation)
+            if motifCodes is None:
+                logging.error(f"databaseManager::removeFromMotifs:No sgRNA cache nor index file for {uuid}, it is left in motif collection")
+                continue
+            wLen, genomeCodes = motifCodes
+            codes.setdefault(wLen, []).append(genomeCodes)
+            found[uuid] = motifCodes
+        if not found:
+            return {}
+        keys = []
+        for wLen, arrays in codes.items():
+            keys += decodeMotifs(np.unique(np.concatenate(arrays)), wLen)
+        logging.info(f"databaseManager::removeFromMotifs:Removing {len(found)} genomes from {len(keys)} sgRNA documents")
+        stats = self.motifsdb.remove(keys, list(found), writers, batchSize)
+        logging.info(f"databaseManager::removeFromMotifs:{sum(s[0] for s in stats.values())} documents updated, {sum(s[1] for s in stats.values())} deleted")
+        unremoved = [ key for s in stats.values() for key in s[2] ]
+        if unremoved:
+            unremovedCodes = { wLen: encodeMotifs([ key for key in unremoved if len(key) == wLen ]) for wLen in codes }
+            for uuid, (wLen, genomeCodes) in found.items():
+                nb = int(np.isin(genomeCodes, unremovedCodes[wLen]).sum())
+                if nb:
+                    logging.error(f"databaseManager::removeFromMotifs:{uuid} is left in {nb} sgRNA documents that could not be rewritten")
+        return stats
+
+    def _motifCodes(self, uuid, indexLocation=None, cacheLocation=None):
+        """sgRNA length and twobits codes of a genome, from its binary cache or its index file, None if there is neither"""
+        fCache = f"{cacheLocation}/{uuid}{CACHE_EXTENSION}" if cacheLocation else None
+        if fCache and os.path.isfile(fCache):
+            cache = MotifCache(fCache)
+            motifCodes = (cache.wLen, np.array(cache.codes))
+            cache.close()
+            return motifCodes
+        indexdb = self._indexFolder(indexLocation) if indexLocation else self.indexdb
+        if not indexdb:
+            return None
+        try:
+            with indexdb.open(uuid) as index:
+                if index.codec != "twobits":
+                    raise ValueError(f"Can't decode sgRNA of {index.fname}, {index.codec} encoded")
+                return index.wLen, np.array(index.codes)
+        except FileNotFoundError:
+            return None
+
+    def sharedSgrnaMatrix(self, outDir: str, jobs: int = 1, blockSize: int = 256, uuids: List[str] = None, jaccard: bool = True) -> Dict[str, str]:
+        """Compute genome by genome shared sgRNA count and Jaccard matrices over the whole index database, see engine.similarity
+
+        :param outDir: folder to write matrices in
+        :type outDir: str
+        :param jobs: number of worker processes, defaults to 1
+        :type jobs: int, optional
+        :param blockSize: number of genomes by block side, defaults to 256
+        :type blockSize: int, optional
+        :param uuids: genomes to compare, defaults to all indexed genomes
+        :type uuids: List[str], optional
+        :param jaccard: also write Jaccard index matrix, defaults to True
+        :type jaccard: bool, optional
+        :return: path of written files
+        :rtype: Dict[str, str]
+        """
+        if not self.indexdb:
+            raise error.IndexConnectionError("No index database specified in config")
+        return sharedSgrnaMatrix(self.indexdb, outDir, uuids, jobs, blockSize, jaccard)
@@ -1,42 +1,94 @@
 import CSTB_database_manager.utils.error as error
-from CSTB_core.utils.io import Zfile as zFile
 
 from CSTB_core.utils.io import hashStripedString as hashSequence
-from CSTB_core.utils.io import fileHash
-import os, glob, re, pickle
+import os, glob, re, shutil, fcntl
 from CSTB_core.utils.io import which
-from CSTB_core.utils.io import gunzipToFile as gunzip
-from CSTB_core.utils.io import fileToGunzip as gzip
-from CSTB_core.utils.io import zFastaReader
-
-from subprocess import check_call
+import CSTB_database_manager.db.blast_registry as blastRegistry
+import CSTB_database_manager.db.blast_blocks as blastBlocks
+from CSTB_database_manager.engine.fasta_reader import WHITESPACES
+from gzip import open as gzOpen
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from subprocess import check_call, Popen, PIPE, CalledProcessError
 import logging
+from typing import List
 
 MAX_COUNT=25
+# Block size of the streaming multifasta rewrite on removal
+COPY_BUFFER = 16 * 1024 * 1024
+# Multifasta size above which the open shard is closed and new records go to a new shard,
+# under makeblastdb default maximal volume size so that a shard makes a single blast volume
+SHARD_SIZE = 1024 * 1024 * 1024
+# Number of shards formatted simultaneously, one makeblastdb process each
+FORMAT_JOBS = 4
+# Lock file of a blast database, shared while it is indexed, exclusive from first write to close
+LOCK_EXTENSION = ".lock"
+# Subfolder of blast database holding the staging fragments of parallel jobs
+STAGING_FOLDER = "staging"
+# Marker file of a staging fragment closed by its job, only completed fragments are merged
+DONE_EXTENSION = ".done"
+# Blast database files of a formatted shard or of the former single multifasta layout
+BLAST_EXTENSIONS = ['nhr', 'nin', 'nsq', 'nal', 'ndb', 'nos', 'not', 'ntf', 'nto', 'njs', 'nog', 'nsd', 'nsi', 'nhd', 'nhi', 'nnd', 'nni', 'pkl']
+
+def _copyRange(fin, fout, offset: int, length: int):
+    """Copy length bytes of fin from offset to fout, by COPY_BUFFER blocks"""
+    fin.seek(offset)
+    while length > 0:
+        block = fin.read(min(COPY_BUFFER, length))
+        if not block:
+            raise EOFError(f"{fin.name} ends before byte {offset + length}")
+        fout.write(block)
+        length -= len(block)
 
 # check formatdb availability
-def connect(blastFolder):
+def connect(blastFolder, jobs=FORMAT_JOBS, compressed=False):
     if not which("makeblastdb"):
         raise error.BlastConnectionError("Executable makeblastdb is missing")
     if not os.path.isdir(blastFolder):
         raise error.BlastConnectionError("Blast directory doesn't exist.")
-    return BlastDB(blastFolder)
+    return BlastDB(blastFolder, compressed=compressed, jobs=jobs)
+
+def stage(blastFolder, name):
+    """Private staging fragment of a blast database, for a job running in parallel with others.
+    Fragment records are folded into the database by BlastDB.merge once the job has closed it.
+    """
+    if not os.path.isdir(blastFolder):
+        raise error.BlastConnectionError("Blast directory doesn't exist.")
+    fragmentFolder = f"{blastFolder}/{STAGING_FOLDER}/{name}"
+    os.makedirs(fragmentFolder, exist_ok=True)
+    return BlastDB(fragmentFolder, staging=True)
 
 class WritingBuffer():
-    def __init__(self, fasta_file, data, remove_mode = False, max_buffer = 1000):
+    def __init__(self, fasta_file, data, remove_mode = False, max_buffer = 1000, roll = None, opener = None):
         self.remove_mode = remove_mode
         self.max_buffer = max_buffer
         self.nb_append = 0
         self.writing_mode = "w" if remove_mode else "a"
         self.initial_file = fasta_file
         self.writing_file = fasta_file + ".tmp" if remove_mode else fasta_file
+        # called before each write, returns open shard multifasta, a new one once current is full
+        self.roll = roll
+        # opens multifasta for binary writing, with "a" or "w" mode
+        self.opener = opener if opener else lambda fasta, mode: open(fasta, mode + "b")
         self._buffer = []
+        self._keys = set()
+        self._ranges = []
         self._real_len = 0
         self.data = data
-        
+
+    @property
+    def shard(self):
+        return re.sub(r"\.mfasta(\.gz)?$", "", os.path.basename(self.initial_file))
+
+    def set_file(self, fasta_file):
+        self.initial_file = fasta_file
+        self.writing_file = fasta_file + ".tmp" if self.remove_mode else fasta_file
+
     def append(self, append_elmt):
-        self.nb_append += 1 
+        self.nb_append += 1
         self._buffer.append(append_elmt)
+        self._keys.add(append_elmt[2])
         self._real_len += 1
         if self.nb_append >= self.max_buffer:
             self.write_buffer()
@@ -45,24 +97,30 @@ class WritingBuffer():
 
     def write_buffer(self):
         logging.info(f"Write {len(self)} seq")
-        with open(self.writing_file, self.writing_mode) as handle:
+        if self._buffer and self.roll and not self.remove_mode:
+            self.set_file(self.roll())
+        self._ranges = []
+        with self.opener(self.writing_file, self.writing_mode) as handle:
+            offset = handle.tell()
             for t in self._buffer:
-                handle.write(t[0] + '\n')
-                handle.write(t[1] + '\n')
-        
+                record = (t[0] + '\n' + t[1] + '\n').encode()
+                handle.write(record)
+                self._ranges.append( (offset, len(record)) )
+                offset += len(record)
+
     def reinit_buffer(self):
         self.writing_mode = "a"
         self.nb_append = 0
         self._buffer = []
+        self._keys = set()
 
     def update_index(self):
-        for header, seq, hKey in self._buffer:
-            self.data[hKey] = header
+        self.data.add( (hKey, header, self.shard, offset, length) for (header, seq, hKey), (offset, length) in zip(self._buffer, self._ranges) )
 
     def replace_tmp_file(self):
         logging.info("Replace tmp file")
         os.replace(self.writing_file, self.initial_file)
-    
+
     def close(self):
         self.write_buffer()
         self.update_index()
@@ -80,58 +138,139 @@ class WritingBuffer():
             self.writing_mode = "a"
             self.writing_file = self.initial_file
 
+    def __contains__(self, hashKey):
+        """hashKey is buffered and not yet written"""
+        return hashKey in self._keys
+
     def __len__(self):
         return self._real_len
 
 class BlastDB ():
-    def __init__(self, blastFolder, compressed=False):
+    """Blast database of all genomes, made of shards : multifasta <tag>_<NNNN>.mfasta, each formatted
+    on its own with makeblastdb, and tied together by <tag>.nal alias file, so blast runs against <tag>.
+    Records are appended to the last (open) shard, which is closed once above SHARD_SIZE.
+    On close, only shards whose multifasta changed since they were last formatted are formatted again, in parallel.
+    A database of former single multifasta layout (<tag>.mfasta formatted as <tag>) is read as is,
+    and turned into first shard of a sharded layout on first write.
+    Compressed shards <tag>_<NNNN>.mfasta.gz are block compressed, see blast_blocks : records are appended as new blocks,
+    removals recompress only the blocks they overlap, and records are read from their blocks.
+    Database is locked with flock on <tag>.lock, shared while it is indexed on opening, exclusive from first write to close,
+    so concurrent writers are serialized. A database opened while a writer holds it is not indexed and its registry
+    is read as is, so readers never wait, writers index it again once they get the lock. A staging fragment (see stage) is a database of its own, exclusively locked
+    by its job from opening to close and never formatted. It is marked as completed (<tag>.done) by a successful close,
+    merge folds completed fragments into the database.
+    """
+    def __init__(self, blastFolder, compressed=False, jobs=FORMAT_JOBS, staging=False):
         print("==== BLAST DB INIT")
-        self.fastaAsArchive = compressed # By Default we will reject fasta under gz b/c I/O too slow        
+        self.fastaAsArchive = compressed # By Default we will reject fasta under gz b/c I/O too slow
         self.location = blastFolder
-        self.registry = self._parsingDatabase()
-        self.max_buffer = 100
-        if self.empty:
-            logging.warn(f"Database {self.tag} seems empty")
-            self.data = {}
-            self.checksum = None
+        self.jobs = jobs
+        self.staging = staging
+        self.tag = self._getTag()
+        self._dirty = {}
+        self._lockHandle = None
+        self._writing = False
+        if staging:
+            try:
+                self._lock(fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise error.BlastConnectionError(f"Staging fragment {self.location} is used by another job")
         else:
-            logging.info(f"blastdb::_parsingDatabase:Computing checksum for {self.fastaFile}...")
-            self.checksum = os.path.getsize(self.fastaFile)
-            self.data = self._index()
-            if not self.data:
-                raise error.BlastConnectionError("indexing Error")
+            try:
+                self._lock(fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._unlock()
+        try:
+            self.registry = self._parsingDatabase()
+            self.max_buffer = 100
+            self.data = blastRegistry.connect(f"{self.location}/{self.tag}{blastRegistry.REGISTRY_EXTENSION}")
+            if self._lockHandle is None:
+                # a writer holds the database, its registry is consistent with shards again once it's closed
+                logging.warn(f"blastDB::__init__:{self.tag} is being written by another job, records registry is read as is, without checking shards")
+            elif self.empty:
+                logging.warn(f"Database {self.tag} seems empty")
+                self.data.clear()
+            else:
+                self._index()
+                if not len(self.data):
+                    raise error.BlastConnectionError("indexing Error")
+        except BaseException:
+            self._unlock()
+            raise
+        if not staging:
+            self._unlock()
 
         self._buffer = self._create_writing_buffer()
         self._delete_buffer = []
-        
-        
+        self._appended = 0
+
+
     @property
     def empty(self):
-        for k in self.registry:
-            if k == 'build':
-                continue
-            if self.registry[k]:
-                return False
-        return True
+        return not self.shards
+
+    @property
+    def legacy(self):
+        """Database of former single multifasta layout"""
+        return self.shards == [self.tag]
 
     @property
     def all_ids(self):
-        return set([header.split("|")[0].lstrip(">") for header in self.data.values()])
+        return self.data.uuids()
+
+    def _lock(self, operation: int):
+        if self._lockHandle is None:
+            self._lockHandle = open(f"{self.location}/{self.tag}{LOCK_EXTENSION}", "a")
+        fcntl.flock(self._lockHandle, operation)
+
+    def _unlock(self):
+        if self._lockHandle is None:
+            return
+        fcntl.flock(self._lockHandle, fcntl.LOCK_UN)
+        self._lockHandle.close()
+        self._lockHandle = None
+
+    @property
+    def _doneFile(self):
+        return f"{self.location}/{self.tag}{DONE_EXTENSION}"
+
+    @property
+    def completed(self) -> bool:
+        """Staging fragment closed by its job"""
+        return os.path.isfile(self._doneFile)
+
+    def _prepareWrite(self):
+        """Lock database until close before its first write. As other writers may have changed it while
+        it was not locked, shards are listed and checked against registry again.
+        """
+        if self._writing:
+            return
+        self._writing = True
+        if self.staging:
+            # fragment is not complete any more until closed again
+            if os.path.isfile(self._doneFile):
+                os.remove(self._doneFile)
+            return
+        self._lock(fcntl.LOCK_EX)
+        self.registry = self._parsingDatabase()
+        self._index()
+        if not self.shards:
+            self.shards = [self._shardName(0)]
+            self.fastaFile = self._shardFasta(self.shards[-1])
+        self.fastaBufferFile = self.fastaFile
+        self._buffer.set_file(self.fastaBufferFile)
+        if self.legacy:
+            self._migrate()
 
     def set_remove_mode(self, b):
-        self._buffer.set_remove_mode(b)
-    
-    def _indexDump(self):    
-        fDump = f"{self.location}/{self.tag}.pkl"
-        _ = {
-            'checksum' : self.checksum,
-            'data' : self.data
-        }
-        pickle.dump( _, open( fDump, "wb" ) )
-        return fDump
+        """Kept for compatibility, removed records are now dropped in a single pass on close, whatever the mode"""
+        if type(b) != bool:
+            raise Exception("bool is needed for set_remove_mode")
+
     # Enforcing naming convention
     def _parsingDatabase(self):
         self.tag = self._getTag()
+        self.shards = self._getShards()
         self.fastaFile = self._getFasta()
         _  = self._setRegistry()
         return _
@@ -140,31 +279,69 @@ class BlastDB ():
         print("=== Create writing buffer")
         self.fastaBufferFile = None
         # No previous fasta record
-        if not self.fastaFile:           
-            self.fastaBufferFile = f"{self.location}/{self.tag}.mfasta"
+        if not self.fastaFile:
+            self.shards = [self._shardName(0)]
+            self.fastaBufferFile = self._shardFasta(self.shards[-1])
             self.fastaFile =  self.fastaBufferFile
-        # Previous record is ziped
-        elif self.fastaAsArchive :
-            self.fastaBufferFile = gunzip(self.fastaFile)
-        # Previous record is flat
+        # Previous record is flat or block compressed, former gzipped multifasta is recompressed on first write
         else :
             self.fastaBufferFile = self.fastaFile
 
-        return WritingBuffer(self.fastaBufferFile, self.data)
+        return WritingBuffer(self.fastaBufferFile, self.data, roll = self._rollShard, opener = self._openShard)
 
 
     def _getTag(self):
         return os.path.basename(self.location)
 
     def hasTag(self, filePath):
-        _  = os.path.basename(filePath)        
+        _  = os.path.basename(filePath)
         return re.match(f"{self.tag}(\.[\d]+)")
 
-    def _getFasta(self):
+    def _shardName(self, rank: int) -> str:
+        return f"{self.tag}_{rank:04d}"
+
+    def _shardFasta(self, shard: str) -> str:
+        return f"{self.location}/{shard}.mfasta" + (".gz" if self.fastaAsArchive else "")
+
+    def _shardFile(self, shard: str) -> str:
+        """Multifasta of a shard, including the one of single multifasta layout"""
+        if shard == self.tag:
+            return self.fastaFile
+        return self._shardFasta(shard)
+
+    def _shardSize(self, shard: str) -> int:
+        """Uncompressed size of a shard multifasta"""
+        if self.fastaAsArchive:
+            return self.data.blockEnd(shard)[1]
+        fasta = self._shardFasta(shard)
+        return os.path.getsize(fasta) if os.path.isfile(fasta) else 0
+
+    def _openShard(self, fasta: str, mode: str = "a"):
+        """Binary writer of a shard multifasta, block compressed one if database is compressed"""
+        shard = re.sub(r"\.mfasta(\.gz)?(\.tmp)?$", "", os.path.basename(fasta))
+        self._markDirty(shard, os.path.getsize(fasta) if mode == "a" and os.path.isfile(fasta) else 0)
+        if self.fastaAsArchive:
+            return blastBlocks.BlockWriter(fasta, self.data, shard, mode)
+        return open(fasta, mode + "b")
+
+    def _getShards(self):
+        shardFiles = glob.glob(f"{self.location}/{self.tag}_[0-9][0-9][0-9][0-9].mfasta*")
+        compressed = set( f.endswith(".gz") for f in shardFiles if re.search(r"\.mfasta(\.gz)?$", f) )
+        if len(compressed) > 1:
+            raise error.BlastConnectionError(f"Both compressed and flat shards found in {self.location}")
+        if compressed and compressed.pop() != self.fastaAsArchive:
+            self.fastaAsArchive = not self.fastaAsArchive
+            logging.warn(f"blastdb::_getShards:shards of {self.tag} are {'' if self.fastaAsArchive else 'not '}compressed, they are kept so")
+        shards = sorted( re.sub(r"\.mfasta(\.gz)?$", "", os.path.basename(f)) for f in shardFiles if re.search(r"\.mfasta(\.gz)?$", f) )
+        if shards:
+            return shards
+        return [self.tag] if self._getLegacyFasta() else []
+
+    def _getLegacyFasta(self):
         fastaName = f"{self.location}/*.mfasta"
         if self.fastaAsArchive:
             fastaName += ".gz"
-        fastaFile = [ f for f in glob.glob(fastaName) ]
+        fastaFile = [ f for f in glob.glob(fastaName) if not re.search(rf'/{self.tag}_\d{{4}}\.mfasta(\.gz)?$', f) ]
         if len(fastaFile) > 1:
             msg = (
                 f"Unexpected  number of "
@@ -172,54 +349,72 @@ class BlastDB ():
                 f"({len(fastaFile)}) found in blastFolder"
             )
             raise error.BlastConnectionError(msg)
-        
+
         if not fastaFile:
             return None
-        
+
         return fastaFile[0]
 
+    def _getFasta(self):
+        """Multifasta of open shard"""
+        if not self.shards:
+            return None
+        if self.legacy:
+            return self._getLegacyFasta()
+        return self._shardFasta(self.shards[-1])
+
     def _setRegistry(self):
         filesRegistry = {
                     'pkl' : None,
-                    'nhr' : [],
-                    'nin' : [],
-                    'nsq' : [],
-                    'build' : { 
-                        'err' : None,
-                        'log' : None
+                    'registry' : None,
+                    'lock' : None,
+                    'done' : None,
+                    'mfasta' : [],
+                    'build' : {
+                        'err' : [],
+                        'log' : []
                     }
                 }
+        for k in BLAST_EXTENSIONS:
+            filesRegistry.setdefault(k, [])
 
         tag = self.tag
-        _reRegularFile =  f"{tag}(\.[\d]+){{0,1}}"
-        _reLogFile = f"{tag}_build"
-        
+        _reRegularFile =  f"{tag}(_\d{{4}}){{0,1}}(\.[\d]+){{0,1}}$"
+        _reLogFile = f"{tag}(_\d{{4}}){{0,1}}_build$"
+
         for file in glob.glob(f"{self.location}/*.*"):
+            if file.endswith(".tmp"):
+                # rewritten shard or alias file of a running writer, or left by an interrupted one
+                logging.debug(f"blastDB::_setRegistry:temporary file {file} ignored")
+                continue
             if re.search(rf'/{tag}.mfasta(.gz){{0,1}}$', file):
                 continue
+            if re.search(rf'/{tag}_\d{{4}}\.mfasta\.gz$', file):
+                filesRegistry['mfasta'].append(os.path.basename(file)[:-len(".mfasta.gz")])
+                continue
             filename, file_extension = os.path.splitext(file)
             filename                 = os.path.basename(filename)
-            file_extension           = file_extension.replace('.', '')           
+            file_extension           = file_extension.replace('.', '')
 
             _root = filesRegistry
             if re.match(_reLogFile, filename):
                 _root = filesRegistry['build']
             elif not re.match(_reRegularFile, filename):
                 raise error.BlastConnectionError(f"Irregular extension found in blast database {file} re/{_reRegularFile}/")
-            
+
             if not file_extension in _root:
                 #raise error.BlastConnectionError(f"Unregistred extension for file {filename} =>{file_extension}")
                 logging.warn(f'Warning: Unregistred extension for file {filename} =>{file_extension}')
                 continue
-            if not type(_root[file_extension]) is list and not _root[file_extension] is None: 
+            if not type(_root[file_extension]) is list and not _root[file_extension] is None:
                 raise error.BlastConnectionError(f"Previous instance of {file_extension} registred" )
-            elif type(_root[file_extension]) is list:       
+            elif type(_root[file_extension]) is list:
                 _root[file_extension].append(filename)
             else:
                 _root[file_extension] = f"{filename}.{file_extension}"
 
-        for k in ['nhr', 'nin', 'nsq']:
-            filesRegistry[k] = sorted(filesRegistry[k]) 
+        for k in ['nhr', 'nin', 'nsq', 'mfasta', 'nal']:
+            filesRegistry[k] = sorted(filesRegistry[k])
 
         for k in ['nin', 'nsq']:
             if not filesRegistry['nhr'] == filesRegistry[k]:
@@ -227,33 +422,113 @@ class BlastDB ():
 
         return filesRegistry
 
-    def _restoreIndex(self, filePickle):
-        logging.info(f"Restoring index from {filePickle}")
-        with open(filePickle, 'rb') as fp:
-            _ = pickle.load(fp)
-            checksum = _.get('checksum', None)
-            if not checksum:
-                raise error.BlastConnectionError(f"No checksum in {filePickle}")
-            if not checksum == self.checksum:
-                raise error.BlastConnectionError(f"Restored checksum in {filePickle} does not match {self.fastaFile}")
-            return  _.get('data', None)
-
     def _index(self):
+        """Check records registry against each shard multifasta. Shards with their registered stamp get a quick
+        check of the first bytes of each checksummed block, others are checksummed again. Records of a changed shard
+        are registered again with a multifasta scan from its first changed block only."""
+        for shard in set(self.data.shards) - set(self.shards):
+            logging.info(f"blastdb::_index:shard {shard} is gone, unregistering its records")
+            self.data.dropShard(shard)
+        for shard in self.shards:
+            fasta = self._shardFile(shard)
+            stamp = blastRegistry.fastaStamp(fasta)
+            checks = self.data.checks(shard)
+            if self.data.stamp(shard) == stamp and not checks:
+                # registered before content checksums
+                self._updateChecks(shard, 0)
+                continue
+            changed = blastRegistry.firstChange(fasta, checks, full = self.data.stamp(shard) != stamp) if self.data.stamp(shard) else 0
+            if changed is None:
+                self.data.setStamp(shard, stamp)
+                continue
+            logging.info(f"blastdb::_index:{fasta} changed from byte {changed}, building records registry from there, "
+                  f" this may take a while...")
+            self._reindex(shard, changed, stamp)
+        logging.info(f"blastdb::_index:{len(self.data)} records registered in {len(self.shards)} shards")
         if self.registry['pkl']:
-            return self._restoreIndex(f"{self.location}/{self.registry['pkl']}")
-            
-        logging.info(f"Building index on {self.fastaFile}, "
-              f" this may take a while...")
-        data = {}
-        with zFile(self.fastaFile) as handle:
-            for genome_seqrecord in SeqIO.parse(handle, "fasta"):
-                genome_seq = genome_seqrecord.seq
-                header = genome_seqrecord.id
-                _id = hashSequence(str(genome_seq))
-                data[_id] = header
-        
-        logging.info(f"{len(data.keys())} fasta records successfully indexed")
-        return data
+            logging.info(f"blastdb::_index:{self.registry['pkl']} index is superseded by records registry and can be deleted")
+
+    def _reindex(self, shard: str, changed: int, stamp):
+        """Register records of a shard again from the record holding multifasta byte changed"""
+        fasta = self._shardFile(shard)
+        if self.fastaAsArchive and shard != self.tag:
+            blocks = [ block for block in self.data.blocks(shard) if block[0] + block[1] > changed ]
+            coffset, uoffset = (blocks[0][0], blocks[0][2]) if blocks else self.data.blockEnd(shard)
+            self.data.setBlocks(shard, blastBlocks.scanBlocks(fasta, coffset, uoffset), uoffset)
+            self.data.rebuild(fasta, shard, stamp, self.data.resumeOffset(shard, uoffset), coffset)
+        elif fasta.endswith(".gz"):
+            self.data.rebuild(fasta, shard, stamp)
+        else:
+            self.data.rebuild(fasta, shard, stamp, self.data.resumeOffset(shard, changed))
+        self._updateChecks(shard, changed)
+
+    def _markDirty(self, shard: str, offset: int):
+        """Record that shard multifasta is written from byte offset, its checksums are updated from there on clean"""
+        self._dirty[shard] = min(offset, self._dirty.get(shard, offset))
+
+    def _updateChecks(self, shard: str, offset: int):
+        """Checksum shard multifasta again from the block holding byte offset"""
+        kept = [ check for check in self.data.checks(shard) if check[0] + check[1] <= offset and check[1] == blastRegistry.CHECK_BLOCK ]
+        start = kept[-1][0] + kept[-1][1] if kept else 0
+        self.data.setChecks(shard, start, blastRegistry.blockChecks(self._shardFile(shard), start, kept[-1][4] if kept else ""))
+
+    def _migrate(self):
+        """Turn the single multifasta of former layout into the first shard of sharded layout.
+        Blast files of former layout are deleted once shards are formatted.
+        """
+        shard = self._shardName(0)
+        fShard = self._shardFasta(shard)
+        logging.info(f"blastdb::_migrate:{self.fastaFile} becomes shard {fShard}")
+        if self.fastaAsArchive:
+            with gzOpen(self.fastaFile, "rb") as fin, self._openShard(fShard, "w") as fout:
+                for block in iter(lambda: fin.read(COPY_BUFFER), b""):
+                    fout.write(block)
+            os.remove(self.fastaFile)
+        else:
+            os.replace(self.fastaFile, fShard)
+        self.data.renameShard(self.tag, shard)
+        self.data.setStamp(shard, blastRegistry.fastaStamp(fShard))
+        self.shards = [shard]
+        self.fastaFile = self.fastaBufferFile = fShard
+        self._buffer.set_file(fShard)
+
+    def _rollShard(self):
+        """Multifasta of open shard, which is closed for a new one once it holds SHARD_SIZE bytes"""
+        if self._shardSize(self.shards[-1]) < SHARD_SIZE:
+            return self.fastaBufferFile
+        shard = self._shardName(int(self.shards[-1].rsplit("_", 1)[1]) + 1)
+        logging.info(f"blastdb::_rollShard:{self.shards[-1]} is full, new records go to {shard}")
+        self.shards.append(shard)
+        self.fastaFile = self.fastaBufferFile = self._shardFasta(shard)
+        return self.fastaBufferFile
+
+    def _writableShard(self, fout = None):
+        """Writer of open shard. Current writer fout is returned until it holds SHARD_SIZE bytes,
+        it is then closed and next shard opened.
+        """
+        if fout is not None and fout.tell() < SHARD_SIZE:
+            return fout
+        if fout is not None:
+            fout.close()
+        self._buffer.set_file(self._rollShard())
+        return self._openShard(self.fastaBufferFile)
+
+    def fetch(self, hashKey: str):
+        """Random access to a record through its registered shard and byte range
+
+        :return: header and sequence, None if record is not registered
+        :rtype: Tuple[str, str]
+        """
+        record = self.data.record(hashKey)
+        if not record:
+            return None
+        header, _, shard, offset, length = record
+        if self.fastaAsArchive and shard != self.tag:
+            content = blastBlocks.readRange(self._shardFile(shard), self.data.blocks(shard, offset, offset + length), offset, length)
+        else:
+            content = blastRegistry.readRange(self._shardFile(shard), offset, length)
+        lines = content.decode().split("\n")
+        return lines[0], "".join(lines[1:])
 
     def __iter__(self):
         for _id, header  in self.data.items():
@@ -262,135 +537,347 @@ class BlastDB ():
     # Returns True hash(sequence) is part of index
     def get(self, **kwargs):
         if 'seq' in kwargs:
-            return self[hashSequence(seq)]
-            
+            return self[hashSequence(kwargs['seq'])]
+
     def __getitem__(self, hashKey):
-        return self.data[hashKey] if hashKey in self.data else None
-    
+        return self.data.get(hashKey)
+
     def add(self, header, sequence, force=False):
         key = hashSequence(sequence)
-        if key in self.data:
+        self._prepareWrite()
+        if key in self.data or key in self._buffer:
             logging.info(f"blast::add:Bouncing {header}, sequence already stored")
             return
         self._buffer.append( (header, sequence, key) )
 
-    def remove(self, header:str, sequence:str): 
-        """Remove sequence from blast database
-        
+    def appendFasta(self, fasta: str, uuid: str) -> int:
+        """Append all records of a genome fasta to the open shard, headers rewritten as >uuid|header.
+        Sequence bytes are copied from fasta by COPY_BUFFER blocks and hashed on the fly, they are never
+        decoded nor rebuilt as strings. Records whose sequence is already stored are cut back out.
+        Appended records are registered once the fasta is copied.
+
+        :param fasta: Path to fasta file, may be gzipped
+        :type fasta: str
+        :param uuid: Genome uuid
+        :type uuid: str
+        :return: number of records appended
+        :rtype: int
+        """
+        self._prepareWrite()
+        if not fasta.endswith(".gz") and not os.path.isfile(fasta) and os.path.isfile(fasta + ".gz"):
+            fasta += ".gz"
+        opener = gzOpen if fasta.endswith(".gz") else open
+        prefix = f">{uuid}|".encode()
+        records = []
+        keys = set()
+        fout = None
+        record = None
+
+        def openRecord(title: bytes):
+            nonlocal fout
+            fout = self._writableShard(fout)
+            header = prefix + title.rstrip() + b"\n"
+            fout.write(header)
+            return [header[:-1].decode(), fout.tell() - len(header), hashlib.md5(), True]
+
+        def closeRecord(record):
+            header, start, hasher, lineStart = record
+            if not lineStart:
+                fout.write(b"\n")
+            hKey = hasher.hexdigest()
+            if hKey in keys or hKey in self.data or hKey in self._buffer:
+                logging.info(f"blast::appendFasta:Bouncing {header}, sequence already stored")
+                fout.truncate(start)
+                fout.seek(start)
+                return
+            keys.add(hKey)
+            records.append( (hKey, header, self._buffer.shard, start, fout.tell() - start) )
+
+        def writeSequence(record, block: bytes):
+            block = block.replace(b"\r", b"")
+            if not block:
+                return
+            fout.write(block)
+            record[2].update(block.translate(None, WHITESPACES))
+            record[3] = block.endswith(b"\n")
+
+        with opener(fasta, "rb") as fin:
+            title = None
+            lineStart = True
+            while True:
+                block = fin.read(COPY_BUFFER)
+                if not block:
+                    break
+                pos = 0
+                while pos < len(block):
+                    if title is not None:
+                        end = block.find(b"\n", pos)
+                        if end == -1:
+                            title += block[pos:]
+                            pos = len(block)
+                            continue
+                        title += block[pos:end]
+                        pos = end + 1
+                        record = openRecord(title[1:])
+                        title = None
+                        continue
+                    if (block[pos - 1:pos] == b"\n" if pos else lineStart) and block[pos:pos + 1] == b">":
+                        start = pos
+                    else:
+                        start = block.find(b"\n>", pos)
+                        start = len(block) if start == -1 else start + 1
+                    if record is not None:
+                        writeSequence(record, block[pos:start])
+                    if start < len(block):
+                        if record is not None:
+                            closeRecord(record)
+                            record = None
+                        title = b""
+                    pos = start
+                lineStart = block.endswith(b"\n")
+            if title is not None:
+                record = openRecord(title[1:])
+            if record is not None:
+                closeRecord(record)
+        if fout is not None:
+            fout.close()
+        self.data.add(records)
+        self._appended += len(records)
+        logging.info(f"blast::appendFasta:{len(records)} records of {fasta} appended to {self.fastaBufferFile}")
+        return len(records)
+
+    def remove(self, header:str, sequence:str):
+        """Remove sequence from blast database. Removals are only recorded,
+        the multifasta is rewritten once for all of them on close.
+
         :param header: Sequence header
         :type header: str
         :param sequence: Nucleotide sequence
         :type sequence: str
         """
+        self._prepareWrite()
         key = hashSequence(sequence)
-        if not key in self.data: 
+        if not key in self.data:
             logging.warn(f"blast::remove:Fasta sequence {header} doesn't exist in blast database")
         else:
             self._delete_buffer.append( (header, key) )
 
-        self._remove_from_mfasta()
 
+    def removeGenomes(self, uuids: List[str]) -> int:
+        """Remove all records of genomes from blast database, they are found in records registry by genome uuid,
+        so neither genome fasta nor sequences are needed. As for remove, records are dropped from shards on close.
 
-    def _add_to_mfasta(self, overwrite = False):
-        """Add sequence in buffer to the multifasta. They can be add at the end of the multifasta or the multifasta can be rewrite.
-        
-        :param overwrite: overwrite multifasta or not, defaults to False
-        :type overwrite: bool, optional
+        :param uuids: Genomes uuids
+        :type uuids: List[str]
+        :return: number of records to remove
+        :rtype: int
         """
-        if overwrite:
-            logging.info("Overwrite mfasta")
-            fp = open (self.fastaBufferFile, 'w')
-        else:
-            fp = open(self.fastaBufferFile, 'a')
-
-        for t in self._buffer:
-            fp.write(t[0] + '\n')
-            fp.write(t[1] + '\n')
-        
-        fp.close()
-
-    def _remove_from_mfasta(self):
-        """Parse current multifasta and just keep sequence that are not in _delete_buffer in _buffer. The _buffer sequences can be then rewrite in a multifasta.
+        self._prepareWrite()
+        records = self.data.genomeRecords(uuids)
+        missing = set(uuids) - set(blastRegistry.headerUuid(header) for hKey, header in records)
+        if missing:
+            logging.warn(f"blast::removeGenomes:No record of {len(missing)} genomes in blast database : {', '.join(sorted(missing))}")
+        self._delete_buffer += [ (header, hKey) for hKey, header in records ]
+        return len(records)
+
+    def _remove_from_mfasta(self) -> int:
+        """Rewrite the shards holding records of _delete_buffer, each in a single streaming pass into a temporary file
+        which then replaces it. Byte ranges of removed records are taken from the registry and skipped,
+        everything else is copied by large blocks, sequences are neither parsed nor hashed. In block compressed shards,
+        only blocks overlapping removed ranges are recompressed. Registry is updated accordingly, shards left empty are deleted.
+
+        :return: number of records removed
+        :rtype: int
         """
-        to_delete_headers = [buf[0] for buf in self._delete_buffer]
-        for header, seq, _id in zFastaReader(self.fastaBufferFile):
-            key = hashSequence(seq)
-            _header = f">{header}"
-            if not _header in to_delete_headers: 
-                self._buffer.append( (_header, seq, key) ) # Add sequences that we want to keep to buffer for rewriting
-
-    def flush(self):
-        logging.info("flushing")
-        self.fastaBufferFile = None
-        # No previous fasta record
-        if not self.fastaFile:           
-            self.fastaBufferFile = f"{self.location}/{self.tag}.mfasta"
-            self.fastaFile =  self.fastaBufferFile
-        # Previous record is ziped
-        elif self.fastaAsArchive :
-            self.fastaBufferFile = gunzip(self.fastaFile)
-        # Previous record is flat
-        else :
-            self.fastaBufferFile = self.fastaFile
-
-        remove = False 
-        if self._delete_buffer:
-            remove = True
-            self._remove_from_mfasta()
-
-        logging.info(f"{len(self._delete_buffer)} sequences deleted")
-        logging.info(f"{len(self._buffer)} sequences added or updated")
+        ranges = self.data.ranges(hKey for header, hKey in self._delete_buffer)
+        byShard = {}
+        for shard, offset, length in ranges:
+            byShard.setdefault(shard, []).append( (offset, length) )
+        for shard, shardRanges in byShard.items():
+            fasta = self._shardFile(shard)
+            if self.fastaAsArchive:
+                self._markDirty(shard, self.data.blocks(shard, shardRanges[0][0])[0][0])
+                self.data.setBlocks(shard, blastBlocks.cutRanges(fasta, self.data.blocks(shard), shardRanges))
+                continue
+            self._markDirty(shard, shardRanges[0][0])
+            tmp = fasta + ".tmp"
+            with open(fasta, "rb") as fin, open(tmp, "wb") as fout:
+                position = 0
+                for offset, length in shardRanges + [(os.path.getsize(fasta), 0)]:
+                    _copyRange(fin, fout, position, offset - position)
+                    position = offset + length
+            os.replace(tmp, fasta)
+        self.updateIndex()
+        for shard in byShard:
+            if not self.data.count(shard):
+                self._dropShard(shard)
+        logging.info(f"blast::_remove_from_mfasta:{len(ranges)} records removed from {len(byShard)} shards")
+        return len(ranges)
+
+    def _dropShard(self, shard: str):
+        """Delete an empty shard, its multifasta and blast files"""
+        logging.info(f"blastdb::_dropShard:{shard} has no record left, deleting it")
+        self._removeBlastFiles(shard)
+        os.remove(self._shardFasta(shard))
+        self.data.dropShard(shard)
+        self._dirty.pop(shard, None)
+        self.shards.remove(shard)
+        if not self.shards:
+            self.shards = [self._shardName(int(shard.rsplit("_", 1)[1]) + 1)]
+        if self.fastaBufferFile == self._shardFasta(shard):
+            self.fastaFile = self.fastaBufferFile = self._shardFasta(self.shards[-1])
+            self._buffer.set_file(self.fastaBufferFile)
+
+    def _removeBlastFiles(self, name: str):
+        """Delete blast files of a formatted shard, or of former single multifasta layout"""
+        for f in glob.glob(f"{self.location}/{name}.*"):
+            if re.search(rf'/{name}(\.\d+)?\.({"|".join(BLAST_EXTENSIONS)})$', f):
+                os.remove(f)
 
-        #self._add_to_mfasta(overwrite = remove) 
-        
     def clean(self):
-        logging.info(f"Computing checksum of {self.fastaFile}")
-        self.checksum  = os.path.getsize(self.fastaFile)
-        logging.info(f"Cleaning")                
-        if self.fastaAsArchive:
-            logging.info(f"Zipping main fasta record")
-            self.fastaFile = gzip(self.fastaBufferFile)
-            logging.info(f"Deleting main fasta record {self.fastaBufferFile}")
-            os.remove(self.fastaBufferFile)
+        logging.info(f"Cleaning")
+        for shard in self.shards:
+            if shard in self._dirty:
+                self._updateChecks(shard, self._dirty.pop(shard))
+            self.data.setStamp(shard, blastRegistry.fastaStamp(self._shardFile(shard)))
 
     def clean_registry(self):
         """Clean blast registry by deleting all files
         """
         logging.info("No sequence are conserved, delete all blast files")
+        self.data.close()
         all_files = glob.glob(self.location + "/*")
         for f in all_files:
-            os.remove(f)
-    
+            if os.path.isfile(f) and not f.endswith(LOCK_EXTENSION):
+                os.remove(f)
+        self.data = blastRegistry.connect(self.data.registry_file)
+        self.shards = []
+
     def _formatdb(self):
-        stdRootPath = f"{self.location}/{self.tag}_build"
-        args = ['makeblastdb', '-in', self.fastaBufferFile, '-dbtype', 'nucl', '-out', f"{self.location}/{self.tag}"]
+        """Format shards changed since they were last formatted, jobs at a time, then write alias file.
+        Blast files of former single multifasta layout are deleted.
+        """
+        self._removeBlastFiles(self.tag)
+        dirty = [ shard for shard in self.shards if self.data.formatted(shard) != blastRegistry.fastaStamp(self._shardFasta(shard)) ]
+        logging.info(f"blastDB::_formatdb:formatting {len(dirty)} of {len(self.shards)} shards")
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for shard, stamp in executor.map(self._formatShard, dirty):
+                self.data.setFormatted(shard, stamp)
+        self._writeAlias()
+
+    def _formatShard(self, shard: str):
+        fasta = self._shardFasta(shard)
+        stamp = blastRegistry.fastaStamp(fasta)
+        stdRootPath = f"{self.location}/{shard}_build"
+        args = ['makeblastdb', '-in', fasta, '-dbtype', 'nucl', '-out', f"{self.location}/{shard}"]
+        if self.fastaAsArchive:
+            # makeblastdb doesn't read gzip, multifasta is streamed to its standard input
+            args = ['makeblastdb', '-in', '-', '-title', shard, '-dbtype', 'nucl', '-out', f"{self.location}/{shard}"]
         #formatdb -t $DATABASE_TAG -i $MFASTA -l ${DATABASE_TAG}_build.log -o T -n $DATABASE_TAG
         with open(f"{stdRootPath}.log", 'a') as stdout:
             with open(f"{stdRootPath}.err", 'a') as stderr:
                 logging.info(f"Running {args}")
-                check_call(args, stdout=stdout, stderr=stderr, cwd=self.location)
-    
+                if not self.fastaAsArchive:
+                    check_call(args, stdout=stdout, stderr=stderr, cwd=self.location)
+                    return shard, stamp
+                process = Popen(args, stdin=PIPE, stdout=stdout, stderr=stderr, cwd=self.location)
+                with gzOpen(fasta, "rb") as fin:
+                    shutil.copyfileobj(fin, process.stdin, COPY_BUFFER)
+                process.stdin.close()
+                if process.wait():
+                    raise CalledProcessError(process.returncode, args)
+        return shard, stamp
+
+    def _writeAlias(self):
+        """Blast alias file <tag>.nal listing all shards"""
+        fAlias = f"{self.location}/{self.tag}.nal"
+        with open(fAlias + ".tmp", "w") as fp:
+            fp.write(f"#\n# Alias file of {len(self.shards)} shards\n#\nTITLE {self.tag}\nDBLIST {' '.join(self.shards)}\n")
+        os.replace(fAlias + ".tmp", fAlias)
+
     def updateIndex(self):
-        for header, hKey in self._delete_buffer:
-            try: del self.data[hKey]
-            except KeyError:
-                logging.warn(f"{hKey} already deleted from index")
+        removed = self.data.remove(hKey for header, hKey in self._delete_buffer)
+        if removed < len(set(hKey for header, hKey in self._delete_buffer)):
+            logging.warn(f"{len(self._delete_buffer) - removed} records already deleted from index")
+
+    def merge(self) -> int:
+        """Fold the staging fragments of finished jobs into database. Records are copied by byte range from
+        fragment shards to open shard, those already stored are skipped, and merged fragments are deleted.
+        Fragments still locked by their job are left for next merge, unlocked fragments not marked as completed
+        were left by a failed job and are reported, not merged. Shards are formatted once, on close.
+
+        :return: number of records merged
+        :rtype: int
+        """
+        self._prepareWrite()
+        merged = 0
+        for fragmentFolder in sorted(glob.glob(f"{self.location}/{STAGING_FOLDER}/*")):
+            try:
+                fragment = BlastDB(fragmentFolder, staging=True)
+            except error.BlastConnectionError as e:
+                logging.warn(f"blast::merge:{e}, fragment left for next merge")
+                continue
+            if not fragment.completed:
+                logging.error(f"blast::merge:{fragmentFolder} was not closed by its job, it may hold partial records and is not merged")
+                fragment.data.close()
+                fragment._unlock()
+                continue
+            nb = self._mergeFragment(fragment)
+            logging.info(f"blast::merge:{nb} records of {len(fragment.data)} merged from {fragmentFolder}")
+            fragment.discard()
+            merged += nb
+        self._appended += merged
+        return merged
+
+    def _mergeFragment(self, fragment: "BlastDB") -> int:
+        records = []
+        keys = set()
+        fout = None
+        for shard in fragment.shards:
+            with open(fragment._shardFile(shard), "rb") as fin:
+                for hKey, header, offset, length in fragment.data.shardRecords(shard):
+                    if hKey in keys or hKey in self.data:
+                        continue
+                    keys.add(hKey)
+                    fout = self._writableShard(fout)
+                    start = fout.tell()
+                    _copyRange(fin, fout, offset, length)
+                    records.append( (hKey, header, self._buffer.shard, start, length) )
+        if fout is not None:
+            fout.close()
+        self.data.add(records)
+        return len(records)
+
+    def discard(self):
+        """Delete database folder, used for merged staging fragments"""
+        self.data.close()
+        shutil.rmtree(self.location)
+        self._unlock()
 
     def close(self):
         logging.info("closing")
-        if not self._buffer and not self._delete_buffer:
+        try:
+            self._close()
+            if self.staging:
+                open(self._doneFile, "w").close()
+        finally:
+            self._writing = False
+            self._unlock()
+
+    def _close(self):
+        """Write buffered insertions and removals, then format changed shards"""
+        if not self._buffer and not self._delete_buffer and not self._appended:
             return
 
-        if self._delete_buffer and set(self.data.values()) == set([buf[0] for buf in self._delete_buffer]):
+        if self._delete_buffer and not self._buffer and not self._appended and len(self.data.ranges(hKey for header, hKey in self._delete_buffer)) == len(self.data):
             self.clean_registry()
             return
 
+        if self._delete_buffer:
+            self._remove_from_mfasta()
         self._buffer.close()
-        #self.flush()
-        self._formatdb()
         self.clean()
-        self.updateIndex()
-        logging.info(f"blastDB::close: deleting {len(self._delete_buffer)} and inserting {len(self._buffer)} fasta records before closing")
-        fName = self._indexDump() 
-        logging.info(f"Index wrote to {fName}")
-        
\ No newline at end of file
+        if not self.staging:
+            self._formatdb()
+        logging.info(f"blastDB::close: deleting {len(self._delete_buffer)} and inserting {len(self._buffer) + self._appended} fasta records before closing")
+        logging.info(f"Records registry updated in {self.data.registry_file}")
@@ -0,0 +1,169 @@
+import os, zlib
+import logging
+from typing import Iterator, List, Tuple
+
+# Uncompressed size of a block, as BGZF
+BLOCK_SIZE = 64 * 1024
+# Read size when scanning a block compressed file
+SCAN_BUFFER = 16 * 1024 * 1024
+
+# (compressed offset, compressed size, uncompressed offset, uncompressed size)
+Block = Tuple[int, int, int, int]
+
+def compressBlock(data: bytes) -> bytes:
+    """data as a standalone gzip member, a block compressed file is a plain concatenation of them"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def decompressBlock(data: bytes) -> bytes:
+    return zlib.decompress(data, 31)
+
+def scanBlocks(fasta: str, coffset: int = 0, uoffset: int = 0) -> Iterator[Block]:
+    """Blocks of a gzip file, one per gzip member, in a single streaming pass,
+    from the member starting at compressed byte coffset, holding uncompressed byte uoffset"""
+    with open(fasta, "rb") as fp:
+        fp.seek(coffset)
+        csize = usize = 0
+        decompressor = zlib.decompressobj(31)
+        data = b""
+        while True:
+            if not data:
+                data = fp.read(SCAN_BUFFER)
+                if not data:
+                    break
+            usize += len(decompressor.decompress(data, SCAN_BUFFER))
+            if decompressor.eof:
+                rest = decompressor.unused_data
+                csize += len(data) - len(rest)
+                yield coffset, csize, uoffset, usize
+                coffset, uoffset = coffset + csize, uoffset + usize
+                csize = usize = 0
+                decompressor = zlib.decompressobj(31)
+            else:
+                rest = decompressor.unconsumed_tail
+                csize += len(data) - len(rest)
+            data = rest
+        if csize:
+            logging.warn(f"blast_blocks::scanBlocks:{fasta} ends with a truncated block of {csize} bytes")
+
+def readRange(fasta: str, blocks: List[Block], offset: int, length: int) -> bytes:
+    """Bytes [offset, offset + length[ of the uncompressed content, from the blocks holding them"""
+    if not blocks:
+        return b""
+    with open(fasta, "rb") as fp:
+        fp.seek(blocks[0][0])
+        data = b"".join( decompressBlock(fp.read(csize)) for _, csize, _, _ in blocks )
+    start = offset - blocks[0][2]
+    return data[start:start + length]
+
+def cutRanges(fasta: str, blocks: List[Block], ranges: List[Tuple[int, int]]) -> List[Block]:
+    """Rewrite a block compressed file without sorted uncompressed byte ranges. Only blocks overlapping
+    ranges are decompressed, cut and compressed again, other blocks are copied as they are.
+
+    :return: blocks of rewritten file
+    :rtype: List[Block]
+    """
+    tmp = fasta + ".tmp"
+    newBlocks = []
+    coffset = uoffset = 0
+    i = 0
+    with open(fasta, "rb") as fin, open(tmp, "wb") as fout:
+        for bcoffset, bcsize, buoffset, busize in blocks:
+            fin.seek(bcoffset)
+            data = fin.read(bcsize)
+            while i < len(ranges) and sum(ranges[i]) <= buoffset:
+                i += 1
+            cuts = []
+            j = i
+            while j < len(ranges) and ranges[j][0] < buoffset + busize:
+                cuts.append(ranges[j])
+                j += 1
+            if cuts:
+                content = decompressBlock(data)
+                kept = []
+                position = 0
+                for offset, length in cuts:
+                    kept.append(content[position:max(offset - buoffset, position)])
+                    position = max(position, offset + length - buoffset)
+                kept.append(content[position:])
+                content = b"".join(kept)
+                if not content:
+                    continue
+                data = compressBlock(content)
+                busize = len(content)
+            fout.write(data)
+            newBlocks.append( (coffset, len(data), uoffset, busize) )
+            coffset += len(data)
+            uoffset += busize
+    os.replace(tmp, fasta)
+    return newBlocks
+
+class BlockWriter():
+    """Appending writer of a block compressed multifasta. Bytes are compressed by BLOCK_SIZE blocks,
+    each an independent gzip member, so the file remains a regular gzip file. Offsets are uncompressed offsets.
+    Written blocks are registered in the records registry on close.
+
+    :ivar shard: name of the shard written
+    :vartype shard: str
+    """
+    def __init__(self, fasta: str, registry, shard: str, mode: str = "a"):
+        self.registry = registry
+        self.shard = shard
+        if mode == "w":
+            self.registry.setBlocks(shard, [])
+        self.fp = open(fasta, mode + "b")
+        self._cend = self.fp.tell()
+        self._uend = self.registry.blockEnd(shard)[1]
+        self._ustart = self._uend
+        self._pending = bytearray()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data: bytes):
+        self._pending += data
+        while len(self._pending) >= BLOCK_SIZE:
+            self._flushBlock(BLOCK_SIZE)
+
+    def _flushBlock(self, size: int):
+        content = bytes(self._pending[:size])
+        del self._pending[:size]
+        data = compressBlock(content)
+        self.fp.write(data)
+        self._blocks.append( (self.shard, self._cend, len(data), self._uend, len(content)) )
+        self._cend += len(data)
+        self._uend += len(content)
+
+    def tell(self) -> int:
+        return self._uend + len(self._pending)
+
+    def seek(self, offset: int):
+        if offset != self.tell():
+            raise ValueError(f"BlockWriter can only seek at end of {self.shard}")
+
+    def truncate(self, offset: int):
+        """Drop written bytes from offset, which must be in bytes written by this writer"""
+        if offset < self._ustart:
+            raise ValueError(f"Can't truncate {self.shard} before {self._ustart}")
+        while offset < self._uend:
+            _, coffset, csize, uoffset, usize = self._blocks.pop()
+            self.fp.flush()
+            with open(self.fp.name, "rb") as fin:
+                fin.seek(coffset)
+                content = decompressBlock(fin.read(csize))
+            self.fp.truncate(coffset)
+            self._pending = bytearray(content) + self._pending
+            self._cend, self._uend = coffset, uoffset
+        del self._pending[offset - self._uend:]
+
+    def close(self):
+        if self.fp.closed:
+            return
+        if self._pending:
+            self._flushBlock(len(self._pending))
+        self.fp.close()
+        self.registry.addBlocks(self._blocks)
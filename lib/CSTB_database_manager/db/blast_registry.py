@@ -0,0 +1,328 @@
+import os, gzip, sqlite3, itertools, hashlib
+from contextlib import contextmanager
+import logging
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+from CSTB_core.utils.io import hashStripedString as hashSequence
+
+REGISTRY_EXTENSION = ".registry"
+# Size of the multifasta blocks checksummed in registry
+CHECK_BLOCK = 4 * 1024 * 1024
+# Size of the leading part of a block checksummed on its own, for quick checks
+CHECK_SAMPLE = 4 * 1024
+
+# (offset, length, digest, sample digest, chain digest)
+Check = Tuple[int, int, str, str, str]
+
+def connect(registry_file):
+    return BlastRegistry(registry_file)
+
+def fastaStamp(fasta: str) -> Tuple[int, int]:
+    """Size and modification time of a multifasta, a registry is only valid for the stamp it was written for"""
+    stat = os.stat(fasta)
+    return (stat.st_size, stat.st_mtime_ns)
+
+def headerUuid(header: str) -> str:
+    """Genome uuid of a blast record header >uuid|record_id"""
+    return header.split("|")[0].lstrip(">")
+
+def blockChecks(fasta: str, start: int = 0, chain: str = "") -> Iterator[Check]:
+    """Checksums of the CHECK_BLOCK blocks of a file, from block aligned byte start. Each block digest is chained
+    to the ones of previous blocks, chain being the chain digest of the block before start.
+    """
+    with open(fasta, "rb") as fp:
+        fp.seek(start)
+        offset = start
+        for block in iter(lambda: fp.read(CHECK_BLOCK), b""):
+            digest = hashlib.md5(block).hexdigest()
+            chain = hashlib.md5((chain + digest).encode()).hexdigest()
+            yield offset, len(block), digest, hashlib.md5(block[:CHECK_SAMPLE]).hexdigest(), chain
+            offset += len(block)
+
+def firstChange(fasta: str, checks: List[Check], full: bool = True) -> Optional[int]:
+    """First byte of a file which may differ from the content its checks were computed on, None if it is unchanged.
+    Blocks are checked in order, hashed again with full, else only their first CHECK_SAMPLE bytes are.
+    A file longer than its checked blocks changes at their end.
+    """
+    size = os.path.getsize(fasta)
+    end = checks[-1][0] + checks[-1][1] if checks else 0
+    chain = ""
+    with open(fasta, "rb") as fp:
+        for offset, length, digest, sample, blockChain in checks:
+            if offset >= size:
+                return size
+            fp.seek(offset)
+            if full:
+                chain = hashlib.md5((chain + digest).encode()).hexdigest()
+                if hashlib.md5(fp.read(length)).hexdigest() != digest or chain != blockChain:
+                    return offset
+            elif hashlib.md5(fp.read(min(length, CHECK_SAMPLE))).hexdigest() != sample:
+                return offset
+    return None if size == end else min(size, end)
+
+def scanRecords(fasta: str, start: int = 0, coffset: int = 0) -> Iterator[Tuple[str, str, int, int]]:
+    """Hash, header, byte offset and byte length of each record of a multifasta, in a single streaming pass.
+    Offsets of gzipped multifasta are offsets in uncompressed content. Scan starts at byte start,
+    for gzipped multifasta at the gzip member starting at compressed byte coffset, holding uncompressed byte start.
+    Bytes before first header are skipped.
+    """
+    with open(fasta, "rb") as raw:
+        if fasta.endswith(".gz"):
+            raw.seek(coffset)
+            with gzip.GzipFile(fileobj=raw) as fp:
+                yield from _scanLines(fp, start)
+        else:
+            raw.seek(start)
+            yield from _scanLines(raw, start)
+
+def _scanLines(fp, offset: int) -> Iterator[Tuple[str, str, int, int]]:
+    header = None
+    start = 0
+    seq = []
+    for line in fp:
+        if line.startswith(b">"):
+            if header is not None:
+                yield hashSequence(b"".join(seq).decode()), header, start, offset - start
+            header = line.rstrip(b"\r\n").decode()
+            start = offset
+            seq = []
+        else:
+            seq.append(line.rstrip(b"\r\n"))
+        offset += len(line)
+    if header is not None:
+        yield hashSequence(b"".join(seq).decode()), header, start, offset - start
+
+def readRange(fasta: str, offset: int, length: int) -> bytes:
+    """Bytes of a record of a multifasta, see scanRecords"""
+    opener = gzip.open if fasta.endswith(".gz") else open
+    with opener(fasta, "rb") as fp:
+        fp.seek(offset)
+        return fp.read(length)
+
+class BlastRegistry():
+    """Local sqlite registry of blast database records, keyed by sequence hash, with their header, genome uuid,
+    shard and byte range in shard multifasta. It is updated with each add and remove.
+    Compressed and uncompressed offsets of the blocks of block compressed shards are registered as well. Each shard is stamped
+    with its multifasta size and mtime when registry was last synchronized with it, and when it was last formatted
+    with makeblastdb, so opening a database needs no multifasta read and only changed shards are formatted again.
+    Shard multifasta content is checksummed by CHECK_BLOCK blocks (see blockChecks), so that a changed shard can be
+    checked without trusting its stamp, and registered again only from its first changed block.
+
+    :ivar registry_file: path to sqlite file
+    :vartype registry_file: str
+    """
+    def __init__(self, registry_file):
+        self.registry_file = registry_file
+        self.conn = sqlite3.connect(registry_file, isolation_level=None)
+        columns = [ row[1] for row in self.conn.execute("PRAGMA table_info(records)") ]
+        if columns and not "shard" in columns:
+            # registry of single multifasta layout, rebuilt from multifasta scan
+            logging.info(f"blast_registry::BlastRegistry:{registry_file} has no shard, it will be rebuilt")
+            self.conn.execute("DROP TABLE records")
+            self.conn.execute("DROP TABLE IF EXISTS stamp")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS records (hash TEXT PRIMARY KEY, header TEXT, uuid TEXT, shard TEXT, offset INTEGER, length INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_uuid ON records (uuid)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_offset ON records (shard, offset)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS shards (name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, formatted_size INTEGER, formatted_mtime_ns INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS checks (shard TEXT, offset INTEGER, length INTEGER, digest TEXT, sample TEXT, chain TEXT, PRIMARY KEY (shard, offset))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS blocks (shard TEXT, coffset INTEGER, csize INTEGER, uoffset INTEGER, usize INTEGER, PRIMARY KEY (shard, uoffset))")
+
+    @contextmanager
+    def _transaction(self):
+        self.conn.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def __contains__(self, hashKey: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM records WHERE hash = ?", (hashKey,)).fetchone() is not None
+
+    def __getitem__(self, hashKey: str) -> str:
+        header = self.get(hashKey)
+        if header is None:
+            raise KeyError(hashKey)
+        return header
+
+    def get(self, hashKey: str) -> Optional[str]:
+        """Header of a record, None if absent"""
+        row = self.conn.execute("SELECT header FROM records WHERE hash = ?", (hashKey,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, hashKey: str) -> Optional[Tuple[str, str, str, int, int]]:
+        """Header, genome uuid, shard, byte offset and byte length of a record, None if absent"""
+        return self.conn.execute("SELECT header, uuid, shard, offset, length FROM records WHERE hash = ?", (hashKey,)).fetchone()
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """(hash, header) of all records, in shards then multifasta order"""
+        return iter(self.conn.execute("SELECT hash, header FROM records ORDER BY shard, offset"))
+
+    def shardRecords(self, shard: str) -> Iterator[Tuple[str, str, int, int]]:
+        """(hash, header, offset, length) of the records of a shard, in multifasta order"""
+        return iter(self.conn.execute("SELECT hash, header, offset, length FROM records WHERE shard = ? ORDER BY offset", (shard,)))
+
+    def values(self) -> List[str]:
+        return [ row[0] for row in self.conn.execute("SELECT header FROM records ORDER BY shard, offset") ]
+
+    def uuids(self) -> Set[str]:
+        return set(row[0] for row in self.conn.execute("SELECT DISTINCT uuid FROM records"))
+
+    def genomeRecords(self, uuids: Iterable[str]) -> List[Tuple[str, str]]:
+        """(hash, header) of all records of genomes, through uuid index"""
+        records = []
+        for uuid in set(uuids):
+            records += [ tuple(row) for row in self.conn.execute("SELECT hash, header FROM records WHERE uuid = ?", (uuid,)) ]
+        return records
+
+    def count(self, shard: str) -> int:
+        """Number of records of a shard"""
+        return self.conn.execute("SELECT COUNT(*) FROM records WHERE shard = ?", (shard,)).fetchone()[0]
+
+    @property
+    def shards(self) -> List[str]:
+        return [ row[0] for row in self.conn.execute("SELECT name FROM shards ORDER BY name") ]
+
+    def stamp(self, shard: str) -> Optional[Tuple[int, int]]:
+        """Multifasta stamp of a shard when registry was last synchronized with it"""
+        row = self.conn.execute("SELECT size, mtime_ns FROM shards WHERE name = ?", (shard,)).fetchone()
+        return tuple(row) if row and row[0] is not None else None
+
+    def formatted(self, shard: str) -> Optional[Tuple[int, int]]:
+        """Multifasta stamp of a shard when it was last formatted"""
+        row = self.conn.execute("SELECT formatted_size, formatted_mtime_ns FROM shards WHERE name = ?", (shard,)).fetchone()
+        return tuple(row) if row and row[0] is not None else None
+
+    def setStamp(self, shard: str, stamp: Tuple[int, int]):
+        with self._transaction():
+            self.conn.execute("INSERT OR IGNORE INTO shards (name) VALUES (?)", (shard,))
+            self.conn.execute("UPDATE shards SET size = ?, mtime_ns = ? WHERE name = ?", (*stamp, shard))
+
+    def setFormatted(self, shard: str, stamp: Tuple[int, int]):
+        with self._transaction():
+            self.conn.execute("INSERT OR IGNORE INTO shards (name) VALUES (?)", (shard,))
+            self.conn.execute("UPDATE shards SET formatted_size = ?, formatted_mtime_ns = ? WHERE name = ?", (*stamp, shard))
+
+    def renameShard(self, shard: str, newName: str):
+        with self._transaction():
+            self.conn.execute("UPDATE records SET shard = ? WHERE shard = ?", (newName, shard))
+            self.conn.execute("UPDATE shards SET name = ?, formatted_size = NULL, formatted_mtime_ns = NULL WHERE name = ?", (newName, shard))
+            self.conn.execute("UPDATE blocks SET shard = ? WHERE shard = ?", (newName, shard))
+            self.conn.execute("UPDATE checks SET shard = ? WHERE shard = ?", (newName, shard))
+
+    def dropShard(self, shard: str):
+        """Unregister a shard and all its records"""
+        with self._transaction():
+            self.conn.execute("DELETE FROM records WHERE shard = ?", (shard,))
+            self.conn.execute("DELETE FROM shards WHERE name = ?", (shard,))
+            self.conn.execute("DELETE FROM blocks WHERE shard = ?", (shard,))
+            self.conn.execute("DELETE FROM checks WHERE shard = ?", (shard,))
+
+    def blocks(self, shard: str, start: int = 0, end: int = None) -> List[Tuple[int, int, int, int]]:
+        """(coffset, csize, uoffset, usize) of the blocks of a shard holding uncompressed bytes [start, end[, in file order"""
+        if end is None:
+            return [ tuple(row) for row in self.conn.execute("SELECT coffset, csize, uoffset, usize FROM blocks WHERE shard = ? AND uoffset + usize > ? ORDER BY uoffset", (shard, start)) ]
+        return [ tuple(row) for row in self.conn.execute("SELECT coffset, csize, uoffset, usize FROM blocks WHERE shard = ? AND uoffset < ? AND uoffset + usize > ? ORDER BY uoffset", (shard, end, start)) ]
+
+    def blockEnd(self, shard: str) -> Tuple[int, int]:
+        """Compressed and uncompressed sizes of a block compressed shard"""
+        row = self.conn.execute("SELECT coffset + csize, uoffset + usize FROM blocks WHERE shard = ? ORDER BY uoffset DESC LIMIT 1", (shard,)).fetchone()
+        return tuple(row) if row else (0, 0)
+
+    def addBlocks(self, blocks: Iterable[Tuple[str, int, int, int, int]]):
+        """Register (shard, coffset, csize, uoffset, usize) blocks"""
+        with self._transaction():
+            self.conn.executemany("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?)", blocks)
+
+    def setBlocks(self, shard: str, blocks: Iterable[Tuple[int, int, int, int]], start: int = 0):
+        """Replace blocks of a shard from uncompressed byte start by (coffset, csize, uoffset, usize) blocks"""
+        with self._transaction():
+            self.conn.execute("DELETE FROM blocks WHERE shard = ? AND uoffset >= ?", (shard, start))
+            self.conn.executemany("INSERT INTO blocks VALUES (?, ?, ?, ?, ?)", ( (shard, *block) for block in blocks ))
+
+    def checks(self, shard: str) -> List[Check]:
+        """Checksums of the blocks of a shard multifasta, in file order"""
+        return [ tuple(row) for row in self.conn.execute("SELECT offset, length, digest, sample, chain FROM checks WHERE shard = ? ORDER BY offset", (shard,)) ]
+
+    def setChecks(self, shard: str, start: int, checks: Iterable[Check]):
+        """Replace checksums of the blocks of a shard from byte start"""
+        with self._transaction():
+            self.conn.execute("DELETE FROM checks WHERE shard = ? AND offset >= ?", (shard, start))
+            self.conn.executemany("INSERT INTO checks VALUES (?, ?, ?, ?, ?, ?)", ( (shard, *check) for check in checks ))
+
+    def resumeOffset(self, shard: str, offset: int) -> int:
+        """Start of the first record of a shard not entirely before byte offset, end of its last record if none"""
+        row = self.conn.execute("SELECT MIN(offset) FROM records WHERE shard = ? AND offset + length > ?", (shard, offset)).fetchone()
+        if row[0] is not None:
+            return row[0]
+        return self.conn.execute("SELECT COALESCE(MAX(offset + length), 0) FROM records WHERE shard = ?", (shard,)).fetchone()[0]
+
+    def add(self, records: Iterable[Tuple[str, str, str, int, int]]):
+        """Register (hash, header, shard, offset, length) records"""
+        with self._transaction():
+            self.conn.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                ( (hashKey, header, headerUuid(header), shard, offset, length) for hashKey, header, shard, offset, length in records ))
+
+    def ranges(self, hashKeys: Iterable[str]) -> List[Tuple[str, int, int]]:
+        """Sorted (shard, offset, length) byte ranges of registered records among hashKeys"""
+        ranges = []
+        for hashKey in set(hashKeys):
+            row = self.conn.execute("SELECT shard, offset, length FROM records WHERE hash = ?", (hashKey,)).fetchone()
+            if row:
+                ranges.append(tuple(row))
+        return sorted(ranges)
+
+    def remove(self, hashKeys: Iterable[str]) -> int:
+        """Unregister records, and shift the offsets of following records of their shard by the removed lengths,
+        as their byte ranges are cut out of shard multifasta
+
+        :return: number of records removed
+        :rtype: int
+        """
+        ranges = self.ranges(hashKeys)
+        if not ranges:
+            return 0
+        # bytes removed from a shard up to each removed range included
+        shifts = []
+        for shard, shardRanges in itertools.groupby(ranges, key=lambda r: r[0]):
+            shift = 0
+            for _, offset, length in shardRanges:
+                shift += length
+                shifts.append( (shard, offset, shift) )
+        with self._transaction():
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS removed (shard TEXT, offset INTEGER, shift INTEGER, PRIMARY KEY (shard, offset))")
+            self.conn.execute("DELETE FROM removed")
+            self.conn.executemany("INSERT INTO removed VALUES (?, ?, ?)", shifts)
+            self.conn.execute("DELETE FROM records WHERE (shard, offset) IN (SELECT shard, offset FROM removed)")
+            self.conn.execute("UPDATE records SET offset = offset - COALESCE((SELECT shift FROM removed WHERE removed.shard = records.shard AND removed.offset < records.offset ORDER BY removed.offset DESC LIMIT 1), 0) WHERE shard IN (SELECT DISTINCT shard FROM removed)")
+            self.conn.execute("DELETE FROM removed")
+        return len(ranges)
+
+    def clear(self):
+        with self._transaction():
+            self.conn.execute("DELETE FROM records")
+            self.conn.execute("DELETE FROM shards")
+            self.conn.execute("DELETE FROM blocks")
+            self.conn.execute("DELETE FROM checks")
+
+    def rebuild(self, fasta: str, shard: str, stamp: Tuple[int, int] = None, start: int = 0, coffset: int = 0) -> int:
+        """Register records of a shard multifasta from scratch, from record starting at byte start,
+        see scanRecords for coffset
+
+        :return: number of records registered
+        :rtype: int
+        """
+        stamp = stamp if stamp else fastaStamp(fasta)
+        with self._transaction():
+            self.conn.execute("DELETE FROM records WHERE shard = ? AND offset >= ?", (shard, start))
+        self.add( (hashKey, header, shard, offset, length) for hashKey, header, offset, length in scanRecords(fasta, start, coffset) if offset >= start )
+        self.setStamp(shard, stamp)
+        nb = self.count(shard)
+        logging.info(f"blast_registry::rebuild:{nb} records of {fasta} registered in {self.registry_file}")
+        return nb
+
+    def close(self):
+        self.conn.close()
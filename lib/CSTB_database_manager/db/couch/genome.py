@@ -1,5 +1,5 @@
 from typeguard import typechecked
-from typing import TypedDict, Optional, Dict
+from typing import TypedDict, Optional, Dict, List, Iterable
 import CSTB_database_manager.db.couch.virtual
 import CSTB_database_manager.utils.error as error
 import logging 
@@ -25,14 +25,31 @@ class GenomeDB(CSTB_database_manager.db.couch.virtual.Database):
                 {"fasta_md5": fasta_md5}
         }
         doc = self.wrapper.couchPostDoc(self.db_name + "/_find", mango_query)
+        return self.fromDocs(doc['docs'], gcf, acc)
 
-        if not doc['docs']:
+    def findByMd5(self, fasta_md5s: Iterable[str]) -> Dict[str, List[Dict]]:
+        """Get genome documents for several fasta_md5 with $in mango queries
+        
+        :return: documents grouped by fasta_md5, md5 not in database are missing
+        :rtype: Dict[str, List[Dict]]
+        """
+        return self.find_in("fasta_md5", fasta_md5s)
+
+    def fromDocs(self, docs: List[Dict], gcf: str = None, acc: str = None) -> Optional['GenomeEntity']:
+        """Create Genome Entity from the documents found for one fasta_md5, checking gcf number and accession number
+        
+        :raises error.DuplicateError: Raises if fasta is duplicated in database
+        :raises error.ConsistencyError: Raises if fasta exists in database but gcf or accession number don't correspond.
+        :return: Genome entity or None
+        :rtype: Optional[GenomeEntity]
+        """
+        if not docs:
             logging.warn("Fasta not in genome database")
             return None
-        if len(doc['docs']) > 1 : 
-            raise error.DuplicateError(f'Fasta exists {len(doc["docs"])} times in genome database : {[doc["_id"] for doc in doc["docs"]]}')
+        if len(docs) > 1 : 
+            raise error.DuplicateError(f'Fasta exists {len(docs)} times in genome database : {[doc["_id"] for doc in docs]}')
 
-        doc = doc['docs'][0]
+        doc = docs[0]
 
         gcf_error = False
         acc_error = False
@@ -48,13 +65,13 @@ class GenomeDB(CSTB_database_manager.db.couch.virtual.Database):
 
         return GenomeEntity(self, doc)
 
-    def createNewGenome(self, fasta_md5:str, size: Dict, headers: Dict, fasta_name: str, gcf: str = None, acc: str = None) -> 'GenomeEntity':
-        """Create genome entity
+    def createNewGenome(self, fasta_md5:str, size: Dict, headers: Dict, fasta_name: str, gcf: str = None, acc: str = None, uuid: str = None) -> 'GenomeEntity':
+        """Create genome entity. A new uuid is asked to couch if none is provided.
         :return: Genome Entity
         :rtype: GenomeEntity
         """
         doc = {
-            "_id": self.wrapper.couchGenerateUUID(),
+            "_id": uuid if uuid else self.wrapper.couchGenerateUUID(),
             "fasta_md5" : fasta_md5,
             "gcf_assembly" : gcf, 
             "accession_number": acc,
@@ -1,34 +1,552 @@
-import json, os
+import json, os, re, time, itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote
+import pycouch.wrapper as pycouch_wrapper
+import pycouch.error as pycouch_error
+
+# One keep-alive session per couch node, shared by all motif writers
+_SESSIONS = {}
+MAX_TRIES = 50
+# Longest rule prefix compiled in routing table, 4**8 entries
+MAX_PREFIX_LENGTH = 8
+# Rules like ^AAAA[ACGT]{19}$
+PREFIX_RULE = re.compile(r"^\^([ACGT]*)\[ACGT\]\{(\d+)\}\$$")
+# twobits code of nucleotides, 4 for other letters
+NUCLEOTIDE_CODES = np.full(256, 4, dtype=np.uint8)
+NUCLEOTIDE_CODES[list(b"ACTG")] = np.arange(4, dtype=np.uint8)
+APPEND_MODES = ["bulk", "update"]
+# Above this number of already existing documents in a volume batch, update handler requests cost more than a bulk merge
+UPDATE_HANDLER_LIMIT = 64
+# Seconds a volume statistics snapshot is reused
+STATS_TTL = 60
+# Design document of motif volumes, its update handler sets genome entries of a sgRNA document
+# on server side, as pycouch lambdaFuse does on client side
+DESIGN_ID = "_design/cstb_motifs"
+APPEND_HANDLER = """function(doc, req) {
+    var body = JSON.parse(req.body);
+    if (!doc) {
+        doc = {_id: req.id};
+    }
+    for (var uuid in body) {
+        doc[uuid] = body[uuid];
+    }
+    return [doc, "ok"];
+}"""
+
+def getSession(end_point, pool_size):
+    """Get pooled keep-alive session for a couch node, enlarging its connection pool if needed"""
+    session, size = _SESSIONS.get(end_point, (None, 0))
+    if session is None or size < pool_size:
+        session = requests.Session()
+        session.trust_env = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _SESSIONS[end_point] = (session, pool_size)
+    return session
 
 class MotifsDB():
-    def __init__(self, wrapper, mapping_rules):
+    """sgRNA motif volumes
+
+    :ivar append_mode: how genomes are added to existing sgRNA documents. "bulk" reads them with _bulk_get, merges them 
+    and writes them back with _bulk_docs. "update" writes documents blindly with _bulk_docs, so new ones need no read, then appends 
+    to conflicting (already existing) ones server side with the design document update handler, one request each without read, 
+    or with a bulk merge if there are more than UPDATE_HANDLER_LIMIT of them.
+    :vartype append_mode: str
+    """
+    def __init__(self, wrapper, mapping_rules, append_mode="bulk"):
         self.wrapper = wrapper
+        if not append_mode in APPEND_MODES:
+            raise ValueError(f"Unknown append mode {append_mode}, must be one of {APPEND_MODES}")
+        self.append_mode = append_mode
+        self._handlers = set()
         if not os.path.isfile(mapping_rules):
             raise Exception(f"{mapping_rules} file doesn't exists")
-        self.volumes_list = self._volumes_list(mapping_rules)
+        self.rules = self._mapping_rules(mapping_rules)
+        self.volumes_list = list(self.rules.values())
+        self._compiled_rules = [ (re.compile(regExp), volume) for regExp, volume in self.rules.items() ]
+        self._compileRouter()
+        self.throughput = {}
+        self._stats = None
 
-    def _volumes_list(self, mapping_rules):
+    def _mapping_rules(self, mapping_rules):
         with open(mapping_rules) as f:
             mapping_dict = json.load(f)
-        return list(mapping_dict.values())
+        return mapping_dict
+
+    def _volumes_list(self, mapping_rules):
+        return list(self._mapping_rules(mapping_rules).values())
+
+    def _compileRouter(self):
+        """Compile prefix rules (^<prefix>[ACGT]{n}$) into a lookup table from prefix twobits code to rule rank.
+        Other rules are kept as regexes, checked in rules order for keys the table can't route.
+        """
+        prefixes = {}
+        self._regexRules = []
+        for rank, (regExp, volume) in enumerate(self.rules.items()):
+            match = PREFIX_RULE.match(regExp)
+            if match and len(match.group(1)) <= MAX_PREFIX_LENGTH:
+                prefixes[rank] = (match.group(1), len(match.group(1)) + int(match.group(2)))
+            else:
+                self._regexRules.append( (rank, self._compiled_rules[rank][0]) )
+        self._volumeIndex = { volume: i for i, volume in enumerate(dict.fromkeys(self.volumes_list)) }
+        self._volumes = list(self._volumeIndex)
+        self._rankVolume = np.array([ self._volumeIndex[volume] for volume in self.rules.values() ], dtype=np.int32)
+        self._prefixLength = max((len(prefix) for prefix, _ in prefixes.values()), default=0)
+        # rule rank and key length of each prefix, -1 if no rule
+        self._table = np.full(4 ** self._prefixLength, -1, dtype=np.int32)
+        self._tableLength = np.full(4 ** self._prefixLength, -1, dtype=np.int32)
+        for rank in sorted(prefixes, reverse=True):
+            prefix, length = prefixes[rank]
+            start = self._prefixCode(prefix) << (2 * (self._prefixLength - len(prefix)))
+            end = start + 4 ** (self._prefixLength - len(prefix))
+            self._table[start:end] = rank
+            self._tableLength[start:end] = length
+        logging.debug(f"motifs::_compileRouter:{len(prefixes)} rules compiled on {self._prefixLength} letters prefixes, {len(self._regexRules)} regex rules")
+
+    def _prefixCode(self, prefix):
+        code = 0
+        for letter in prefix.encode():
+            code = (code << 2) | int(NUCLEOTIDE_CODES[letter])
+        return code
+
+    def _regexRank(self, key, maxRank=None):
+        for rank, regExp in self._regexRules:
+            if maxRank is not None and rank >= maxRank:
+                break
+            if regExp.search(key):
+                return rank
+        return None
+
+    def route(self, keys):
+        """Volume of each sgRNA key in one vectorized pass over routing table.
+        Keys the table can't route, or that an earlier regex rule may catch, are matched against regex rules.
+
+        :param keys: sgRNA keys
+        :type keys: List[str]
+        :return: index of each key volume in volumes, -1 if no rule matches
+        :rtype: np.ndarray
+        """
+        nbKeys = len(keys)
+        routes = np.full(nbKeys, -1, dtype=np.int32)
+        if not nbKeys:
+            return routes
+        P = self._prefixLength
+        lengths = np.fromiter((len(k) for k in keys), dtype=np.int64, count=nbKeys)
+        ranks = np.full(nbKeys, -1, dtype=np.int32)
+        raw = "".join(keys).encode()
+        if len(raw) == lengths.sum() and len(raw):
+            letters = NUCLEOTIDE_CODES[np.frombuffer(raw, dtype=np.uint8)]
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            # key must only hold ACGT to match the [ACGT]{n} part of the rule
+            acgt = np.add.reduceat(np.append(letters == 4, False).astype(np.int32), starts) == 0
+            codes = np.zeros(nbKeys, dtype=np.int64)
+            for column in range(P):
+                codes = (codes << 2) | letters[np.minimum(starts + column, len(raw) - 1)]
+            candidates = acgt & (lengths >= max(P, 1))
+            codes = np.where(candidates, codes, 0)
+            tableRanks = self._table[codes]
+            ok = candidates & (tableRanks >= 0) & (self._tableLength[codes] == lengths)
+            ranks[ok] = tableRanks[ok]
+        else:
+            # non ascii keys, table can't be used
+            for i, key in enumerate(keys):
+                ranks[i] = next((rank for rank, (regExp, _) in enumerate(self._compiled_rules) if regExp.search(key)), -1)
+        if self._regexRules and len(raw) == lengths.sum():
+            firstRegexRank = self._regexRules[0][0]
+            for i in np.nonzero((ranks < 0) | (ranks > firstRegexRank))[0].tolist():
+                rank = self._regexRank(keys[i], ranks[i] if ranks[i] >= 0 else None)
+                if rank is not None:
+                    ranks[i] = rank
+        routed = ranks >= 0
+        routes[routed] = self._rankVolume[ranks[routed]]
+        return routes
+
+    def volume(self, key):
+        """Volume of a sgRNA key, None if no rule matches"""
+        route = self.route([key])[0]
+        return self._volumes[route] if route >= 0 else None
+
+    def shard(self, batch):
+        """Split a sgRNA batch by target volume
+
+        :param batch: sgRNA dictionnary
+        :type batch: Dict
+        :return: sgRNA dictionnaries by volume
+        :rtype: Dict -> {volume: {sgRNA: value}}
+        """
+        keys = list(batch.keys())
+        routes = self.route(keys)
+        shards = {}
+        for k, route in zip(keys, routes.tolist()):
+            if route < 0:
+                logging.warn(f"motifs::shard:No volume for {k}")
+                continue
+            shards.setdefault(self._volumes[route], {})[k] = batch[k]
+        return shards
+
+    def insert(self, batch, writers=1):
+        """Insert a sgRNA batch, with one concurrent writer per volume and at most writers requests in flight.
+        Existing documents are merged with pycouch lambdaFuse, as wrapper.volDocAdd does.
+
+        :param batch: sgRNA dictionnary
+        :type batch: Dict
+        :param writers: maximal number of volumes written simultaneously, defaults to 1
+        :type writers: int, optional
+        :return: number of written documents and keys of documents still not written after MAX_TRIES tries, by volume
+        :rtype: Dict -> {volume: (int, List[str])}
+        """
+        shards = self.shard(batch)
+        session = getSession(self.wrapper.end_point, writers)
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            futures = { volume: executor.submit(self._insertVolume, session, volume, shard) for volume, shard in shards.items() }
+            return { volume: future.result() for volume, future in futures.items() }
+
+    def _insertVolume(self, session, volume, shard):
+        start = time.time()
+        if self.append_mode == "update":
+            written, failed = self._appendVolume(session, volume, shard)
+        else:
+            written, failed = self._mergeVolume(session, volume, shard)
+        self._addThroughput(volume, written, time.time() - start)
+        return written, failed
+
+    def _mergeVolume(self, session, volume, shard):
+        """Merge shard documents with existing ones, retrying failed ones
+        
+        :return: number of written documents and keys of the ones given up after MAX_TRIES tries
+        :rtype: Tuple[int, List[str]]
+        """
+        left = shard
+        written = 0
+        tries = 0
+        while left:
+            ok, err = self._mergeDocs(session, volume, left)
+            written += len(ok)
+            if not err:
+                break
+            tries += 1
+            if tries >= MAX_TRIES:
+                logging.error(f"motifs::_insertVolume:{MAX_TRIES} tries failed for {len(err)} documents in {volume}, giving up")
+                return written, [ e["id"] for e in err ]
+            logging.debug(f"motifs::_insertVolume:retrying {len(err)} documents in {volume}, try {tries}")
+            if any(e.get("error") != "conflict" for e in err):
+                time.sleep(5)
+            errIds = set(e["id"] for e in err)
+            left = { k: v for k, v in left.items() if k in errIds }
+        return written, []
+
+    def bulkLoad(self, runs, batchSize=10000, writers=1):
+        """Load volumes built offline, each document written once with _bulk_docs, so with a single revision
+        in empty volumes. Documents already in a volume are merged instead.
+
+        :param runs: sgRNA documents sorted by volume
+        :type runs: VolumeRuns
+        :param batchSize: number of documents by _bulk_docs request, defaults to 10000
+        :type batchSize: int, optional
+        :param writers: maximal number of volumes written simultaneously, defaults to 1
+        :type writers: int, optional
+        :return: number of written documents and uuids of the genomes of documents still not written after MAX_TRIES tries, by volume
+        :rtype: Dict -> {volume: (int, Set[str])}
+        """
+        session = getSession(self.wrapper.end_point, writers)
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            futures = { volume: executor.submit(self._loadVolume, session, volume, runs.docs(volume), batchSize) for volume in runs.volumes }
+            return { volume: future.result() for volume, future in futures.items() }
+
+    def _loadVolume(self, session, volume, docs, batchSize):
+        start = time.time()
+        written = 0
+        merged = 0
+        failed = set()
+        while True:
+            chunk = list(itertools.islice(docs, batchSize))
+            if not chunk:
+                break
+            try:
+                ok, err = self._bulkDocs(session, volume, chunk)
+            except (requests.RequestException, pycouch_error.CouchWrapperError, ValueError) as e:
+                ok, err = [], [ {"id": doc["_id"], "error": str(e)} for doc in chunk ]
+            written += len(ok)
+            if err:
+                errIds = set(e["id"] for e in err)
+                merged += sum(e.get("error") == "conflict" for e in err)
+                nbMerged, errKeys = self._mergeVolume(session, volume, { doc["_id"]: { k: v for k, v in doc.items() if k != "_id" } for doc in chunk if doc["_id"] in errIds })
+                written += nbMerged
+                errKeys = set(errKeys)
+                failed.update( uuid for doc in chunk if doc["_id"] in errKeys for uuid in doc if uuid != "_id" )
+        if merged:
+            logging.warn(f"motifs::bulkLoad:{merged} documents already in {volume} were merged, they have several revisions")
+        self._addThroughput(volume, written, time.time() - start)
+        return written, failed
+
+    def remove(self, keys, uuids, writers=1, batchSize=2000):
+        """Remove genomes from sgRNA documents, without scanning volumes : only documents of keys are read,
+        by batches of keys with _all_docs, stripped of genomes entries and written back with _bulk_docs.
+        Documents left without any genome are deleted. Volumes are processed concurrently.
+
+        :param keys: sgRNA keys carried by removed genomes
+        :type keys: List[str]
+        :param uuids: removed genomes uuids
+        :type uuids: List[str]
+        :param writers: maximal number of volumes processed simultaneously, defaults to 1
+        :type writers: int, optional
+        :param batchSize: number of keys by request, defaults to 2000
+        :type batchSize: int, optional
+        :return: number of updated and deleted documents, and keys of documents still not stripped after MAX_TRIES tries, by volume
+        :rtype: Dict -> {volume: (int, int, List[str])}
+        """
+        shards = {}
+        for k, route in zip(keys, self.route(keys).tolist()):
+            if route < 0:
+                logging.warn(f"motifs::remove:No volume for {k}")
+                continue
+            shards.setdefault(self._volumes[route], []).append(k)
+        session = getSession(self.wrapper.end_point, writers)
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            futures = { volume: executor.submit(self._removeVolume, session, volume, shard, set(uuids), batchSize) for volume, shard in shards.items() }
+            return { volume: future.result() for volume, future in futures.items() }
+
+    def _removeVolume(self, session, volume, keys, uuids, batchSize):
+        updated = 0
+        deleted = 0
+        unremoved = []
+        for i in range(0, len(keys), batchSize):
+            left = keys[i:i + batchSize]
+            tries = 0
+            while left:
+                try:
+                    docs = []
+                    for doc in self._allDocs(session, volume, left):
+                        if not any(uuid in doc for uuid in uuids):
+                            continue
+                        stripped = { k: v for k, v in doc.items() if not k in uuids }
+                        if all(k.startswith("_") for k in stripped):
+                            stripped = {"_id": doc["_id"], "_rev": doc["_rev"], "_deleted": True}
+                        docs.append(stripped)
+                    ok, err = self._bulkDocs(session, volume, docs) if docs else ([], [])
+                except (requests.RequestException, pycouch_error.CouchWrapperError, ValueError) as e:
+                    ok, err = [], [ {"id": key, "error": str(e)} for key in left ]
+                    docs = []
+                okIds = set(a["id"] for a in ok)
+                nbDeleted = sum(1 for doc in docs if doc.get("_deleted") and doc["_id"] in okIds)
+                deleted += nbDeleted
+                updated += len(okIds) - nbDeleted
+                if not err:
+                    break
+                tries += 1
+                if tries >= MAX_TRIES:
+                    logging.error(f"motifs::_removeVolume:{MAX_TRIES} tries failed for {len(err)} documents in {volume}, giving up")
+                    unremoved += [ e["id"] for e in err ]
+                    break
+                # conflicts are documents written meanwhile, read again and strip them again
+                if any(e.get("error") != "conflict" for e in err):
+                    time.sleep(5)
+                left = [ e["id"] for e in err ]
+        logging.info(f"motifs::remove:{updated} documents updated and {deleted} deleted in {volume}")
+        return updated, deleted, unremoved
+
+    def _allDocs(self, session, volume, keys):
+        """Current documents of keys with a single _all_docs request, missing or deleted ones are left out"""
+        r = session.post(f"{self.wrapper.end_point}/{volume}/_all_docs", params={"include_docs": "true"}, json={"keys": keys})
+        data = json.loads(r.text)
+        if not "rows" in data:
+            raise pycouch_error.CouchWrapperError(f"Unsuccessful _all_docs at {volume} : {data}")
+        return [ row["doc"] for row in data["rows"] if row.get("doc") ]
+
+    def _mergeDocs(self, session, volume, docs):
+        """Read current documents, merge them with new ones and write them back, one _bulk_get and one _bulk_docs"""
+        try:
+            current = self._bulkGet(session, volume, list(docs.keys()))
+            merged = []
+            for key, value in docs.items():
+                doc = dict(value)
+                doc["_id"] = key
+                if key in current:
+                    doc = pycouch_wrapper.lambdaFuse(current[key], doc)
+                merged.append(doc)
+            return self._bulkDocs(session, volume, merged)
+        except (requests.RequestException, pycouch_error.CouchWrapperError, ValueError) as e:
+            return [], [ {"id": key, "error": str(e)} for key in docs ]
+
+    def _appendVolume(self, session, volume, shard):
+        """Insert shard documents as new ones, then append to already existing ones server side with update handler.
+        When more than UPDATE_HANDLER_LIMIT documents already exist, a single bulk merge is cheaper than one request each.
+
+        :return: number of written documents and keys of the ones given up after MAX_TRIES tries
+        :rtype: Tuple[int, List[str]]
+        """
+        self.installAppendHandler(session, volume)
+        written = 0
+        tries = 0
+        left = shard
+        while left:
+            try:
+                ok, err = self._bulkDocs(session, volume, [ dict(value, _id=key) for key, value in left.items() ])
+            except (requests.RequestException, pycouch_error.CouchWrapperError, ValueError) as e:
+                ok, err = [], [ {"id": key, "error": str(e)} for key in left ]
+            written += len(ok)
+            existing = [ e["id"] for e in err if e.get("error") == "conflict" ]
+            failed = set(e["id"] for e in err if e.get("error") != "conflict")
+            sleep = bool(failed)
+            if len(existing) > UPDATE_HANDLER_LIMIT:
+                ok, err = self._mergeDocs(session, volume, { key: left[key] for key in existing })
+                written += len(ok)
+                failed |= set(e["id"] for e in err)
+                sleep = sleep or any(e.get("error") != "conflict" for e in err)
+            else:
+                for key in existing:
+                    if self._appendDoc(session, volume, key, left[key]):
+                        written += 1
+                    else:
+                        failed.add(key)
+            if not failed:
+                break
+            tries += 1
+            if tries >= MAX_TRIES:
+                logging.error(f"motifs::_appendVolume:{MAX_TRIES} tries failed for {len(failed)} documents in {volume}, giving up")
+                return written, sorted(failed)
+            logging.debug(f"motifs::_appendVolume:retrying {len(failed)} documents in {volume}, try {tries}")
+            if sleep:
+                time.sleep(5)
+            left = { k: v for k, v in left.items() if k in failed }
+        return written, []
+
+    def _appendDoc(self, session, volume, key, value, tries=5):
+        for _ in range(tries):
+            try:
+                r = session.put(f"{self.wrapper.end_point}/{volume}/{DESIGN_ID}/_update/append/{quote(key, safe='')}", json=value)
+            except requests.RequestException as e:
+                logging.debug(f"motifs::_appendDoc:{key} in {volume} : {e}")
+                continue
+            if r.status_code in (200, 201, 202):
+                return True
+            # 409 if document changed between handler read and write
+            logging.debug(f"motifs::_appendDoc:{key} in {volume} : {r.status_code} {r.text}")
+        return False
+
+    def installAppendHandler(self, session, volume):
+        """Create or update volume design document holding the append update handler.
+        A conflict means another writer changed the design document meanwhile, it is read and checked again.
+        """
+        if volume in self._handlers:
+            return
+        url = f"{self.wrapper.end_point}/{volume}/{DESIGN_ID}"
+        for _ in range(MAX_TRIES):
+            r = session.get(url)
+            design = json.loads(r.text) if r.status_code == 200 else {"_id": DESIGN_ID}
+            if design.get("updates", {}).get("append") == APPEND_HANDLER:
+                break
+            design.setdefault("updates", {})["append"] = APPEND_HANDLER
+            r = session.put(url, json=design)
+            if r.status_code in (201, 202):
+                logging.info(f"motifs::installAppendHandler:append handler installed in {volume}")
+                break
+            if r.status_code != 409:
+                raise pycouch_error.CouchWrapperError(f"Can't install append handler in {volume} : {r.text}")
+            logging.debug(f"motifs::installAppendHandler:design document of {volume} changed meanwhile, checking it again")
+        else:
+            raise pycouch_error.CouchWrapperError(f"Can't install append handler in {volume} : {MAX_TRIES} conflicting updates")
+        self._handlers.add(volume)
+
+    def _bulkGet(self, session, volume, keys, packetSize=2000):
+        """Get current documents for keys, missing or deleted ones are left out"""
+        current = {}
+        for i in range(0, len(keys), packetSize):
+            r = session.post(f"{self.wrapper.end_point}/{volume}/_bulk_get", json={"docs": [ {"id": k} for k in keys[i:i + packetSize] ]})
+            data = json.loads(r.text)
+            if not "results" in data:
+                raise pycouch_error.CouchWrapperError(f"Unsuccessful _bulk_get at {volume} : {data}")
+            for result in data["results"]:
+                datum = result["docs"][0]
+                if "ok" in datum:
+                    current[result["id"]] = datum["ok"]
+        return current
+
+    def _bulkDocs(self, session, volume, docs):
+        r = session.post(f"{self.wrapper.end_point}/{volume}/_bulk_docs", json={"docs": docs})
+        ans = json.loads(r.text)
+        if not isinstance(ans, list):
+            raise pycouch_error.CouchWrapperError(f"Unsuccessful _bulk_docs at {volume} : {ans}")
+        ok = [ a for a in ans if a.get("ok") ]
+        err = [ a for a in ans if not a.get("ok") ]
+        return ok, err
+
+    def _addThroughput(self, volume, nb_docs, duration):
+        docs, seconds = self.throughput.get(volume, (0, 0.0))
+        self.throughput[volume] = (docs + nb_docs, seconds + duration)
+        logging.info(f"motifs::insert:{nb_docs} documents written in {volume} ({nb_docs / duration if duration else 0:.0f} docs/s)")
+
+    def throughputReport(self):
+        """Log and return cumulated documents, seconds and documents per second for each volume"""
+        report = { volume: {"docs": docs, "seconds": seconds, "docs_per_second": docs / seconds if seconds else 0} for volume, (docs, seconds) in sorted(self.throughput.items()) }
+        total_docs = sum(r["docs"] for r in report.values())
+        total_seconds = sum(r["seconds"] for r in report.values())
+        logging.info(f"motifs::throughputReport:{total_docs} documents written in {len(report)} volumes ({total_seconds:.1f} cumulated writer seconds)")
+        for volume, r in report.items():
+            logging.info(f"motifs::throughputReport:{volume}\t{r['docs']}\t{r['docs_per_second']:.0f} docs/s")
+        return report
+
+    def volumeStats(self, writers=16, ttl=STATS_TTL, refresh=False):
+        """Statistics of all volumes, queried concurrently. The snapshot is kept and returned again for ttl seconds.
+
+        :param writers: maximal number of volumes queried simultaneously, defaults to 16
+        :type writers: int, optional
+        :param ttl: age in seconds under which last snapshot is reused, defaults to STATS_TTL
+        :type ttl: float, optional
+        :param refresh: query volumes even if last snapshot is recent enough, defaults to False
+        :type refresh: bool, optional
+        :return: document count, deleted document count, active, file and external sizes in bytes, and fragmentation
+        (share of file size not used by live data) of each volume. Document count is the number of sgRNA documents :
+        design documents (as the append handler one, DESIGN_ID) are counted by CouchDB and subtracted here
+        :rtype: Dict -> {volume: {"doc_count": int, "doc_del_count": int, "active_size": int, "file_size": int, "external_size": int, "fragmentation": float}}
+        """
+        if not refresh and self._stats and time.time() - self._stats[0] < ttl:
+            return self._stats[1]
+        session = getSession(self.wrapper.end_point, writers)
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            futures = { volume: executor.submit(self._volumeStats, session, volume) for volume in dict.fromkeys(self.volumes_list) }
+            stats = { volume: future.result() for volume, future in futures.items() }
+        self._stats = (time.time(), stats)
+        return stats
+
+    def _volumeStats(self, session, volume):
+        r = session.get(f"{self.wrapper.end_point}/{volume}")
+        answer = json.loads(r.text)
+        if "error" in answer:
+            raise pycouch_error.CouchWrapperError(f"error when try to interrogate {volume} : {answer}")
+        if not "doc_count" in answer:
+            raise pycouch_error.CouchWrapperError(f"Can't have doc count for {volume} : {answer}")
+        sizes = answer.get("sizes", {})
+        active = sizes.get("active", 0)
+        fileSize = sizes.get("file", 0)
+        return {"doc_count": answer["doc_count"] - self._designCount(session, volume), "doc_del_count": answer.get("doc_del_count", 0),
+                "active_size": active, "file_size": fileSize, "external_size": sizes.get("external", 0),
+                "fragmentation": (fileSize - active) / fileSize if fileSize else 0.0}
+
+    def _designCount(self, session, volume):
+        """Number of design documents of a volume, read from the _design/ range of _all_docs"""
+        r = session.get(f"{self.wrapper.end_point}/{volume}/_all_docs", params={"startkey": json.dumps("_design/"), "endkey": json.dumps("_design0")})
+        answer = json.loads(r.text)
+        if not "rows" in answer:
+            raise pycouch_error.CouchWrapperError(f"Can't list design documents of {volume} : {answer}")
+        return len(answer["rows"])
 
     @property
     def stats_per_volume(self):
-        result_dic = {}
-        for v in self.volumes_list:
-            answer = self.wrapper.couchGetRequest(v)
-            if "error" in answer:
-                raise Exception(f"error when try to interrogate {v} : {answer}")
-            
-            if not "doc_count" in answer:
-                raise Exception(f"Can't have doc count for {v} : {answer}")
-
-            result_dic[v] = {"nb_motifs" : answer["doc_count"], "size":answer["sizes"]}
+        return { volume: {"nb_motifs": stats["doc_count"], "size": {"active": stats["active_size"], "file": stats["file_size"], "external": stats["external_size"]}} for volume, stats in self.volumeStats().items() }
 
-        return result_dic
+    @property
+    def entries_per_volume(self):
+        """Number of sgRNA documents of each volume, design documents left out"""
+        return { volume: stats["doc_count"] for volume, stats in self.volumeStats().items() }
 
     def hasView(self):
         pass
-            
 
-         
+
+
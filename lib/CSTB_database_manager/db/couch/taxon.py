@@ -1,5 +1,5 @@
 from typeguard import typechecked
-from typing import TypedDict, Optional, List
+from typing import TypedDict, Optional, List, Dict, Iterable
 import CSTB_database_manager.db.couch.virtual
 import CSTB_database_manager.db.couch.genome as genomeDB
 import CSTB_database_manager.utils.error as error
@@ -22,17 +22,7 @@ class TaxonDB(CSTB_database_manager.db.couch.virtual.Database):
                  }
             }
             doc = self.wrapper.couchPostDoc(self.db_name + "/_find", taxid_mango_query)
-            if not doc['docs']:
-                return None
-            
-            if len(doc['docs']) > 1:
-                raise error.DuplicateError(f'{taxid} exists {len(doc["docs"])} times in taxon database')
-            
-            # Check if name corresponds
-            doc = doc['docs'][0]
-            if doc["name"] != name:
-                raise error.ConsistencyError(f'{taxid} exists in taxon database but associated with an other name (name : {doc["name"]}). Update taxon if you want to insert.')
-            return TaxonEntity(self, doc)
+            return self.fromDocs(doc['docs'], name, taxid)
 
         name_mango_query = {
             "selector": {
@@ -41,14 +31,39 @@ class TaxonDB(CSTB_database_manager.db.couch.virtual.Database):
         }
 
         doc = self.wrapper.couchPostDoc(self.db_name + "/_find", name_mango_query)
-        
-        if not doc['docs']:
+        return self.fromDocs(doc['docs'], name)
+
+    def findByTaxid(self, taxids: Iterable[int]) -> Dict[int, List[Dict]]:
+        """Get taxon documents for several taxids with $in mango queries"""
+        return self.find_in("taxid", taxids)
+
+    def findByName(self, names: Iterable[str]) -> Dict[str, List[Dict]]:
+        """Get taxon documents for several names with $in mango queries"""
+        return self.find_in("name", names)
+
+    def fromDocs(self, docs: List[Dict], name: str, taxid: int = None) -> Optional['TaxonEntity']:
+        """Create Taxon Entity from the documents found for one taxid, or for one name if taxid is not provided
+
+        :raises error.DuplicateError: Raises if taxid or name is duplicated in database
+        :raises error.ConsistencyError: Raises if taxid exists in database with an other name
+        """
+        if not docs:
             return None
 
-        if len(doc['docs']) > 1:
-            raise error.DuplicateError(f'{name} exists {len(doc["docs"])} times in taxon database associated with no taxid')
+        if taxid:
+            if len(docs) > 1:
+                raise error.DuplicateError(f'{taxid} exists {len(docs)} times in taxon database')
+            
+            # Check if name corresponds
+            doc = docs[0]
+            if doc["name"] != name:
+                raise error.ConsistencyError(f'{taxid} exists in taxon database but associated with an other name (name : {doc["name"]}). Update taxon if you want to insert.')
+            return TaxonEntity(self, doc)
+
+        if len(docs) > 1:
+            raise error.DuplicateError(f'{name} exists {len(docs)} times in taxon database associated with no taxid')
         
-        return TaxonEntity(self,doc['docs'][0])
+        return TaxonEntity(self, docs[0])
     
     #def create_insert_doc(self, name: str, taxid: int = None) -> TaxonDoc:
     #    return {
@@ -57,9 +72,9 @@ class TaxonDB(CSTB_database_manager.db.couch.virtual.Database):
     #         "taxid": taxid         
     #    }
 
-    def createNewTaxon(self, name: str, taxid: int = None) -> 'TaxonEntity':
+    def createNewTaxon(self, name: str, taxid: int = None, uuid: str = None) -> 'TaxonEntity':
         doc = {
-            "_id": self.wrapper.couchGenerateUUID(),
+            "_id": uuid if uuid else self.wrapper.couchGenerateUUID(),
             "name" : name,
             "taxid" : taxid
         }
@@ -3,7 +3,7 @@ from datetime import datetime
 import pycouch.wrapper as pycouch_wrapper
 import CSTB_database_manager.utils.error as error
 from typeguard import typechecked
-from typing import TypedDict, Set
+from typing import TypedDict, Set, Dict, List, Tuple, Iterable
 import logging
 
 class PositivePutAnswer(TypedDict):
@@ -49,6 +49,68 @@ class Database():
 
         return doc["docs"]
     
+    def find_in(self, field: str, values: Iterable, chunk_size: int = 1000) -> Dict:
+        """Get all documents whose field value is in values, with one $in mango query per chunk of values
+        
+        :param field: document field to look at
+        :type field: str
+        :param values: values to search
+        :type values: Iterable
+        :param chunk_size: number of values per mango query, defaults to 1000
+        :type chunk_size: int, optional
+        :raises error.MangoQueryError: Raises if query can't be execute
+        :return: documents grouped by field value
+        :rtype: Dict -> {value: [documents]}
+        """
+        values = list(set(values))
+        grouped = {}
+        for i in range(0, len(values), chunk_size):
+            chunk = values[i:i + chunk_size]
+            mango_query = {
+                "selector": {
+                    field: {"$in": chunk}
+                },
+                "limit": 2 * len(chunk)
+            }
+            while True:
+                try:
+                    doc = self.wrapper.couchPostDoc(self.db_name + "/_find", mango_query)
+                except pycouch_wrapper.CouchWrapperError as e :
+                    raise error.MangoQueryError(f"Can't execute mango query because of CouchWrapperError\n{e}")
+                for d in doc["docs"]:
+                    grouped.setdefault(d[field], []).append(d)
+                if len(doc["docs"]) < mango_query["limit"]:
+                    break
+                mango_query["bookmark"] = doc["bookmark"]
+        return grouped
+
+    def bulk_add(self, docs: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Add or update several documents with a single _bulk_docs request
+        
+        :param docs: json documents to write, with _rev for updates
+        :type docs: List[Dict]
+        :return: couch answers for written documents and for rejected documents
+        :rtype: Tuple[List[Dict], List[Dict]]
+        """
+        if not docs:
+            return [], []
+        ans = self.wrapper.couchPostDoc(self.db_name + "/_bulk_docs", {"docs": docs})
+        ok = [a for a in ans if a.get("ok")]
+        err = [a for a in ans if not a.get("ok")]
+        return ok, err
+
+    def generate_uuids(self, count: int) -> List[str]:
+        """Get several uuids from couch in one request
+        
+        :param count: number of uuids
+        :type count: int
+        :return: list of uuids
+        :rtype: List[str]
+        """
+        if not count:
+            return []
+        return self.wrapper.couchGetRequest("_uuids", {"count": count})["uuids"]
+
     @property
     def number_of_entries(self) -> int:
         """Get number of entries in database
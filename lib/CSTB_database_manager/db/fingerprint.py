@@ -0,0 +1,101 @@
+import os, json, sqlite3
+import logging
+from typing import Dict, Iterable, Optional
+from CSTB_database_manager.engine.fasta_reader import FastaDigest, resolveFasta
+
+def connect(fingerprint_file):
+    return FingerprintCache(fingerprint_file)
+
+def _fingerprint(stat: os.stat_result):
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+class FingerprintCache():
+    """Local sqlite cache of fasta md5, sequences sizes and headers.
+    Entries are keyed by path of the file read (fasta, or fasta.gz if only the compressed file exists)
+    and only valid while file size, mtime and inode are unchanged.
+
+    :ivar fingerprint_file: path to sqlite file
+    :vartype fingerprint_file: str
+    """
+    def __init__(self, fingerprint_file):
+        self.fingerprint_file = fingerprint_file
+        self.conn = sqlite3.connect(fingerprint_file, isolation_level=None, timeout=60)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS fingerprints (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, md5 TEXT, sizes TEXT, headers TEXT, conflict TEXT)")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fasta: str) -> Optional[FastaDigest]:
+        """Summary of fasta (digest without records) if cached entry is still valid, None otherwise
+
+        :raises FileNotFoundError: Raise if fasta doesn't exist
+        """
+        path = os.path.abspath(resolveFasta(fasta))
+        stat = os.stat(path)
+        row = self.conn.execute("SELECT size, mtime_ns, inode, md5, sizes, headers, conflict FROM fingerprints WHERE path = ?", (path,)).fetchone()
+        if not row or tuple(row[:3]) != _fingerprint(stat):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return FastaDigest.fromSummary(fasta, row[3], json.loads(row[4]), json.loads(row[5]), row[6])
+
+    def put(self, digest: FastaDigest):
+        """Store digest md5, sizes and headers, with fasta stats taken before its read"""
+        path = os.path.abspath(digest.path)
+        self.conn.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, *_fingerprint(digest.stat), digest.md5, json.dumps(digest.size), json.dumps(digest.headers), digest._conflict))
+
+    @property
+    def paths(self):
+        return [ row[0] for row in self.conn.execute("SELECT path FROM fingerprints ORDER BY path") ]
+
+    def validate(self, full: bool = False) -> Dict[str, str]:
+        """Check every entry against file system
+
+        :param full: rehash files whose stats are unchanged and compare md5, defaults to False
+        :type full: bool, optional
+        :return: problem of each invalid entry : "missing", "stale" (stats changed) or "corrupted" (same stats, different md5)
+        :rtype: Dict -> {path: problem}
+        """
+        report = {}
+        for path, size, mtime_ns, inode, md5 in self.conn.execute("SELECT path, size, mtime_ns, inode, md5 FROM fingerprints ORDER BY path").fetchall():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                report[path] = "missing"
+                continue
+            if (size, mtime_ns, inode) != _fingerprint(stat):
+                report[path] = "stale"
+            elif full and FastaDigest(path).md5 != md5:
+                report[path] = "corrupted"
+        return report
+
+    def rebuild(self, fastaList: Iterable[str] = (), prune: bool = True, full: bool = False) -> Dict[str, int]:
+        """Recompute invalid entries and add entries for new fasta files
+
+        :param fastaList: fasta files to add to cache if not already valid in it
+        :type fastaList: Iterable[str]
+        :param prune: delete entries of missing files, defaults to True
+        :type prune: bool, optional
+        :param full: rehash every entry, see validate, defaults to False
+        :type full: bool, optional
+        :return: number of "added", "updated" and "deleted" entries
+        :rtype: Dict[str, int]
+        """
+        counts = {"added": 0, "updated": 0, "deleted": 0}
+        for path, problem in self.validate(full).items():
+            if problem == "missing":
+                if prune:
+                    self.conn.execute("DELETE FROM fingerprints WHERE path = ?", (path,))
+                    counts["deleted"] += 1
+                continue
+            self.put(FastaDigest(path))
+            counts["updated"] += 1
+        for fasta in fastaList:
+            if self.get(fasta) is None:
+                self.put(FastaDigest(fasta))
+                counts["added"] += 1
+        logging.info(f"fingerprint::rebuild:{counts}")
+        return counts
+
+    def close(self):
+        self.conn.close()
@@ -1,15 +1,301 @@
-import os, glob
+import os, glob, mmap, struct
+import logging
+from typing import Iterable, Iterator, List, Tuple
+import numpy as np
+import CSTB_database_manager.utils.error as error
+from CSTB_database_manager.engine.minhash import sketchCodes, jaccardEstimates, SKETCH_SIZE
 
-def connect(index_folder):
+TEXT_EXTENSION = ".index"
+BINARY_EXTENSION = ".bindex"
+FORMATS = ["text", "binary"]
+MAGIC = b"CSTBIX01"
+# word length, number of codes, codec name
+HEADER = struct.Struct("<IQ16s")
+HEADER_SIZE = 64
+SKETCH_EXTENSION = ".sketch"
+SKETCH_MAGIC = b"CSTBSK01"
+# number of bins, hash seed, number of codes sketched
+SKETCH_HEADER = struct.Struct("<IIQ")
+
+def connect(index_folder, index_format="text"):
     if not os.path.isdir(index_folder):
         raise error.IndexConnectionError("Index directory doesn't exist.")
 
-    return IndexDB(index_folder)
+    return IndexDB(index_folder, index_format)
+
+def writeBinaryIndex(codes, counts, fname: str, wLen: int, codec: str) -> int:
+    """Write sorted codes and their occurences in binary index format :
+    magic, header (word length, number of codes, codec), uint64 codes, uint32 counts
+
+    :return: number of codes written
+    :rtype: int
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    return writeBinaryIndexChunks([(codes, counts)], len(codes), fname, wLen, codec)
+
+def _checkedChunks(chunks: Iterable[Tuple[np.ndarray, np.ndarray]]) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    last = None
+    for codes, counts in chunks:
+        codes = np.asarray(codes, dtype=np.uint64)
+        counts = np.asarray(counts, dtype=np.uint32)
+        if len(codes) != len(counts):
+            raise ValueError(f"{len(codes)} codes for {len(counts)} counts")
+        if not len(codes):
+            continue
+        if (len(codes) > 1 and not np.all(codes[1:] > codes[:-1])) or (last is not None and codes[0] <= last):
+            raise ValueError("Index codes must be sorted and unique")
+        last = codes[-1]
+        yield codes, counts
+
+def writeBinaryIndexChunks(chunks: Iterable[Tuple[np.ndarray, np.ndarray]], nbCodes: int, fname: str, wLen: int, codec: str) -> int:
+    """Write binary index from successive (codes, counts) chunks, sorted and unique across chunks,
+    without holding the whole index in memory
+
+    :param nbCodes: total number of codes of the chunks
+    :type nbCodes: int
+    :raises ValueError: Raise if codes are not sorted or not nbCodes
+    :return: number of codes written
+    :rtype: int
+    """
+    written = 0
+    with open(fname, "wb") as fp:
+        fp.write(MAGIC + HEADER.pack(wLen, nbCodes, codec.encode()))
+        fp.write(b"\0" * (HEADER_SIZE - fp.tell()))
+        for codes, counts in _checkedChunks(chunks):
+            if written + len(codes) > nbCodes:
+                raise ValueError(f"More than {nbCodes} codes to write in {fname}")
+            fp.seek(HEADER_SIZE + 8 * written)
+            fp.write(codes.tobytes())
+            fp.seek(HEADER_SIZE + 8 * nbCodes + 4 * written)
+            fp.write(counts.tobytes())
+            written += len(codes)
+    if written != nbCodes:
+        raise ValueError(f"{written} codes written in {fname}, {nbCodes} expected")
+    return written
+
+def writeTextIndexChunks(chunks: Iterable[Tuple[np.ndarray, np.ndarray]], nbCodes: int, fname: str, wLen: int, codec: str) -> int:
+    """Same as writeBinaryIndexChunks, in CSTB_core sgRNAIndexWriter text format with occurences"""
+    written = 0
+    with open(fname, "w") as fp:
+        fp.write(f"# {nbCodes} {wLen} {codec}\n")
+        for codes, counts in _checkedChunks(chunks):
+            fp.write("".join(f"{code} {count}\n" for code, count in zip(codes.tolist(), counts.tolist())))
+            written += len(codes)
+    if written != nbCodes:
+        raise ValueError(f"{written} codes written in {fname}, {nbCodes} expected")
+    return written
+
+def sgRNABinaryIndexWriter(data: List[Tuple[int, int]], fname: str, wLen: int, codec: str) -> int:
+    """Same arguments as CSTB_core sgRNAIndexWriter, data is a sorted list of (code, occurences)"""
+    codes = np.fromiter((datum[0] for datum in data), dtype=np.uint64, count=len(data))
+    counts = np.fromiter((datum[1] for datum in data), dtype=np.uint32, count=len(data))
+    return writeBinaryIndex(codes, counts, fname, wLen, codec)
+
+def readTextIndex(fname: str) -> Tuple[np.ndarray, np.ndarray, int, str]:
+    """Parse a text index file
+
+    :return: codes, counts (1 for indexes written without occurences), word length and codec
+    :rtype: Tuple[np.ndarray, np.ndarray, int, str]
+    """
+    with open(fname) as fp:
+        header = fp.readline().split()
+        if len(header) < 4 or header[0] != "#":
+            raise IOError(f"Irregular header line in index file {fname}")
+        values = np.array(fp.read().split(), dtype=np.uint64)
+    nbCodes = int(header[1])
+    if len(values) == nbCodes:
+        return values, np.ones(nbCodes, dtype=np.uint32), int(header[2]), header[3]
+    if len(values) != 2 * nbCodes:
+        raise IOError(f"Irregular index file {fname}, {len(values)} values for {nbCodes} codes")
+    values = values.reshape(nbCodes, 2)
+    return values[:, 0].copy(), values[:, 1].astype(np.uint32), int(header[2]), header[3]
+
+def convertTextIndex(fname: str, fBinary: str = None) -> str:
+    """Convert a text index file to binary format
+
+    :return: binary index path, fname with .bindex extension by default
+    :rtype: str
+    """
+    fBinary = fBinary if fBinary else os.path.splitext(fname)[0] + BINARY_EXTENSION
+    codes, counts, wLen, codec = readTextIndex(fname)
+    writeBinaryIndex(codes, counts, fBinary, wLen, codec)
+    logging.info(f"index::convertTextIndex:{len(codes)} codes of {fname} wrote to {fBinary}")
+    return fBinary
+
+def writeSketch(sketch: np.ndarray, fname: str, nbCodes: int, seed: int = 0):
+    """Write a MinHash sketch : magic, header (number of bins, seed, number of codes sketched), uint64 bins"""
+    with open(fname, "wb") as fp:
+        fp.write(SKETCH_MAGIC + SKETCH_HEADER.pack(len(sketch), seed, nbCodes))
+        fp.write(np.asarray(sketch, dtype=np.uint64).tobytes())
+
+def readSketch(fname: str) -> Tuple[np.ndarray, int]:
+    """MinHash sketch and number of codes sketched"""
+    with open(fname, "rb") as fp:
+        content = fp.read()
+    if not content.startswith(SKETCH_MAGIC):
+        raise IOError(f"{fname} is not a sketch file")
+    size, _, nbCodes = SKETCH_HEADER.unpack_from(content, len(SKETCH_MAGIC))
+    return np.frombuffer(content, dtype=np.uint64, count=size, offset=len(SKETCH_MAGIC) + SKETCH_HEADER.size), nbCodes
+
+class MotifIndex():
+    """sgRNA index of a genome, memory mapped when in binary format
+
+    :ivar uuid: genome uuid
+    :vartype uuid: str
+    :ivar codes: sorted sgRNA codes
+    :vartype codes: np.ndarray
+    :ivar counts: occurences of each code
+    :vartype counts: np.ndarray
+    :ivar wLen: sgRNA length
+    :vartype wLen: int
+    :ivar codec: sgRNA encoding
+    :vartype codec: str
+    """
+    def __init__(self, uuid: str, fname: str):
+        self.uuid = uuid
+        self.fname = fname
+        self._fp = None
+        self._mmap = None
+        with open(fname, "rb") as fp:
+            binary = fp.read(len(MAGIC)) == MAGIC
+        if binary:
+            self._fp = open(fname, "rb")
+            self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self.wLen, nbCodes, codec = HEADER.unpack_from(self._mmap, len(MAGIC))
+            self.codec = codec.rstrip(b"\0").decode()
+            self.codes = np.frombuffer(self._mmap, dtype=np.uint64, count=nbCodes, offset=HEADER_SIZE)
+            self.counts = np.frombuffer(self._mmap, dtype=np.uint32, count=nbCodes, offset=HEADER_SIZE + 8 * nbCodes)
+        else:
+            self.codes, self.counts, self.wLen, self.codec = readTextIndex(fname)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __contains__(self, code: int) -> bool:
+        return self.count(code) > 0
+
+    def count(self, code: int) -> int:
+        """Occurences of a sgRNA code, 0 if absent"""
+        i = int(np.searchsorted(self.codes, np.uint64(code)))
+        if i < len(self.codes) and self.codes[i] == code:
+            return int(self.counts[i])
+        return 0
+
+    def close(self):
+        self.codes = self.counts = None
+        if self._mmap:
+            self._mmap.close()
+            self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 class IndexDB():
-    def __init__(self, index_db_folder):
+    def __init__(self, index_db_folder, index_format="text"):
         self.database_folder = index_db_folder
+        if not index_format in FORMATS:
+            raise ValueError(f"Unknown index format {index_format}, must be one of {FORMATS}")
+        self.index_format = index_format
+        # sketches kept in memory as rows of a matrix grown by doubling, in order of _sketchUuids
+        self._sketchUuids = []
+        self._sketchRows = {}
+        self._sketchMatrix = np.zeros((0, SKETCH_SIZE), dtype=np.uint64)
+        self._sketchesLoaded = False
 
     @property
     def all_ids(self):
-        return set([f.split("/")[-1].split(".")[0] for f in glob.glob(self.database_folder + "/*.index")])
\ No newline at end of file
+        return set([f.split("/")[-1].split(".")[0] for f in glob.glob(self.database_folder + "/*" + TEXT_EXTENSION) + glob.glob(self.database_folder + "/*" + BINARY_EXTENSION)])
+
+    def path(self, uuid: str) -> str:
+        """Index file of a genome, binary one if both formats exist
+
+        :raises FileNotFoundError: Raise if genome has no index file
+        """
+        for extension in (BINARY_EXTENSION, TEXT_EXTENSION):
+            fname = f"{self.database_folder}/{uuid}{extension}"
+            if os.path.isfile(fname):
+                return fname
+        raise FileNotFoundError(f"No index file for {uuid} in {self.database_folder}")
+
+    def open(self, uuid: str) -> MotifIndex:
+        """Open a genome index, binary files are memory mapped without copy.
+        Close it (or use it as context manager) to release the mapping.
+        """
+        return MotifIndex(uuid, self.path(uuid))
+
+    def sketchPath(self, uuid: str) -> str:
+        return f"{self.database_folder}/{uuid}{SKETCH_EXTENSION}"
+
+    def addSketch(self, uuid: str, codes: np.ndarray) -> np.ndarray:
+        """Compute and store MinHash sketch of a genome sgRNA codes, next to its index file"""
+        sketch = sketchCodes(np.asarray(codes, dtype=np.uint64))
+        return self.storeSketch(uuid, sketch, len(codes))
+
+    def storeSketch(self, uuid: str, sketch: np.ndarray, nbCodes: int) -> np.ndarray:
+        """Store an already computed MinHash sketch of nbCodes sgRNA codes, next to genome index file"""
+        writeSketch(sketch, self.sketchPath(uuid), nbCodes)
+        self._keepSketch(uuid, sketch)
+        return sketch
+
+    def _keepSketch(self, uuid: str, sketch: np.ndarray):
+        if uuid in self._sketchRows:
+            self._sketchMatrix[self._sketchRows[uuid]] = sketch
+            return
+        rank = len(self._sketchUuids)
+        if rank == len(self._sketchMatrix):
+            grown = np.zeros((max(2 * rank, 64), len(sketch)), dtype=np.uint64)
+            grown[:rank] = self._sketchMatrix[:rank]
+            self._sketchMatrix = grown
+        self._sketchMatrix[rank] = sketch
+        self._sketchRows[uuid] = rank
+        self._sketchUuids.append(uuid)
+
+    def buildSketches(self, uuids: List[str] = None, force: bool = False) -> int:
+        """Sketch indexed genomes without sketch (or all of them with force)
+
+        :return: number of sketches written
+        :rtype: int
+        """
+        nb = 0
+        for uuid in sorted(self.all_ids if uuids is None else uuids):
+            if not force and os.path.isfile(self.sketchPath(uuid)):
+                continue
+            with self.open(uuid) as index:
+                self.addSketch(uuid, index.codes)
+            nb += 1
+        logging.info(f"index::buildSketches:{nb} sketches wrote to {self.database_folder}")
+        return nb
+
+    def sketches(self) -> Tuple[List[str], np.ndarray]:
+        """uuids and stacked sketches of all sketched genomes. Sketch files are read on first call only,
+        sketches added afterwards are appended to the rows kept in memory. Both are views, not copies.
+        """
+        if not self._sketchesLoaded:
+            for fname in sorted(glob.glob(self.database_folder + "/*" + SKETCH_EXTENSION)):
+                uuid = os.path.basename(fname)[:-len(SKETCH_EXTENSION)]
+                if not uuid in self._sketchRows:
+                    self._keepSketch(uuid, readSketch(fname)[0])
+            self._sketchesLoaded = True
+        return self._sketchUuids, self._sketchMatrix[:len(self._sketchUuids)]
+
+    def nearest(self, sketch: np.ndarray, n: int = 5, exclude: str = None) -> List[Tuple[str, float]]:
+        """Genomes with highest estimated Jaccard index with a sketch, without reading their index
+
+        :param sketch: query sketch, see addSketch
+        :type sketch: np.ndarray
+        :param n: number of genomes returned, defaults to 5
+        :type n: int, optional
+        :param exclude: uuid to leave out, typically query genome itself, defaults to None
+        :type exclude: str, optional
+        :return: (uuid, estimated Jaccard index) by decreasing Jaccard index
+        :rtype: List[Tuple[str, float]]
+        """
+        uuids, matrix = self.sketches()
+        if not uuids:
+            return []
+        estimates = jaccardEstimates(matrix, sketch)
+        order = np.argsort(-estimates, kind="stable")
+        return [ (uuids[i], float(estimates[i])) for i in order if uuids[i] != exclude ][:n]
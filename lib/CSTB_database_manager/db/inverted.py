@@ -0,0 +1,278 @@
+import os, json, mmap, struct, uuid as uuidlib
+import logging
+from typing import Dict, Iterable, List, Set, Tuple
+import numpy as np
+
+MAGIC = b"CSTBIV01"
+# number of codes, number of postings, segment level
+HEADER = struct.Struct("<QQI")
+HEADER_SIZE = 64
+MANIFEST = "manifest.json"
+# Segments merged together as soon as there are FANOUT of them at the same level
+FANOUT = 8
+# Genome codes kept in memory before being written as a new segment
+FLUSH_SIZE = 50_000_000
+
+def connect(inverted_folder):
+    os.makedirs(inverted_folder, exist_ok=True)
+    return InvertedIndex(inverted_folder)
+
+def _postingsOf(codes: np.ndarray, ordinals: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sort (code, ordinal) pairs and group them by code
+
+    :return: unique codes, offsets of each code postings, ordinals sorted by code then ordinal
+    """
+    order = np.lexsort((ordinals, codes))
+    codes = codes[order]
+    ordinals = ordinals[order]
+    unique, firsts = np.unique(codes, return_index=True)
+    return unique, np.append(firsts, len(codes)).astype(np.uint64), ordinals
+
+def _lookupPostings(segmentCodes: np.ndarray, offsets: np.ndarray, ordinals: np.ndarray, codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Postings of query codes found in grouped postings, see _postingsOf
+
+    :return: query ranks and genome ordinals, one pair per posting
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    if not len(segmentCodes):
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.uint32)
+    positions = np.searchsorted(segmentCodes, codes)
+    positions[positions == len(segmentCodes)] = 0
+    found = np.nonzero(segmentCodes[positions] == codes)[0]
+    starts = offsets[positions[found]].astype(np.intp)
+    lengths = offsets[positions[found] + 1].astype(np.intp) - starts
+    total = int(lengths.sum())
+    # ranks of postings, range by range, without python loop
+    shifts = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return np.repeat(found, lengths), ordinals[shifts + np.arange(total)]
+
+def writeSegment(fname: str, codes: np.ndarray, offsets: np.ndarray, ordinals: np.ndarray, level: int):
+    """Write a segment : magic, header, then sorted uint64 codes, uint64 offsets (one more than codes), uint32 genome ordinals"""
+    tmp = fname + ".tmp"
+    with open(tmp, "wb") as fp:
+        fp.write(MAGIC + HEADER.pack(len(codes), len(ordinals), level))
+        fp.write(b"\0" * (HEADER_SIZE - fp.tell()))
+        fp.write(np.asarray(codes, dtype=np.uint64).tobytes())
+        fp.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+        fp.write(np.asarray(ordinals, dtype=np.uint32).tobytes())
+    os.replace(tmp, fname)
+
+class Segment():
+    """Memory mapped segment of the inverted index : each code of the segment with the ordinals of genomes carrying it
+
+    :ivar codes: sorted sgRNA codes
+    :vartype codes: np.ndarray
+    :ivar offsets: genome ordinals of codes[i] are in ordinals[offsets[i]:offsets[i + 1]]
+    :vartype offsets: np.ndarray
+    :ivar ordinals: genome ordinals
+    :vartype ordinals: np.ndarray
+    """
+    def __init__(self, fname: str):
+        self.fname = fname
+        self._fp = open(fname, "rb")
+        self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise IOError(f"{fname} is not an inverted index segment")
+        nbCodes, nbPostings, self.level = HEADER.unpack_from(self._mmap, len(MAGIC))
+        self.codes = np.frombuffer(self._mmap, dtype=np.uint64, count=nbCodes, offset=HEADER_SIZE)
+        self.offsets = np.frombuffer(self._mmap, dtype=np.uint64, count=nbCodes + 1, offset=HEADER_SIZE + 8 * nbCodes)
+        self.ordinals = np.frombuffer(self._mmap, dtype=np.uint32, count=nbPostings, offset=HEADER_SIZE + 8 * (2 * nbCodes + 1))
+
+    def __len__(self) -> int:
+        return len(self.ordinals)
+
+    def lookup(self, codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Postings of query codes found in segment
+
+        :return: query ranks and genome ordinals, one pair per posting
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        return _lookupPostings(self.codes, self.offsets, self.ordinals, codes)
+
+    def close(self):
+        self.codes = self.offsets = self.ordinals = None
+        self._mmap.close()
+        self._fp.close()
+
+class InvertedIndex():
+    """Local inverted index of index database : sgRNA code -> ordinals of genomes carrying it.
+    Genomes are added incrementally into memory mapped segment files, which are merged log-structured
+    (FANOUT segments of a level make one segment of next level), so a lookup only searches a few segments.
+    Genome ordinals and segments list are kept in manifest.json.
+    Removed genomes keep their ordinal as a tombstone : their postings are left out of lookups,
+    and dropped from segments when these are merged.
+
+    :ivar folder: inverted index folder
+    :vartype folder: str
+    :ivar genomes: genome uuids by ordinal, removed ones included
+    :vartype genomes: List[str]
+    :ivar removed: ordinals of removed genomes
+    :vartype removed: Set[int]
+    """
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.genomes = []
+        self.segments = []
+        self.removed = set()
+        self._pending = []
+        self._pendingSize = 0
+        # grouped postings of buffered genomes, built on lookup and kept until next add or flush
+        self._pendingPostings = None
+        manifest = f"{folder}/{MANIFEST}"
+        if os.path.isfile(manifest):
+            with open(manifest) as fp:
+                data = json.load(fp)
+            self.genomes = data["genomes"]
+            self.segments = [ Segment(f"{folder}/{name}") for name in data["segments"] ]
+            self.removed = set(data.get("removed", []))
+        self._ordinals = { uuid: i for i, uuid in enumerate(self.genomes) if not i in self.removed }
+
+    def _writeManifest(self):
+        tmp = f"{self.folder}/{MANIFEST}.tmp"
+        with open(tmp, "w") as fp:
+            json.dump({"genomes": self.genomes, "segments": [ os.path.basename(segment.fname) for segment in self.segments ], "removed": sorted(self.removed)}, fp)
+        os.replace(tmp, f"{self.folder}/{MANIFEST}")
+
+    def __contains__(self, uuid: str) -> bool:
+        return uuid in self._ordinals
+
+    def __len__(self) -> int:
+        """Number of genomes in inverted index, removed ones left out"""
+        return len(self._ordinals)
+
+    def add(self, uuid: str, codes: np.ndarray, force: bool = False):
+        """Add codes of a genome. They are buffered and written with next flush (automatic above FLUSH_SIZE codes).
+        A genome already in inverted index is skipped, or with force removed and added again under a new ordinal.
+        """
+        if uuid in self._ordinals:
+            if not force:
+                logging.warn(f"inverted::add:{uuid} already in inverted index, skipped")
+                return
+            self.remove([uuid])
+        self._ordinals[uuid] = len(self.genomes)
+        self.genomes.append(uuid)
+        codes = np.unique(np.asarray(codes, dtype=np.uint64))
+        self._pending.append( (codes, np.full(len(codes), self._ordinals[uuid], dtype=np.uint32)) )
+        self._pendingSize += len(codes)
+        self._pendingPostings = None
+        if self._pendingSize >= FLUSH_SIZE:
+            self.flush()
+
+    def remove(self, uuids: Iterable[str]) -> int:
+        """Remove genomes from inverted index. Buffered genomes are dropped, ordinals of the others are tombstoned
+        until segments holding their postings are merged. Manifest is updated at once.
+
+        :return: number of genomes removed, genomes absent from inverted index are ignored
+        :rtype: int
+        """
+        ordinals = set( self._ordinals.pop(uuid) for uuid in uuids if uuid in self._ordinals )
+        if not ordinals:
+            return 0
+        self.removed |= ordinals
+        self._pending = [ (codes, genomeOrdinals) for codes, genomeOrdinals in self._pending if not (len(genomeOrdinals) and int(genomeOrdinals[0]) in ordinals) ]
+        self._pendingSize = sum( len(codes) for codes, _ in self._pending )
+        self._pendingPostings = None
+        self._writeManifest()
+        logging.info(f"inverted::remove:{len(ordinals)} genomes removed, {len(self._ordinals)} left")
+        return len(ordinals)
+
+    def _removedPostings(self, ordinals: np.ndarray) -> np.ndarray:
+        """Mask of postings of removed genomes"""
+        if not self.removed:
+            return np.zeros(len(ordinals), dtype=bool)
+        return np.isin(ordinals, np.fromiter(self.removed, dtype=np.uint32, count=len(self.removed)))
+
+    def flush(self):
+        """Write buffered genomes as a level 0 segment, merge full levels and update manifest"""
+        if not self._pending:
+            return
+        codes, offsets, ordinals = self._bufferedPostings()
+        self._pending = []
+        self._pendingSize = 0
+        self._pendingPostings = None
+        self.segments.append(self._newSegment(codes, offsets, ordinals, 0))
+        self._compact()
+        self._writeManifest()
+        logging.info(f"inverted::flush:{len(self.genomes)} genomes in {len(self.segments)} segments")
+
+    def _bufferedPostings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self._pendingPostings is None:
+            self._pendingPostings = _postingsOf(*( np.concatenate(arrays) for arrays in zip(*self._pending) ))
+        return self._pendingPostings
+
+    def _newSegment(self, codes, offsets, ordinals, level) -> Segment:
+        fname = f"{self.folder}/segment_{level}_{uuidlib.uuid4().hex}.seg"
+        writeSegment(fname, codes, offsets, ordinals, level)
+        return Segment(fname)
+
+    def _compact(self):
+        level = 0
+        while True:
+            same = [ segment for segment in self.segments if segment.level == level ]
+            if len(same) < FANOUT:
+                if not any(segment.level > level for segment in self.segments):
+                    return
+                level += 1
+                continue
+            self._merge(same, level + 1)
+
+    def _merge(self, segments: List[Segment], level: int):
+        """Merge segments into one segment of level, without postings of removed genomes"""
+        codes = np.concatenate([ np.repeat(segment.codes, np.diff(segment.offsets).astype(np.intp)) for segment in segments ])
+        ordinals = np.concatenate([ segment.ordinals for segment in segments ])
+        kept = ~self._removedPostings(ordinals)
+        merged = self._newSegment(*_postingsOf(codes[kept], ordinals[kept]), level)
+        self.segments = [ segment for segment in self.segments if not segment in segments ] + [merged]
+        self._writeManifest()
+        for segment in segments:
+            segment.close()
+            os.remove(segment.fname)
+
+    def optimize(self):
+        """Merge all segments into one, postings of removed genomes are dropped"""
+        self.flush()
+        if len(self.segments) > 1 or (self.segments and self._removedPostings(self.segments[0].ordinals).any()):
+            self._merge(list(self.segments), max(segment.level for segment in self.segments) + 1)
+
+    def lookup(self, codes: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Genome ordinals carrying each query code, for a batch of codes.
+        Buffered genomes are searched in memory, after segments, without being written.
+
+        :param codes: sgRNA codes
+        :type codes: Iterable[int]
+        :return: offsets and ordinals, genomes of codes[i] are ordinals[offsets[i]:offsets[i + 1]]
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        codes = np.asarray(codes, dtype=np.uint64)
+        # sorted queries walk segments in order, far more cache friendly
+        order = np.argsort(codes, kind="stable")
+        sortedCodes = codes[order]
+        ranks, ordinals = [], []
+        for segment in self.segments:
+            rank, ordinal = segment.lookup(sortedCodes)
+            ranks.append(order[rank])
+            ordinals.append(ordinal)
+        if self._pending:
+            rank, ordinal = _lookupPostings(*self._bufferedPostings(), sortedCodes)
+            ranks.append(order[rank])
+            ordinals.append(ordinal)
+        ranks = np.concatenate(ranks) if ranks else np.zeros(0, dtype=np.intp)
+        ordinals = np.concatenate(ordinals) if ordinals else np.zeros(0, dtype=np.uint32)
+        # tombstoned genomes still have postings in segments not merged since their removal
+        kept = ~self._removedPostings(ordinals)
+        ranks, ordinals = ranks[kept], ordinals[kept]
+        byRank = np.argsort(ranks, kind="stable")
+        offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ranks, minlength=len(codes)), out=offsets[1:])
+        return offsets, ordinals[byRank]
+
+    def genomesOf(self, codes: Iterable[int]) -> Dict[int, List[str]]:
+        """Genome uuids carrying each query code, codes absent from all genomes are left out"""
+        codes = list(codes)
+        offsets, ordinals = self.lookup(codes)
+        return { code: [ self.genomes[o] for o in ordinals[offsets[i]:offsets[i + 1]].tolist() ] for i, code in enumerate(codes) if offsets[i + 1] > offsets[i] }
+
+    def close(self):
+        self.flush()
+        for segment in self.segments:
+            segment.close()
@@ -0,0 +1,64 @@
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Optional
+
+STAGES = ["genome", "motifs", "index", "cache", "blast"]
+
+def connect(journal_file):
+    return IngestionJournal(journal_file)
+
+class IngestionJournal():
+    """Local sqlite journal of add_genome.py stages completed for each fasta (by fasta md5).
+    Motif insertion is journaled batch per batch, so a resumed run can continue in the middle of a genome.
+
+    :ivar journal_file: path to sqlite file
+    :vartype journal_file: str
+    """
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self.conn = sqlite3.connect(journal_file, isolation_level=None)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stages (fasta_md5 TEXT, stage TEXT, uuid TEXT, date TEXT, PRIMARY KEY (fasta_md5, stage))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS batches (fasta_md5 TEXT PRIMARY KEY, layout TEXT, last_batch INTEGER)")
+
+    def _checkStage(self, stage):
+        if not stage in STAGES:
+            raise ValueError(f"Unknown ingestion stage {stage}, must be one of {STAGES}")
+
+    def isDone(self, fasta_md5: str, stage: str) -> bool:
+        self._checkStage(stage)
+        row = self.conn.execute("SELECT 1 FROM stages WHERE fasta_md5 = ? AND stage = ?", (fasta_md5, stage)).fetchone()
+        return row is not None
+
+    def done(self, fasta_md5: str, stage: str, uuid: str = None):
+        """Record stage as completed for fasta"""
+        self._checkStage(stage)
+        self.conn.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?)", (fasta_md5, stage, uuid, datetime.now().strftime("%d/%m/%Y %H:%M:%S")))
+        if stage == "motifs":
+            self.conn.execute("DELETE FROM batches WHERE fasta_md5 = ?", (fasta_md5,))
+
+    def uuid(self, fasta_md5: str) -> Optional[str]:
+        """Genome uuid recorded by genome stage"""
+        row = self.conn.execute("SELECT uuid FROM stages WHERE fasta_md5 = ? AND stage = 'genome'", (fasta_md5,)).fetchone()
+        return row[0] if row else None
+
+    def lastBatch(self, fasta_md5: str, layout: str) -> int:
+        """Rank of the last acknowledged motif batch for fasta, -1 if none or if batches were cut another way
+
+        :param layout: description of the batch cutting (mode and batch size), batches ranks are only valid for the same layout
+        :type layout: str
+        """
+        row = self.conn.execute("SELECT layout, last_batch FROM batches WHERE fasta_md5 = ?", (fasta_md5,)).fetchone()
+        if not row:
+            return -1
+        if row[0] != layout:
+            logging.warn(f"journal::lastBatch:Motif batches of {fasta_md5} were cut as {row[0]}, not {layout}. All batches will be inserted")
+            return -1
+        return row[1]
+
+    def ackBatch(self, fasta_md5: str, layout: str, rank: int):
+        """Record motif batch as inserted"""
+        self.conn.execute("INSERT OR REPLACE INTO batches VALUES (?, ?, ?)", (fasta_md5, layout, rank))
+
+    def close(self):
+        self.conn.close()
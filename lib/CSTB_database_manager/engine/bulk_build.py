@@ -0,0 +1,121 @@
+import os, heapq, itertools, shutil, tempfile
+import logging
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# Number of sgRNA locations buffered in memory before sorted runs are written
+MAX_BUFFERED_HITS = 5_000_000
+# Number of runs opened at once by a merge, kept far below open files limit
+MAX_FANIN = 128
+
+class VolumeRuns():
+    """External sort of the sgRNA locations of many genomes by target volume, to build each volume in one pass.
+    Locations are buffered per volume, then written in sorted runs (by sgRNA, then genome) in a volume folder.
+    Runs of a volume are merged on read, so each sgRNA comes once with all its genomes.
+    Beyond maxFanIn runs, consecutive groups of runs are first merged into larger runs, so a merge never opens more than maxFanIn files.
+
+    :ivar location: work folder
+    :vartype location: str
+    :ivar nb_hits: number of sgRNA locations added
+    :vartype nb_hits: int
+    """
+    def __init__(self, workLocation: str = None, maxBufferedHits: int = MAX_BUFFERED_HITS, maxFanIn: int = MAX_FANIN):
+        if maxFanIn < 2:
+            raise ValueError(f"Runs merge fan-in must be at least 2, not {maxFanIn}")
+        self.location = tempfile.mkdtemp(prefix="bulk_build_", dir=workLocation)
+        self.maxBufferedHits = maxBufferedHits
+        self.maxFanIn = maxFanIn
+        self.nb_hits = 0
+        self._buffers = {}
+        self._buffered = 0
+        self._runs = {}
+        self._nbRuns = 0
+
+    def add(self, batch: Dict, volumes: List[str]):
+        """Add a sgRNA dictionnary {sgRNA: {uuid: {id: [locations]}}}
+
+        :param volumes: target volume of each sgRNA of batch, in batch order, None to leave sgRNA out
+        :type volumes: List[str]
+        """
+        for (seq, orgs), volume in zip(batch.items(), volumes):
+            if volume is None:
+                continue
+            buffer = self._buffers.setdefault(volume, [])
+            for org, refs in orgs.items():
+                for ref, locations in refs.items():
+                    for location in locations:
+                        buffer.append( (seq, org, ref, location) )
+                        self._buffered += 1
+                        self.nb_hits += 1
+        if self._buffered >= self.maxBufferedHits:
+            self.flush()
+
+    def flush(self):
+        """Write buffered locations as one sorted run per volume"""
+        for volume, buffer in self._buffers.items():
+            if not buffer:
+                continue
+            # stable sort, locations of a genome keep their scan order
+            buffer.sort(key=lambda hit: (hit[0], hit[1]))
+            os.makedirs(f"{self.location}/{volume}", exist_ok=True)
+            runs = self._runs.setdefault(volume, [])
+            fRun = self._newRun(volume)
+            self._writeRun(fRun, buffer)
+            runs.append(fRun)
+        self._buffers = {}
+        self._buffered = 0
+
+    @property
+    def volumes(self) -> List[str]:
+        self.flush()
+        return sorted(self._runs)
+
+    def _newRun(self, volume: str) -> str:
+        self._nbRuns += 1
+        return f"{self.location}/{volume}/run_{self._nbRuns:05d}.tsv"
+
+    def _writeRun(self, fRun: str, hits: Iterable[Tuple[str, str, str, str]]):
+        with open(fRun, "w") as fp:
+            fp.writelines( f"{seq}\t{org}\t{ref}\t{location}\n" for seq, org, ref, location in hits )
+
+    def _readRun(self, fRun: str):
+        with open(fRun) as fp:
+            for l in fp:
+                yield tuple(l.rstrip("\n").split("\t"))
+
+    def _merge(self, runs: List[str]) -> Iterator[Tuple[str, str, str, str]]:
+        # heapq.merge is stable : equal keys come in runs order, so in scan order
+        return heapq.merge(*[ self._readRun(fRun) for fRun in runs ], key=lambda hit: (hit[0], hit[1]))
+
+    def _reduceRuns(self, volume: str) -> List[str]:
+        """Merge consecutive groups of maxFanIn runs of a volume until at most maxFanIn runs are left"""
+        runs = self._runs.get(volume, [])
+        while len(runs) > self.maxFanIn:
+            logging.info(f"bulk_build::_reduceRuns:Merging {len(runs)} runs of volume {volume} by groups of {self.maxFanIn}")
+            reduced = []
+            for i in range(0, len(runs), self.maxFanIn):
+                group = runs[i:i + self.maxFanIn]
+                if len(group) == 1:
+                    reduced += group
+                    continue
+                fRun = self._newRun(volume)
+                self._writeRun(fRun, self._merge(group))
+                for fMerged in group:
+                    os.remove(fMerged)
+                reduced.append(fRun)
+            runs = reduced
+            self._runs[volume] = runs
+        return runs
+
+    def docs(self, volume: str) -> Iterator[Dict]:
+        """Yield sgRNA documents of a volume {"_id": sgRNA, uuid: {id: [locations]}}, sorted by sgRNA"""
+        self.flush()
+        # groups are consecutive runs, so reduced runs keep scan order of equal keys
+        merged = self._merge(self._reduceRuns(volume))
+        for seq, hits in itertools.groupby(merged, key=lambda hit: hit[0]):
+            doc = {"_id": seq}
+            for _, org, ref, location in hits:
+                doc.setdefault(org, {}).setdefault(ref, []).append(location)
+            yield doc
+
+    def close(self):
+        shutil.rmtree(self.location, ignore_errors=True)
@@ -0,0 +1,115 @@
+import os, hashlib
+from typing import Dict, Iterator, List, Tuple
+from CSTB_core.utils.io import Zfile as zFile
+import CSTB_database_manager.utils.error as error
+
+# Bytes matched by \s in CSTB_core fileHash
+WHITESPACES = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+
+def resolveFasta(fasta: str) -> str:
+    """File actually read for fasta : fasta itself, or fasta.gz when only the compressed file exists, as CSTB_core Zfile does"""
+    return fasta if os.path.isfile(fasta) or not os.path.isfile(fasta + ".gz") else fasta + ".gz"
+
+def _fastaLines(path: str) -> Iterator[Tuple[bytes, List[str]]]:
+    """Stream raw lines of a (compressed) fasta, each with its text lines, with newlines normalized"""
+    with zFile(path, 'rb') as f:
+        for raw in f:
+            text = raw.decode()
+            if "\r" in text:
+                yield raw, text.replace("\r\n", "\n").replace("\r", "\n").splitlines(keepends=True)
+            else:
+                yield raw, [text]
+
+class FastaDigest():
+    """Everything database stages need from a fasta file but its sequences, computed in a single streaming pass,
+    sequences are read again with FastaRecords when needed.
+
+    :ivar fasta: Path to fasta file
+    :vartype fasta: str
+    :ivar path: Path of the file read, fasta or fasta.gz, see resolveFasta
+    :vartype path: str
+    :ivar md5: fasta hash, same value as CSTB_core fileHash
+    :vartype md5: str
+    :ivar size: Sizes of fasta sequences
+    :vartype size: Dict -> {fasta_header(str):size(int)}
+    :ivar headers: Complete headers of fasta sequences
+    :vartype headers: Dict -> {fasta_header(str):complete_header(str)}
+    :ivar stat: fasta file stats, taken before its read
+    :vartype stat: os.stat_result
+    """
+    def __init__(self, fasta: str):
+        self.fasta = fasta
+        self.path = resolveFasta(fasta)
+        self.stat = os.stat(self.path)
+        self.size = {}
+        self.headers = {}
+        self._conflict = None
+        # Header line is discarded and whitespaces stripped, as CSTB_core fileHash does
+        hasher = hashlib.md5()
+        ref = None
+        first = True
+        for raw, lines in _fastaLines(self.path):
+            if first:
+                first = False
+            else:
+                hasher.update(raw.translate(None, WHITESPACES))
+            for l in lines:
+                if l.startswith('>'):
+                    # Same keys as former DatabaseManager._proceed_fasta
+                    ref = l.split(" ")[0].lstrip(">")
+                    if ref in self.size and not self._conflict:
+                        self._conflict = ref
+                    self.size[ref] = 0
+                    self.headers[ref] = l.rstrip("\n").lstrip(">")
+                elif ref is not None:
+                    self.size[ref] += len(l.rstrip())
+        self.md5 = hasher.hexdigest()
+
+    @classmethod
+    def fromSummary(cls, fasta: str, md5: str, size: Dict[str, int], headers: Dict[str, str], conflict: str = None) -> "FastaDigest":
+        """Digest from already computed md5, sizes and headers"""
+        digest = cls.__new__(cls)
+        digest.fasta = fasta
+        digest.path = resolveFasta(fasta)
+        digest.stat = None
+        digest.md5 = md5
+        digest.size = size
+        digest.headers = headers
+        digest._conflict = conflict
+        return digest
+
+    def checkHeaders(self):
+        """
+        :raises error.FastaHeaderConflict: Raise if 2 fasta headers have same first word
+        """
+        if self._conflict:
+            raise error.FastaHeaderConflict(f"Two fasta header have same first identifiant : {self._conflict}. Change fasta headers to insert this genome.")
+
+class FastaRecords():
+    """Records of a fasta file, read record by record on each iteration, so only one sequence is held at a time.
+    Records are (complete_header, sequence, id) tuples, same fields as Bio.SeqIO fasta parsing.
+
+    :ivar path: Path to fasta file, or its .gz
+    :vartype path: str
+    """
+    def __init__(self, fasta: str):
+        self.path = resolveFasta(fasta)
+
+    def __iter__(self) -> Iterator[Tuple[str, str, str]]:
+        title = None
+        seq_lines = []
+        for _, lines in _fastaLines(self.path):
+            for l in lines:
+                if l.startswith('>'):
+                    if title is not None:
+                        yield self._record(title, seq_lines)
+                    title = l[1:].rstrip()
+                    seq_lines = []
+                elif title is not None:
+                    seq_lines.append(l.rstrip())
+        if title is not None:
+            yield self._record(title, seq_lines)
+
+    def _record(self, title: str, seq_lines: List[str]) -> Tuple[str, str, str]:
+        _id = title.split(None, 1)[0] if title else ""
+        return (title, "".join(seq_lines).replace(" ", ""), _id)
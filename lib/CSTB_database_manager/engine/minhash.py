@@ -0,0 +1,53 @@
+import numpy as np
+
+# Number of bins of one permutation MinHash sketches, must be a power of 2
+SKETCH_SIZE = 256
+# Value of bins without any code
+EMPTY = np.uint64(0xFFFFFFFFFFFFFFFF)
+# Estimated Jaccard index above which 2 genomes are reported as near duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.9
+
+def mix64(codes: np.ndarray, seed: int = 0) -> np.ndarray:
+    """splitmix64 finalizer of sgRNA codes, a cheap hash spreading codes over the whole uint64 range"""
+    with np.errstate(over="ignore"):
+        z = np.asarray(codes, dtype=np.uint64) + np.uint64((0x9E3779B97F4A7C15 * (seed + 1)) & 0xFFFFFFFFFFFFFFFF)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+def sketchCodes(codes: np.ndarray, size: int = SKETCH_SIZE, seed: int = 0) -> np.ndarray:
+    """One permutation MinHash sketch of a set of sgRNA codes : hashes are split in size bins by their high bits
+    and each bin keeps its smallest hash (EMPTY if none).
+
+    :param codes: sgRNA codes of a genome, as in index files
+    :type codes: np.ndarray
+    :param size: number of bins, a power of 2, defaults to SKETCH_SIZE
+    :type size: int, optional
+    :rtype: np.ndarray of size uint64
+    """
+    if size & (size - 1):
+        raise ValueError(f"Sketch size must be a power of 2, not {size}")
+    sketch = np.full(size, EMPTY, dtype=np.uint64)
+    if not len(codes):
+        return sketch
+    hashes = np.sort(mix64(codes, seed))
+    bins = (hashes >> np.uint64(64 - size.bit_length() + 1)).astype(np.intp) if size > 1 else np.zeros(len(hashes), dtype=np.intp)
+    # hashes are sorted, so the first hash of each bin is its minimum
+    occupied, first = np.unique(bins, return_index=True)
+    sketch[occupied] = hashes[first]
+    return sketch
+
+def jaccardEstimates(sketches: np.ndarray, sketch: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard index between one sketch and each row of a sketches matrix,
+    fraction of identical bins among bins not empty in both sketches
+
+    :param sketches: sketches matrix, one genome by row
+    :type sketches: np.ndarray (n, size)
+    :param sketch: query sketch
+    :type sketch: np.ndarray (size,)
+    :rtype: np.ndarray (n,) float
+    """
+    filled = (sketches != EMPTY) | (sketch != EMPTY)
+    same = (sketches == sketch) & (sketch != EMPTY)
+    nbFilled = filled.sum(axis=1)
+    return np.divide(same.sum(axis=1), nbFilled, out=np.zeros(len(sketches)), where=nbFilled > 0)
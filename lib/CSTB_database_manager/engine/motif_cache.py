@@ -0,0 +1,256 @@
+import os, json, mmap, struct, pickle, shutil, tempfile
+import logging
+from contextlib import ExitStack
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+from CSTB_database_manager.engine.sorted_runs import SortedRuns, RUN_SIZE
+
+MAGIC = b"CSTBMC01"
+# word length, number of records, number of motifs, number of hits, length of json names block
+HEADER = struct.Struct("<IIQQQ")
+HEADER_SIZE = 64
+CACHE_EXTENSION = ".mcache"
+# twobits code of each nucleotide, as CSTB_core twobits encoder : A=0, C=1, T=2, G=3
+NUCLEOTIDES = np.frombuffer(b"ACTG", dtype=np.uint8)
+STRANDS = "+-"
+
+def _align(offset: int, size: int = 8) -> int:
+    return (offset + size - 1) // size * size
+
+def encodeMotifs(motifs: List[str]) -> np.ndarray:
+    """twobits codes of same length sgRNA, identical to CSTB_core twobits encoder
+
+    :raises ValueError: Raise if sgRNA have different lengths or contain other letters than ACGT
+    """
+    if not motifs:
+        return np.zeros(0, dtype=np.uint64)
+    wLen = len(motifs[0])
+    raw = "".join(motifs).encode()
+    if len(raw) != wLen * len(motifs):
+        raise ValueError(f"Not even size sgRNA to encode, expected {wLen} length")
+    if raw.translate(None, b"ACGT"):
+        raise ValueError("Only ACGT sgRNA can be encoded")
+    values = ((np.frombuffer(raw, dtype=np.uint8).reshape(len(motifs), wLen) >> 1) & 3).astype(np.uint64)
+    weights = np.uint64(1) << (np.uint64(2) * np.arange(wLen - 1, -1, -1, dtype=np.uint64))
+    return (values * weights).sum(axis=1, dtype=np.uint64)
+
+def decodeMotifs(codes: np.ndarray, wLen: int) -> List[str]:
+    """sgRNA of twobits codes"""
+    if not len(codes):
+        return []
+    shifts = np.uint64(2) * np.arange(wLen - 1, -1, -1, dtype=np.uint64)
+    values = (np.asarray(codes, dtype=np.uint64)[:, None] >> shifts) & np.uint64(3)
+    raw = NUCLEOTIDES[values.astype(np.intp)].tobytes().decode()
+    return [ raw[i:i + wLen] for i in range(0, len(raw), wLen) ]
+
+class MotifCacheWriter():
+    """Write sgRNA locations of one genome in binary cache format, batch after batch.
+
+    File layout (little endian) : magic, header, then
+    sorted uint64 twobits codes of sgRNA, uint64 offsets of each sgRNA hits (one more than sgRNA),
+    uint32 hits starts, uint32 hits record ranks, uint8 hits strands (0 for +, 1 for -),
+    json block with genome uuid and records ids.
+    Hits of a sgRNA keep their order of insertion. They are sorted on disk by runs of runSize hits,
+    so memory doesn't grow with genome size.
+
+    :ivar fCache: cache file path
+    :vartype fCache: str
+    :ivar uuid: genome uuid
+    :vartype uuid: str
+    """
+    def __init__(self, fCache: str, uuid: str, runSize: int = RUN_SIZE):
+        self.fCache = fCache
+        self.uuid = uuid
+        self.wLen = None
+        self.records = {}
+        # hits (code, start, record rank, strand), sorted on disk by runs of runSize hits
+        self._hits = SortedRuns([np.uint64, np.uint32, np.uint32, np.uint8], os.path.dirname(os.path.abspath(fCache)), runSize)
+
+    def add(self, sgRNA_data: Dict):
+        """Add a sgRNA dictionnary {sgRNA: {uuid: {id: ["+(start,end)"]}}} of the genome
+
+        :raises ValueError: Raise if sgRNA_data holds other genomes or irregular locations
+        """
+        if not sgRNA_data:
+            return
+        motifs = list(sgRNA_data.keys())
+        if self.wLen is None:
+            self.wLen = len(motifs[0])
+        motifCodes = encodeMotifs(motifs)
+        hitMotif, starts, recs, strands = [], [], [], []
+        for i, seq in enumerate(motifs):
+            for org, refs in sgRNA_data[seq].items():
+                if org != self.uuid:
+                    raise ValueError(f"sgRNA of {org} in {self.uuid} cache")
+                for ref, locations in refs.items():
+                    rank = self.records.setdefault(ref, len(self.records))
+                    for location in locations:
+                        start, end = location[2:-1].split(",")
+                        if int(end) - int(start) + 1 != self.wLen:
+                            raise ValueError(f"Irregular location {location} for {seq}")
+                        hitMotif.append(i)
+                        starts.append(int(start))
+                        recs.append(rank)
+                        strands.append(STRANDS.index(location[0]))
+        self._hits.add(motifCodes[np.array(hitMotif, dtype=np.intp)], starts, recs, strands)
+
+    def close(self) -> int:
+        """Merge sorted hits and write cache. Codes are written as they are merged,
+        other arrays go through temporary files until the number of sgRNA is known.
+
+        :return: number of sgRNA written
+        :rtype: int
+        """
+        names = json.dumps({"uuid": self.uuid, "records": sorted(self.records, key=self.records.get)}).encode()
+        nMotifs, nHits = 0, 0
+        folder = os.path.dirname(os.path.abspath(self.fCache))
+        try:
+            with open(self.fCache, "wb") as fp, ExitStack() as stack:
+                columns = [ stack.enter_context(tempfile.TemporaryFile(dir=folder)) for _ in range(4) ]
+                fp.write(b"\0" * HEADER_SIZE)
+                for hitCodes, starts, recs, strands in self._hits.merged():
+                    codes, firsts = np.unique(hitCodes, return_index=True)
+                    fp.write(codes.tobytes())
+                    for column, array in zip(columns, ((firsts + nHits).astype(np.uint64), starts, recs, strands)):
+                        column.write(array.tobytes())
+                    nMotifs += len(codes)
+                    nHits += len(hitCodes)
+                columns[0].write(np.array([nHits], dtype=np.uint64).tobytes())
+                for column in columns:
+                    column.seek(0)
+                    shutil.copyfileobj(column, fp)
+                fp.write(b"\0" * (_align(fp.tell()) - fp.tell()))
+                fp.write(names)
+                fp.seek(0)
+                fp.write(MAGIC + HEADER.pack(self.wLen or 0, len(self.records), nMotifs, nHits, len(names)))
+        finally:
+            self._hits.close()
+        return nMotifs
+
+    def discard(self):
+        """Drop hits added and not written yet"""
+        self._hits.close()
+
+class MotifCache():
+    """Memory mapped binary sgRNA cache of a genome, see MotifCacheWriter for layout.
+
+    :ivar uuid: genome uuid
+    :vartype uuid: str
+    :ivar wLen: sgRNA length
+    :vartype wLen: int
+    :ivar codes: sorted twobits codes of sgRNA
+    :vartype codes: np.ndarray
+    :ivar offsets: hits of codes[i] are in [offsets[i], offsets[i + 1][
+    :vartype offsets: np.ndarray
+    :ivar records: records ids
+    :vartype records: List[str]
+    """
+    def __init__(self, fCache: str):
+        self.fCache = fCache
+        self._fp = open(fCache, "rb")
+        if os.fstat(self._fp.fileno()).st_size < HEADER_SIZE or self._fp.read(len(MAGIC)) != MAGIC:
+            self._fp.close()
+            raise ValueError(f"{fCache} is not a binary motif cache")
+        self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.wLen, nRecords, nMotifs, nHits, namesLength = HEADER.unpack_from(self._mmap, len(MAGIC))
+        offset = HEADER_SIZE
+        self.codes = np.frombuffer(self._mmap, dtype=np.uint64, count=nMotifs, offset=offset)
+        offset += 8 * nMotifs
+        self.offsets = np.frombuffer(self._mmap, dtype=np.uint64, count=nMotifs + 1, offset=offset)
+        offset += 8 * (nMotifs + 1)
+        self.starts = np.frombuffer(self._mmap, dtype=np.uint32, count=nHits, offset=offset)
+        offset += 4 * nHits
+        self.recordRanks = np.frombuffer(self._mmap, dtype=np.uint32, count=nHits, offset=offset)
+        offset += 4 * nHits
+        self.strands = np.frombuffer(self._mmap, dtype=np.uint8, count=nHits, offset=offset)
+        offset = _align(offset + nHits)
+        names = json.loads(self._mmap[offset:offset + namesLength].decode())
+        self.uuid = names["uuid"]
+        self.records = names["records"]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nb_hits(self) -> int:
+        return len(self.starts)
+
+    def occurences(self) -> np.ndarray:
+        """Number of hits of each sgRNA, in codes order"""
+        return np.diff(self.offsets)
+
+    def index(self) -> List[Tuple[int, int]]:
+        """Sorted (code, occurences) list, as written in .index files, without rebuilding sgRNA dictionnary"""
+        return list(zip(self.codes.tolist(), self.occurences().tolist()))
+
+    def find(self, seq: str) -> Dict:
+        """Locations of a sgRNA in the genome, {} if absent
+
+        :rtype: Dict -> {id: ["+(start,end)"]}
+        """
+        code = encodeMotifs([seq])[0]
+        i = int(np.searchsorted(self.codes, code))
+        if i == len(self.codes) or self.codes[i] != code:
+            return {}
+        return self._locations(i)
+
+    def _locations(self, i: int) -> Dict:
+        locations = {}
+        begin, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        for start, rank, strand in zip(self.starts[begin:end].tolist(), self.recordRanks[begin:end].tolist(), self.strands[begin:end].tolist()):
+            locations.setdefault(self.records[rank], []).append(f"{STRANDS[strand]}({start},{start + self.wLen - 1})")
+        return locations
+
+    def chunks(self, batchSize: int) -> Iterator[Dict]:
+        """Yield sgRNA dictionnaries of at most batchSize keys, in codes order"""
+        for i in range(0, len(self.codes), batchSize):
+            motifs = decodeMotifs(self.codes[i:i + batchSize], self.wLen)
+            yield { seq: {self.uuid: self._locations(i + j)} for j, seq in enumerate(motifs) }
+
+    def toDict(self) -> Dict:
+        """Whole sgRNA dictionnary {sgRNA: {uuid: {id: ["+(start,end)"]}}}, as computed by sgRNA search"""
+        data = {}
+        for chunk in self.chunks(max(len(self.codes), 1)):
+            data.update(chunk)
+        return data
+
+    def close(self):
+        # numpy views must be released before the map
+        self.codes = self.offsets = self.starts = self.recordRanks = self.strands = None
+        self._mmap.close()
+        self._fp.close()
+
+def writeMotifCache(sgRNA_data: Dict, uuid: str, fCache: str) -> int:
+    """Write a whole sgRNA dictionnary of a genome in binary cache format"""
+    writer = MotifCacheWriter(fCache, uuid)
+    writer.add(sgRNA_data)
+    return writer.close()
+
+def isMotifCache(fCache: str) -> bool:
+    with open(fCache, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+def convertPickleCache(fPickle: str, fCache: str = None) -> str:
+    """Convert a pickled sgRNA cache of a genome (single dictionnary or sequence of chunks) to binary format
+
+    :return: binary cache path, fPickle with .mcache extension by default
+    :rtype: str
+    """
+    fCache = fCache if fCache else os.path.splitext(fPickle)[0] + CACHE_EXTENSION
+    writer = None
+    with open(fPickle, "rb") as fp:
+        while True:
+            try:
+                chunk = pickle.load(fp)
+            except EOFError:
+                break
+            if not chunk:
+                continue
+            if writer is None:
+                writer = MotifCacheWriter(fCache, next(iter(next(iter(chunk.values())))))
+            writer.add(chunk)
+    if writer is None:
+        raise ValueError(f"No sgRNA in {fPickle}, genome uuid is unknown")
+    nbMotifs = writer.close()
+    logging.info(f"motif_cache::convertPickleCache:{nbMotifs} sgRNA of {fPickle} wrote to {fCache}")
+    return fCache
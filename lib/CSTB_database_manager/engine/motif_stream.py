@@ -0,0 +1,112 @@
+import os, glob, pickle, shutil, tempfile
+import logging
+from typing import Dict, Iterator, Iterable, List, Tuple
+import numpy as np
+from CSTB_core.engine.wordIntegerIndexing import getEncoding
+from CSTB_database_manager.engine.sgrna_search import sgRNArecordsHits
+from CSTB_database_manager.engine.motif_cache import MotifCache, isMotifCache
+
+PREFIX_LENGTH = 4
+
+class MotifSpill():
+    """sgRNA locations of one genome spilled on local disk, one bucket file per sgRNA prefix.
+    Each sgRNA lies in a single bucket, so buckets can be loaded one at a time to build
+    bounded size chunks of the sgRNA dictionnary.
+
+    :ivar uuid: genome uuid
+    :vartype uuid: str
+    :ivar location: spill directory
+    :vartype location: str
+    :ivar nb_hits: number of sgRNA locations spilled
+    :vartype nb_hits: int
+    """
+    def __init__(self, uuid: str, spillLocation: str = None):
+        self.uuid = uuid
+        self.location = tempfile.mkdtemp(prefix=f"{uuid}_", dir=spillLocation)
+        self.nb_hits = 0
+
+    def _bucket(self, prefix: str) -> str:
+        return f"{self.location}/{prefix}.tsv"
+
+    def write(self, hits: Iterable[Tuple[str, str, str]]) -> int:
+        """Spill sgRNA hits (sgRNA, id, location) in prefix buckets
+
+        :return: number of spilled hits
+        :rtype: int
+        """
+        handles = {}
+        try:
+            for seq, ref, location in hits:
+                prefix = seq[:PREFIX_LENGTH]
+                if not prefix in handles:
+                    handles[prefix] = open(self._bucket(prefix), "a")
+                handles[prefix].write(f"{seq}\t{ref}\t{location}\n")
+                self.nb_hits += 1
+        finally:
+            for fp in handles.values():
+                fp.close()
+        return self.nb_hits
+
+    @property
+    def prefixes(self) -> List[str]:
+        return sorted(os.path.basename(f)[:-len(".tsv")] for f in glob.glob(f"{self.location}/*.tsv"))
+
+    def loadBucket(self, prefix: str) -> Dict:
+        """Load one prefix bucket as a sgRNA dictionnary {sgRNA: {uuid: {id: [locations]}}}"""
+        data = {}
+        with open(self._bucket(prefix)) as fp:
+            for l in fp:
+                seq, ref, location = l.rstrip("\n").split("\t")
+                data.setdefault(seq, {self.uuid: {}})[self.uuid].setdefault(ref, []).append(location)
+        return data
+
+    def chunks(self, batchSize: int) -> Iterator[Dict]:
+        """Yield sgRNA dictionnaries of at most batchSize keys, grouped by prefix bucket.
+        Each sgRNA appears in exactly one chunk with all its locations.
+        """
+        for prefix in self.prefixes:
+            data = self.loadBucket(prefix)
+            keys = list(data.keys())
+            for i in range(0, len(keys), batchSize):
+                yield { k : data[k] for k in keys[i:i + batchSize] }
+
+    def close(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+def spillRecords(records: Iterable[Tuple[str, str, str]], uuid: str, spillLocation: str = None) -> MotifSpill:
+    """Search sgRNA in fasta records and spill them on disk without building the whole sgRNA dictionnary"""
+    spill = MotifSpill(uuid, spillLocation)
+    spill.write(sgRNArecordsHits(records))
+    logging.info(f"motif_stream::spillRecords:{spill.nb_hits} sgRNA locations of {uuid} spilled to {spill.location}")
+    return spill
+
+def sliceMotifs(sgRNA_data: Dict, batchSize: int) -> Iterator[Dict]:
+    """Yield sgRNA dictionnaries of at most batchSize keys from a whole sgRNA dictionnary"""
+    allKeys = list(sgRNA_data.keys())
+    for i in range(0, len(allKeys), batchSize):
+        yield { k : sgRNA_data[k] for k in allKeys[i:i + batchSize] }
+
+def motifsIndex(sgRNA_data: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """Integer encoding of sgRNA (uint64) with their number of occurences (uint32), unsorted. 
+    Same values as CSTB_core indexAndMayOccurence."""
+    encoder = getEncoding()[1]
+    codes = np.fromiter((encoder(k) for k in sgRNA_data), dtype=np.uint64, count=len(sgRNA_data))
+    counts = np.fromiter((sum(len(locations) for org in sgRNA_data[k].values() for locations in org.values()) for k in sgRNA_data), dtype=np.uint32, count=len(sgRNA_data))
+    return codes, counts
+
+def loadMotifCache(fPickle: str) -> Dict:
+    """Load sgRNA cache of a genome. Binary caches are rebuilt from their arrays, 
+    pickled caches are a sequence of pickled chunks or, for older ones, a single pickled dictionnary"""
+    if isMotifCache(fPickle):
+        cache = MotifCache(fPickle)
+        data = cache.toDict()
+        cache.close()
+        return data
+    data = {}
+    with open(fPickle, "rb") as fp:
+        while True:
+            try:
+                data.update(pickle.load(fp))
+            except EOFError:
+                break
+    return data
@@ -0,0 +1,59 @@
+import re
+from typing import Dict, Iterable, Iterator, Tuple
+
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+IUPAC_CODE = {'R': '[AG]', 'Y': '[CT]', 'S': '[GC]', 'W': '[AT]',
+              'K': '[GT]', 'M': '[AC]', 'B': '[CGT]', 'D': '[AGT]',
+              'H': '[ACT]', 'V': '[ACG]', 'N': '[ACGT]'}
+
+def _complement_seq(sequence: str) -> str:
+    return "".join(c.translate(COMPLEMENT) if c in "ACGT" else "N" for c in reversed(sequence))
+
+def _build_expression(seq: str) -> str:
+    return "".join(IUPAC_CODE.get(letter, letter) for letter in seq)
+
+def _find_indices(seq: str, motif: str):
+    return [m.start() for m in re.finditer('(?=' + _build_expression(motif) + ')', seq, re.I)]
+
+def sgRNArecordsHits(records: Iterable[Tuple[str, str, str]], pam: str = "NGG", non_pam_motif_length: int = 20) -> Iterator[Tuple[str, str, str]]:
+    """Yield sgRNA hits of fasta records one by one, in CSTB_core sgRNAfastaSearch order.
+    Records are iterated twice, first for their lengths, so they are streamed when read with FastaRecords.
+
+    :param records: fasta records (complete_header, sequence, id), a list or a FastaRecords
+    :type records: Iterable[Tuple[str, str, str]]
+    :return: generator of (sgRNA, id, location) where location is like "+(start,end)"
+    :rtype: Iterator[Tuple[str, str, str]]
+    """
+    sgrna = "N" * non_pam_motif_length + pam
+    word_length = non_pam_motif_length + len(pam)
+    # CSTB_core gives up on the whole genome when one record is too short
+    if any(len(sequence) < word_length for _, sequence, _ in records):
+        return
+    for _, sequence, ref in records:
+        genome_seq = sequence.upper()
+        for indices, reverse, str_reverse in ( (_find_indices(genome_seq, _complement_seq(sgrna)), False, "+("),
+                                               (_find_indices(genome_seq, sgrna), True, "-(") ):
+            for indice in indices:
+                end = indice + word_length
+                seq = genome_seq[indice:end] if reverse else genome_seq[indice:end].translate(COMPLEMENT)[::-1]
+                yield (seq, ref, str_reverse + str(indice + 1) + ',' + str(end) + ')')
+
+def sgRNArecordsSearch(records: Iterable[Tuple[str, str, str]], organism: str, pam: str = "NGG", non_pam_motif_length: int = 20) -> Dict:
+    """Find sgRNA in fasta records.
+    Gives the same result as CSTB_core sgRNAfastaSearch on the fasta file the records come from.
+
+    :param records: fasta records (complete_header, sequence, id), a list or a FastaRecords
+    :type records: Iterable[Tuple[str, str, str]]
+    :param organism: genome uuid
+    :type organism: str
+    :return: sgRNA locations
+    :rtype: Dict -> {sgRNA: {organism: {id: ["+(start,end)"]}}}
+    """
+    seq_dict = {}
+    for seq, ref, location in sgRNArecordsHits(records, pam, non_pam_motif_length):
+        if seq not in seq_dict:
+            seq_dict[seq] = {organism: {}}
+        if ref not in seq_dict[seq][organism]:
+            seq_dict[seq][organism][ref] = []
+        seq_dict[seq][organism][ref].append(location)
+    return seq_dict
@@ -0,0 +1,116 @@
+import os, json
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+import numpy as np
+import CSTB_database_manager.db.index as indexDBHandler
+
+SHARED_FILE = "shared.npy"
+JACCARD_FILE = "jaccard.npy"
+SIZES_FILE = "sizes.npy"
+UUIDS_FILE = "uuids.json"
+
+def sharedCount(codesA: np.ndarray, codesB: np.ndarray) -> int:
+    """Number of codes shared by 2 sorted and unique code arrays. The smaller array is searched in the larger."""
+    if len(codesA) > len(codesB):
+        codesA, codesB = codesB, codesA
+    if not len(codesA):
+        return 0
+    positions = np.searchsorted(codesB, codesA)
+    positions[positions == len(codesB)] = 0
+    return int(np.count_nonzero(codesB[positions] == codesA))
+
+def _sharedBlock(index_folder: str, rowUuids: List[str], colUuids: List[str], diagonal: bool) -> np.ndarray:
+    """Shared sgRNA counts between row and column genomes, in a worker process.
+    On a diagonal block (same genomes in rows and columns) only the upper triangle is computed, then mirrored.
+    """
+    indexdb = indexDBHandler.IndexDB(index_folder)
+    rows = [ indexdb.open(uuid) for uuid in rowUuids ]
+    cols = rows if diagonal else [ indexdb.open(uuid) for uuid in colUuids ]
+    block = np.zeros((len(rows), len(cols)), dtype=np.uint32)
+    for i, row in enumerate(rows):
+        for j in range(i if diagonal else 0, len(cols)):
+            block[i, j] = len(row) if diagonal and i == j else sharedCount(row.codes, cols[j].codes)
+    if diagonal:
+        block = np.triu(block) + np.triu(block, 1).T
+    for index in set(rows + cols):
+        index.close()
+    return block
+
+def _blocks(nbGenomes: int, blockSize: int) -> List[Tuple[int, int, int, int]]:
+    bounds = [ (start, min(start + blockSize, nbGenomes)) for start in range(0, nbGenomes, blockSize) ]
+    return [ (*bounds[i], *bounds[j]) for i in range(len(bounds)) for j in range(i, len(bounds)) ]
+
+def sharedSgrnaMatrix(indexdb: indexDBHandler.IndexDB, outDir: str, uuids: List[str] = None, jobs: int = 1, blockSize: int = 256, jaccard: bool = True) -> Dict[str, str]:
+    """Compute the genome by genome shared sgRNA count matrix (and Jaccard index matrix) of index database,
+    by blocks of genomes in worker processes. Matrices are written as .npy files, memory mapped while they are filled,
+    so they never have to fit in memory. Genome order is given by uuids.json.
+
+    :param indexdb: index database
+    :type indexdb: IndexDB
+    :param outDir: folder to write matrices in
+    :type outDir: str
+    :param uuids: genomes to compare, defaults to all indexed genomes, sorted
+    :type uuids: List[str], optional
+    :param jobs: number of worker processes, defaults to 1
+    :type jobs: int, optional
+    :param blockSize: number of genomes by block side, defaults to 256
+    :type blockSize: int, optional
+    :param jaccard: also write Jaccard index matrix, defaults to True
+    :type jaccard: bool, optional
+    :return: path of written files
+    :rtype: Dict -> {"uuids", "sizes", "shared"[, "jaccard"]: path}
+    """
+    uuids = sorted(indexdb.all_ids) if uuids is None else list(uuids)
+    nbGenomes = len(uuids)
+    os.makedirs(outDir, exist_ok=True)
+    files = { "uuids": f"{outDir}/{UUIDS_FILE}", "sizes": f"{outDir}/{SIZES_FILE}", "shared": f"{outDir}/{SHARED_FILE}" }
+    with open(files["uuids"], "w") as fp:
+        json.dump(uuids, fp)
+
+    shared = np.lib.format.open_memmap(files["shared"], mode="w+", dtype=np.uint32, shape=(nbGenomes, nbGenomes))
+    blocks = _blocks(nbGenomes, blockSize)
+    logging.info(f"similarity::sharedSgrnaMatrix:{nbGenomes} genomes in {len(blocks)} blocks with {jobs} processes")
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        blockIter = iter(blocks)
+        done = 0
+        while True:
+            while len(pending) < 2 * jobs:
+                bounds = next(blockIter, None)
+                if bounds is None:
+                    break
+                r0, r1, c0, c1 = bounds
+                pending.append( (bounds, executor.submit(_sharedBlock, indexdb.database_folder, uuids[r0:r1], uuids[c0:c1], r0 == c0)) )
+            if not pending:
+                break
+            (r0, r1, c0, c1), future = pending.popleft()
+            block = future.result()
+            shared[r0:r1, c0:c1] = block
+            shared[c0:c1, r0:r1] = block.T
+            done += 1
+            logging.debug(f"similarity::sharedSgrnaMatrix:block {done}/{len(blocks)}")
+
+    sizes = np.diagonal(shared).astype(np.uint64)
+    np.save(files["sizes"], sizes)
+    if jaccard:
+        files["jaccard"] = f"{outDir}/{JACCARD_FILE}"
+        jaccardMatrix = np.lib.format.open_memmap(files["jaccard"], mode="w+", dtype=np.float32, shape=(nbGenomes, nbGenomes))
+        for r0 in range(0, nbGenomes, blockSize):
+            r1 = min(r0 + blockSize, nbGenomes)
+            inter = shared[r0:r1].astype(np.float64)
+            union = sizes[r0:r1, None].astype(np.float64) + sizes[None, :] - inter
+            jaccardMatrix[r0:r1] = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        jaccardMatrix.flush()
+        del jaccardMatrix
+    shared.flush()
+    del shared
+    logging.info(f"similarity::sharedSgrnaMatrix:matrices wrote to {outDir}")
+    return files
+
+def loadSharedSgrnaMatrix(outDir: str, name: str = "shared", mmap_mode: str = "r") -> Tuple[List[str], np.ndarray]:
+    """Genome uuids and memory mapped matrix ("shared" or "jaccard") written by sharedSgrnaMatrix"""
+    with open(f"{outDir}/{UUIDS_FILE}") as fp:
+        uuids = json.load(fp)
+    return uuids, np.load(f"{outDir}/{name}.npy", mmap_mode=mmap_mode)
@@ -0,0 +1,106 @@
+import shutil, tempfile
+from typing import Iterator, List
+import numpy as np
+
+# Number of buffered rows sorted and written to disk as one run
+RUN_SIZE = 4000000
+
+class SortedRuns():
+    """Rows of numpy columns sorted on their first (key) column, with bounded memory :
+    rows are buffered until runSize of them are sorted and spilled to disk as a run,
+    runs are merged back chunk by chunk. Rows of equal keys keep their order of insertion.
+
+    :ivar dtypes: dtype of each column, the first one is the sort key
+    :vartype dtypes: List[np.dtype]
+    :ivar size: number of rows added
+    :vartype size: int
+    """
+    def __init__(self, dtypes: List, location: str = None, runSize: int = RUN_SIZE):
+        self.dtypes = [ np.dtype(dtype) for dtype in dtypes ]
+        self.location = location
+        self.runSize = runSize
+        self.size = 0
+        self._buffer = []
+        self._buffered = 0
+        self._folder = None
+        self._runs = []
+
+    def add(self, *columns: np.ndarray):
+        """Add rows, one array by column"""
+        if not len(columns[0]):
+            return
+        self._buffer.append([ np.asarray(column, dtype=dtype) for column, dtype in zip(columns, self.dtypes) ])
+        self._buffered += len(columns[0])
+        self.size += len(columns[0])
+        if self._buffered >= self.runSize:
+            self._spill()
+
+    def _sortBuffer(self) -> List[np.ndarray]:
+        if self._buffer:
+            columns = [ np.concatenate(arrays) for arrays in zip(*self._buffer) ]
+        else:
+            columns = [ np.zeros(0, dtype=dtype) for dtype in self.dtypes ]
+        self._buffer = []
+        self._buffered = 0
+        order = np.argsort(columns[0], kind="stable")
+        return [ column[order] for column in columns ]
+
+    def _runPath(self, run: int, column: int) -> str:
+        return f"{self._folder}/run_{run:05d}_{column}.bin"
+
+    def _spill(self):
+        if self._folder is None:
+            self._folder = tempfile.mkdtemp(prefix="sorted_runs_", dir=self.location)
+        columns = self._sortBuffer()
+        for i, column in enumerate(columns):
+            column.tofile(self._runPath(len(self._runs), i))
+        self._runs.append(len(columns[0]))
+
+    def merged(self, chunkSize: int = RUN_SIZE) -> Iterator[List[np.ndarray]]:
+        """Yield all rows sorted on key, as chunks of columns of about chunkSize rows.
+        Rows of a key are never split over two chunks.
+        """
+        if not self._runs:
+            columns = self._sortBuffer()
+            begin = 0
+            while begin < len(columns[0]):
+                end = int(np.searchsorted(columns[0], columns[0][min(begin + chunkSize, len(columns[0])) - 1], side="right"))
+                yield [ column[begin:end] for column in columns ]
+                begin = end
+            return
+        if self._buffer:
+            self._spill()
+        runs = [ [ np.memmap(self._runPath(run, i), dtype=dtype, mode="r", shape=(length,)) for i, dtype in enumerate(self.dtypes) ]
+                 for run, length in enumerate(self._runs) ]
+        positions = [0] * len(runs)
+        window = max(chunkSize // len(runs), 1)
+        while True:
+            active = [ run for run in range(len(runs)) if positions[run] < self._runs[run] ]
+            if not active:
+                break
+            # every row up to the smallest window end of remaining runs can be merged
+            threshold = min( runs[run][0][min(positions[run] + window, self._runs[run]) - 1] for run in active )
+            parts = []
+            for run in active:
+                end = positions[run] + int(np.searchsorted(runs[run][0][positions[run]:], threshold, side="right"))
+                parts.append([ np.array(column[positions[run]:end]) for column in runs[run] ])
+                positions[run] = end
+            columns = [ np.concatenate(arrays) for arrays in zip(*parts) ]
+            # parts are in run order, a stable sort keeps rows of equal keys in order of insertion
+            order = np.argsort(columns[0], kind="stable")
+            yield [ column[order] for column in columns ]
+
+    def close(self):
+        """Remove spilled runs"""
+        self._buffer = []
+        self._buffered = 0
+        self._runs = []
+        if self._folder:
+            shutil.rmtree(self._folder, ignore_errors=True)
+            self._folder = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -28,4 +28,7 @@ class FastaHeaderConflict(Exception):
 
 class NotAvailableKeys(Exception):
     """Raised when you try to change or add a forbidden key"""
-    pass
\ No newline at end of file
+    pass
+class IndexConnectionError(Exception):
+    """Raised when index database folder doesn't exist"""
+    pass
@@ -3,7 +3,7 @@
 """Add genomes to taxon and genome databases
 
 Usage:
-    add_genome.py --config <conf> --genomes <genome_list> --location <fasta_folder> [--map <volume_mapper>] [--index <index_file_dump_loc>] [ --min <start_index> --max <stop_index> --cache <pickle_cache> ] [ --debug ] [ --size <batch_size> ] [ --tree ] [ --blast ] [ --force ]
+    add_genome.py --config <conf> --genomes <genome_list> --location <fasta_folder> [--map <volume_mapper>] [--index <index_file_dump_loc> [ --index-format <format> ] [ --inverted <inverted_folder> ] ] [ --min <start_index> --max <stop_index> --cache <pickle_cache> ] [ --debug ] [ --size <batch_size> ] [ --jobs <n_jobs> ] [ --writers <n_writers> ] [ --append <mode> ] [ --bulk-build <work_folder> ] [ --stream [ --spill <spill_folder> ] ] [ --batch ] [ --journal <journal_file> [ --resume ] ] [ --tree ] [ --blast [ --stage ] ] [ --force ]
 
 Options:
     -h --help
@@ -12,10 +12,22 @@ Options:
     --location <fasta_folder> path to folder containing referenced fasta in tsv file
     --map <volume_mapper> rules to dispatch sgRNA to database endpoints. MANDATORY for sgRNA motif insertions
     --index <index_file_dump_loc> folder location to write integer encoded sgRNA genome content
+    --index-format <format>  text (<uuid>.index) or binary (<uuid>.bindex) index files (default = config index_format or text)
+    --inverted <inverted_folder>  add indexed genomes to this local inverted index (default = config inverted_path if any)
     --min <start_index> position to read from (included) in the tsv file (header line does not count)
     --max <stop_index>  position to read to   (included) in the tsv file (header line does not count)
-    --cache <pickle_cache>  define a folder to dump the sgnRNA locations of each provided genome
+    --cache <pickle_cache>  define a folder to dump the sgnRNA locations of each provided genome in binary cache format (<uuid>.mcache), genomes already cached there are not scanned again
     --size <batch_size>  Maximal number of keys in a couchDB volume collection insert (default = 10000)
+    --jobs <n_jobs>  Number of processes used to scan fasta for sgRNA motifs (default = 1)
+    --writers <n_writers>  Number of motif volumes written simultaneously (default = 1)
+    --append <mode>  bulk : read, merge and write back existing sgRNA documents ; update : write sgRNA documents without read, then append to the few existing ones on server side with a design document update handler (default = bulk)
+    --bulk-build <work_folder>  Release rebuild : sort sgRNA of all genomes by volume in this folder, then write each volume in one pass, every sgRNA document once with all its genomes
+    --stream  Spill sgRNA motifs on disk by prefix and upload, cache and index them batch per batch to bound memory usage
+    --spill <spill_folder>  folder for --stream temporary files (default = system temporary folder)
+    --batch  Resolve and write genome and taxon entries of the whole slice with bulk requests
+    --journal <journal_file>  sqlite file recording the stages completed for each fasta (genome/taxon, motifs, index, cache, blast)
+    --resume  Skip stages completed according to journal, motif insertion restarts after the last recorded batch
+    --stage  Write blast records to a private staging fragment of blast database, for runs in parallel ; fragments are folded into database by merge_blast.py
     --tree  Create taxonomic tree after insertion
     --debug  Set debug mode ON
     --force  Force add to motif, blast and index databases
@@ -42,6 +54,8 @@ if __name__ == "__main__":
     x = int(ARGS["--min"]) if not ARGS["--min"] is None  else 0
     y = int(ARGS["--max"]) if not ARGS["--max"] is None else len([ _ for _ in tsvReader(ARGS["--genomes"])])
     bSize = int(ARGS["--size"]) if ARGS["--size"] else 10000                
+    nJobs = int(ARGS["--jobs"]) if ARGS["--jobs"] else 1
+    nWriters = int(ARGS["--writers"]) if ARGS["--writers"] else 1
        
     #cacheLocation = ARGS["--cache"] if "--cache" in ARGS else None
     #indexLocation = ARGS["--index"] if "--index" in ARGS else None
@@ -51,27 +65,57 @@ if __name__ == "__main__":
     if ARGS["--debug"]:
         db.setDebugMode()
 
+    if ARGS["--index-format"]:
+        db.setIndexFormat(ARGS["--index-format"])
+
+    if ARGS["--inverted"]:
+        db.setInvertedIndex(ARGS["--inverted"])
+
+    if ARGS["--journal"]:
+        db.setJournal(ARGS["--journal"], ARGS["--resume"])
+
     new_fasta = []
+    genome_list = []
     for (fasta, name, taxid, gcf, acc) in tsvReader(ARGS["--genomes"], x, y):
         
         fasta_path = ARGS["--location"] + '/' + fasta
 
         if not zExists(fasta_path):
             raise ValueError(f'No fasta file at {fasta_path}')
+
+        if ARGS["--resume"] and db.isDone(fasta_path, "genome"):
+            logging.info(f"{fasta_path} already in genome database according to journal")
+            new_fasta.append(fasta_path)
+            continue
         
+        if ARGS["--batch"]:
+            genome_list.append( (fasta_path, name, taxid, gcf, acc) )
+            continue
+
         logging.info(f"db.AddGenome({fasta_path}, {name}, {taxid}, {gcf}, {acc})")           
         return_status = db.addGenome(fasta_path, name, taxid, gcf, acc)
         if return_status or ARGS["--force"]:
             new_fasta.append(fasta_path)
 
+    if ARGS["--batch"]:
+        logging.info(f"db.AddGenomes of {len(genome_list)} genomes")
+        for fasta_path, return_status in db.addGenomes(genome_list).items():
+            if return_status or ARGS["--force"]:
+                new_fasta.append(fasta_path)
+
     if ARGS["--map"]:
-        db.setMotifAgent(ARGS["--map"])
+        db.setMotifAgent(ARGS["--map"], ARGS["--append"] if ARGS["--append"] else "bulk")
         
     if ARGS["--map"] or ARGS["--index"]:
         logging.info(f"Proceeding to the db.AddMotifs of {len(new_fasta)} fasta")  
-        db.addFastaMotifs(new_fasta, bSize , indexLocation, cacheLocation)
+        if ARGS["--bulk-build"] and ARGS["--map"]:
+            db.bulkBuildMotifs(new_fasta, ARGS["--bulk-build"], bSize, indexLocation, cacheLocation, nJobs, ARGS["--stream"], ARGS["--spill"], nWriters)
+        else:
+            db.addFastaMotifs(new_fasta, bSize , indexLocation, cacheLocation, nJobs, ARGS["--stream"], ARGS["--spill"], nWriters)
 
     if ARGS["--blast"]: 
+        if ARGS["--stage"]:
+            db.setBlastStaging()
         db.addBlast(new_fasta)
 
     if ARGS["--tree"]:
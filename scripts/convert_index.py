@@ -0,0 +1,22 @@
+#!/software/mobi/crispr-manager/2.0.0/bin/python
+
+import argparse, logging, glob, os
+from CSTB_database_manager.db.index import convertTextIndex, TEXT_EXTENSION, BINARY_EXTENSION
+
+logging.basicConfig(level = logging.INFO, format='%(levelname)s\t%(filename)s:%(lineno)s\t%(message)s')
+
+def args_gestion():
+    parser = argparse.ArgumentParser(description = "Convert text index files (<uuid>.index) to binary index files (<uuid>.bindex)")
+    parser.add_argument("--index", metavar = "<index_folder>", help = "folder of text index files", required = True)
+    parser.add_argument("--out", metavar = "<index_folder>", help = "folder to write binary index files, default is --index folder")
+    parser.add_argument("--remove", action = "store_true", help = "Remove text index file once converted")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    ARGS = args_gestion()
+    out = ARGS.out if ARGS.out else ARGS.index
+    for fIndex in sorted(glob.glob(f"{ARGS.index}/*{TEXT_EXTENSION}")):
+        fBinary = f"{out}/{os.path.basename(fIndex)[:-len(TEXT_EXTENSION)]}{BINARY_EXTENSION}"
+        convertTextIndex(fIndex, fBinary)
+        if ARGS.remove:
+            os.remove(fIndex)
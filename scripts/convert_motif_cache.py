@@ -0,0 +1,22 @@
+#!/software/mobi/crispr-manager/2.0.0/bin/python
+
+import argparse, logging, glob, os
+from CSTB_database_manager.engine.motif_cache import convertPickleCache, CACHE_EXTENSION
+
+logging.basicConfig(level = logging.INFO, format='%(levelname)s\t%(filename)s:%(lineno)s\t%(message)s')
+
+def args_gestion():
+    parser = argparse.ArgumentParser(description = "Convert pickled sgRNA caches (<uuid>.p) to binary caches (<uuid>.mcache)")
+    parser.add_argument("--cache", metavar = "<cache_folder>", help = "folder of pickled caches", required = True)
+    parser.add_argument("--out", metavar = "<cache_folder>", help = "folder to write binary caches, default is --cache folder")
+    parser.add_argument("--remove", action = "store_true", help = "Remove pickled cache once converted")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    ARGS = args_gestion()
+    out = ARGS.out if ARGS.out else ARGS.cache
+    for fPickle in sorted(glob.glob(f"{ARGS.cache}/*.p")):
+        fCache = f"{out}/{os.path.basename(fPickle)[:-len('.p')]}{CACHE_EXTENSION}"
+        convertPickleCache(fPickle, fCache)
+        if ARGS.remove:
+            os.remove(fPickle)
@@ -1,19 +1,27 @@
 #!/software/mobi/crispr-manager/2.0.0/bin/python
-import matplotlib.pyplot as plt
 
-import logging, sys, argparse
-logging.basicConfig(level = logging.INFO, format='%(levelname)s\t%(filename)s:%(lineno)s\t%(message)s', stream=sys.stdout)
+import logging, sys, argparse, json
+logging.basicConfig(level = logging.INFO, format='%(levelname)s\t%(filename)s:%(lineno)s\t%(message)s', stream=sys.stderr)
 import CSTB_database_manager.databaseManager as dbManager
 
+COLUMNS = ["doc_count", "doc_del_count", "active_size", "file_size", "external_size", "fragmentation"]
+
 def args_gestion():
     parser = argparse.ArgumentParser(description="Get some stats for crispr database.")
     
     parser.add_argument("--config", help = "json config file (see config.json for format)", required = True,  type=str, metavar = "FILE")
     parser.add_argument("--map", help = "rules to dispatch sgRNA to database endpoints. Here is used to have the list of volumes.", required = True, metavar ="FILE", type=str)
+    parser.add_argument("--format", help = "output format, json or tsv (one line per volume)", choices = ["json", "tsv"], default = "json")
+    parser.add_argument("--out", help = "output file, default to standard output", metavar = "FILE", type=str)
+    parser.add_argument("--jobs", help = "number of volumes queried simultaneously", type = int, default = 16)
+    parser.add_argument("--plot", help = "also plot the distribution of sgRNA per volume in FILE.png (requires matplotlib)", metavar = "FILE", type=str)
 
     return parser.parse_args()
 
 def plot_entries_per_volume_distrib(entries_per_volume, plot_file):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
     numbers = list(entries_per_volume.values())
     fig, ax = plt.subplots()
     ax.set_title(f"Number of sgRNA per volume")
@@ -23,6 +31,11 @@ def plot_entries_per_volume_distrib(entries_per_volume, plot_file):
     fig.savefig(f"{plot_file}.png", format = "png")
     logging.info(f"Number of sgRNA per volume saved to {plot_file}.png")
 
+def write_tsv(fp, fasta_number, taxon_number, volume_stats):
+    fp.write(f"# fasta\t{fasta_number}\n# taxons\t{taxon_number}\n")
+    fp.write("volume\t" + "\t".join(COLUMNS) + "\n")
+    for volume, stats in volume_stats.items():
+        fp.write(volume + "\t" + "\t".join(f"{stats[c]:.4f}" if c == "fragmentation" else str(stats[c]) for c in COLUMNS) + "\n")
 
 if __name__ == "__main__":
     ARGS = args_gestion()
@@ -30,14 +43,17 @@ if __name__ == "__main__":
     
     fasta_number = db.genomedb.number_of_entries
     taxon_number = db.taxondb.number_of_entries
-    entries_per_volume = db.motifsdb.entries_per_volume
-
-    o = open("general_stats.txt", "w")
-    o.write(f"Number of fasta : {fasta_number}\nNumber of represented taxons : {taxon_number}")
-    o.close()
-
-    logging.info("General stats are written in general_stats.txt")
-
-    plot_entries_per_volume_distrib(entries_per_volume, "entries_per_volume")
-    
-
+    volume_stats = db.motifsdb.volumeStats(ARGS.jobs)
+
+    o = open(ARGS.out, "w") if ARGS.out else sys.stdout
+    if ARGS.format == "tsv":
+        write_tsv(o, fasta_number, taxon_number, volume_stats)
+    else:
+        json.dump({"fasta": fasta_number, "taxons": taxon_number, "volumes": volume_stats}, o, indent=2)
+        o.write("\n")
+    if ARGS.out:
+        o.close()
+        logging.info(f"Stats of {len(volume_stats)} volumes written in {ARGS.out}")
+
+    if ARGS.plot:
+        plot_entries_per_volume_distrib(db.motifsdb.entries_per_volume, ARGS.plot)
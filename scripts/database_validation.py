@@ -1,13 +1,18 @@
 #!/software/mobi/crispr-manager/2.0.0/bin/python
 
-import argparse
+import argparse, logging
 import CSTB_database_manager.databaseManager as dbManager
 
+logging.basicConfig(level = logging.INFO, format='%(levelname)s\t%(filename)s:%(lineno)s\t%(message)s')
+
 def args_gestion():
-    parser = argparse.ArgumentParser(description="Get some stats for crispr database.")
+    parser = argparse.ArgumentParser(description="Compute genome by genome shared sgRNA count and Jaccard matrices from index database.")
     
-    parser.add_argument("--config", help = "json config file (see config.json for format)", required = True,  type=str, metavar = "FILE")
-    parser.add_argument("--map", help = "rules to dispatch sgRNA to database endpoints. Here is used to have the list of volumes.", required = True, metavar ="FILE", type=str)
+    parser.add_argument("--config", help = "json config file (see config.json for format), must have indexdb_path", required = True,  type=str, metavar = "FILE")
+    parser.add_argument("--out", help = "folder to write uuids.json, sizes.npy, shared.npy and jaccard.npy", required = True, type=str, metavar = "DIR")
+    parser.add_argument("--jobs", help = "number of worker processes (default: 1)", type=int, default=1, metavar = "INT")
+    parser.add_argument("--block", help = "number of genomes by block side (default: 256)", type=int, default=256, metavar = "INT")
+    parser.add_argument("--no-jaccard", help = "Only write shared sgRNA counts", action = "store_true")
 
     return parser.parse_args()
 
@@ -15,4 +20,6 @@ if __name__ == "__main__":
     ARGS = args_gestion()
     db = dbManager.DatabaseManager(ARGS.config)
 
-    motif_genomes, similarity = db.getEncodedSgrnaWithGenomes()
+    files = db.sharedSgrnaMatrix(ARGS.out, ARGS.jobs, ARGS.block, jaccard = not ARGS.no_jaccard)
+    for name, path in files.items():
+        logging.info(f"{name}\t{path}")
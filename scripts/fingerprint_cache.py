@@ -0,0 +1,52 @@
+#!/software/mobi/crispr-manager/2.0.0/bin/python
+
+import argparse, sys, logging, json, glob, os
+import CSTB_database_manager.db.fingerprint as fingerprintHandler
+
+logging.basicConfig(level = logging.INFO, format='%(levelname)s\t%(filename)s:%(lineno)s\t%(message)s')
+
+def args_gestion():
+    parser = argparse.ArgumentParser(description = "Validate or rebuild fasta fingerprint cache (md5, sequences sizes and headers)")
+    parser.add_argument("-c", "--config", metavar = "<json file>", help = "json database config file, cache is read from its fingerprint_path")
+    parser.add_argument("--cache", metavar = "<sqlite file>", help = "fingerprint cache file, overrides config fingerprint_path")
+
+    subparsers = parser.add_subparsers(dest='subparser_name')
+    parser_val = subparsers.add_parser('validate', help='List cache entries of missing or modified fasta files')
+    parser_val.add_argument("--full", action = "store_true", help = "Rehash unmodified files and compare md5")
+
+    parser_reb = subparsers.add_parser('rebuild', help='Recompute invalid entries and add entries for new fasta files')
+    parser_reb.add_argument("-l", "--location", metavar = "<fasta_folder>", help = "folder of fasta files to add to cache")
+    parser_reb.add_argument("--pattern", metavar = "<glob>", help = "fasta files pattern in location (default: *.fna*)", default = "*.fna*")
+    parser_reb.add_argument("--keep-missing", action = "store_true", help = "Keep entries of missing files")
+    parser_reb.add_argument("--full", action = "store_true", help = "Rehash unmodified files and compare md5")
+
+    args = parser.parse_args()
+    if not args.subparser_name:
+        parser.error("validate or rebuild command is required")
+    if not args.cache:
+        if not args.config:
+            parser.error("--config or --cache is required")
+        with open(args.config) as f:
+            config = json.load(f)
+        if not "fingerprint_path" in config:
+            parser.error(f"No fingerprint_path in {args.config}")
+        args.cache = config["fingerprint_path"]
+    return args
+
+if __name__ == "__main__":
+    ARGS = args_gestion()
+    cache = fingerprintHandler.connect(ARGS.cache)
+
+    if ARGS.subparser_name == "validate":
+        report = cache.validate(ARGS.full)
+        for path, problem in report.items():
+            print(f"{problem}\t{path}")
+        logging.info(f"{len(report)} invalid entries on {len(cache.paths)}")
+        cache.close()
+        sys.exit(1 if report else 0)
+
+    elif ARGS.subparser_name == "rebuild":
+        fastaList = sorted(glob.glob(os.path.join(ARGS.location, ARGS.pattern))) if ARGS.location else []
+        counts = cache.rebuild(fastaList, not ARGS.keep_missing, ARGS.full)
+        print(json.dumps(counts))
+        cache.close()
@@ -0,0 +1,53 @@
+#!/software/mobi/crispr-manager/2.0.0/bin/python
+
+import argparse, logging, json, sys
+import CSTB_database_manager.db.index as indexDBHandler
+import CSTB_database_manager.db.inverted as invertedHandler
+from CSTB_database_manager.engine.motif_cache import encodeMotifs
+
+logging.basicConfig(level = logging.INFO, format='%(levelname)s\t%(filename)s:%(lineno)s\t%(message)s')
+
+def args_gestion():
+    parser = argparse.ArgumentParser(description = "Build or query local inverted index (sgRNA -> genomes) of index database")
+    parser.add_argument("--inverted", metavar = "<inverted_folder>", help = "inverted index folder", required = True)
+
+    subparsers = parser.add_subparsers(dest='subparser_name')
+    parser_build = subparsers.add_parser('build', help='Add indexed genomes missing from inverted index')
+    parser_build.add_argument("--index", metavar = "<index_folder>", help = "index database folder", required = True)
+    parser_build.add_argument("--optimize", action = "store_true", help = "Merge all segments into one after build")
+
+    parser_lookup = subparsers.add_parser('lookup', help='Print genomes carrying sgRNA, as json')
+    parser_lookup.add_argument("--sgrna", metavar = "<sgRNA>", nargs = "*", default = [], help = "sgRNA sequences")
+    parser_lookup.add_argument("--file", metavar = "<file>", help = "file with one sgRNA sequence per line")
+
+    args = parser.parse_args()
+    if not args.subparser_name:
+        parser.error("build or lookup command is required")
+    return args
+
+if __name__ == "__main__":
+    ARGS = args_gestion()
+    inverted = invertedHandler.connect(ARGS.inverted)
+
+    if ARGS.subparser_name == "build":
+        indexdb = indexDBHandler.connect(ARGS.index)
+        missing = sorted(uuid for uuid in indexdb.all_ids if not uuid in inverted)
+        logging.info(f"{len(missing)} genomes to add to inverted index")
+        for uuid in missing:
+            with indexdb.open(uuid) as index:
+                inverted.add(uuid, index.codes)
+        inverted.flush()
+        if ARGS.optimize:
+            inverted.optimize()
+
+    elif ARGS.subparser_name == "lookup":
+        sgrnas = list(ARGS.sgrna)
+        if ARGS.file:
+            with open(ARGS.file) as fp:
+                sgrnas += [ l.strip() for l in fp if l.strip() ]
+        codes = encodeMotifs(sgrnas).tolist()
+        genomes = inverted.genomesOf(codes)
+        json.dump({ sgrna: genomes.get(code, []) for sgrna, code in zip(sgrnas, codes) }, sys.stdout, indent=2)
+        print()
+
+    inverted.close()
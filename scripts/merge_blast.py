@@ -0,0 +1,26 @@
+#!/software/mobi/crispr-manager/2.0.0/bin/python
+
+import argparse, sys, logging, json
+import CSTB_database_manager.db.blast as blastDBHandler
+
+logging.basicConfig(level = logging.INFO, format='%(levelname)s\t%(filename)s:%(lineno)s\t%(message)s')
+
+def args_gestion():
+    parser = argparse.ArgumentParser(description = "Fold blast staging fragments of finished add_genome.py --blast --stage runs into blast database, then format changed shards")
+    parser.add_argument("-c", "--config", metavar = "<json file>", help = "json database config file, blast database is read from its blastdb_path", required = True)
+    parser.add_argument("--jobs", metavar = "<n_jobs>", type = int, help = "Number of shards formatted simultaneously (default: %(default)s)", default = blastDBHandler.FORMAT_JOBS)
+    args = parser.parse_args()
+    with open(args.config) as f:
+        config = json.load(f)
+    if not "blastdb_path" in config:
+        parser.error(f"No blastdb_path in {args.config}")
+    args.blastdb_path = config["blastdb_path"]
+    args.compressed = config.get("blastdb_compressed", False)
+    return args
+
+if __name__ == "__main__":
+    ARGS = args_gestion()
+    blastdb = blastDBHandler.connect(ARGS.blastdb_path, ARGS.jobs, ARGS.compressed)
+    merged = blastdb.merge()
+    blastdb.close()
+    logging.info(f"{merged} staged records merged into {ARGS.blastdb_path}")
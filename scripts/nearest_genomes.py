@@ -0,0 +1,24 @@
+#!/software/mobi/crispr-manager/2.0.0/bin/python
+
+import argparse, logging, sys
+import CSTB_database_manager.databaseManager as dbManager
+
+logging.basicConfig(level = logging.INFO, format='%(levelname)s\t%(filename)s:%(lineno)s\t%(message)s')
+
+def args_gestion():
+    parser = argparse.ArgumentParser(description="Find indexed genomes closest to fasta files, from MinHash sketches of their sgRNA")
+    parser.add_argument("--config", help = "json config file (see config.json for format), must have indexdb_path", required = True, type=str, metavar = "FILE")
+    parser.add_argument("--fasta", help = "fasta files to look for", nargs = "*", default = [], metavar = "FILE")
+    parser.add_argument("-n", help = "number of genomes reported for each fasta (default: 5)", type=int, default=5, metavar = "INT")
+    parser.add_argument("--build", help = "Sketch indexed genomes without sketch first", action = "store_true")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    ARGS = args_gestion()
+    db = dbManager.DatabaseManager(ARGS.config)
+    if ARGS.build:
+        db.indexdb.buildSketches()
+    print("#fasta\tuuid\tjaccard")
+    for fasta in ARGS.fasta:
+        for uuid, jaccard in db.nearestGenomes(fasta, ARGS.n):
+            print(f"{fasta}\t{uuid}\t{jaccard:.4f}")
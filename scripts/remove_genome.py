@@ -1,9 +1,9 @@
 #!/software/mobi/crispr-manager/2.0.0/bin/python
 
-"""Remove genome from database (except motif collection)
+"""Remove genome from database (motif collection with --motifs)
 
 Usage:
-    remove_genome.py --config <conf> --genomes <genome_list> --location <fasta_folder> [ --min <start_index> --max <stop_index> ] [ --tree ] [ --blast ]
+    remove_genome.py --config <conf> --genomes <genome_list> --location <fasta_folder> [ --min <start_index> --max <stop_index> ] [ --tree ] [ --blast ] [ --motifs --map <volume_mapper> [ --index <index_folder> ] [ --cache <cache_folder> ] [ --writers <n_writers> ] ] [ --inverted <inverted_folder> ]
 
 Options:
     -h --help
@@ -13,7 +13,13 @@ Options:
     --min <start_index> position to read from (included) in the tsv file (header line does not count)
     --max <stop_index>  position to read to   (included) in the tsv file (header line does not count)
     --tree  Create taxonomic tree after deletion
-    --blast  Remove from blast
+    --blast  Remove from blast, all records of removed genomes are found by genome uuid in blast records registry
+    --motifs  Remove from motif collection, only documents of the sgRNA listed in genome sgRNA cache or index file are rewritten
+    --map <volume_mapper>  rules to dispatch sgRNA to database endpoints
+    --index <index_folder>  folder of genome index files (default = config indexdb_path)
+    --cache <cache_folder>  folder of binary sgRNA caches (<uuid>.mcache), used before index files
+    --inverted <inverted_folder>  remove genomes from this local inverted index (default = config inverted_path if any)
+    --writers <n_writers>  Number of motif volumes processed simultaneously (default = 1)
 
 """
 
@@ -42,13 +48,8 @@ if __name__ == "__main__":
             continue
         fastaFileList.append(fasta_path)
         
-    #First remove from blast, else it will be impossible to retrieve genome id
-    
-    if ARGS["--blast"]:
-        logging.info("# Remove from Blast")
-        db.removeFromBlast(fastaFileList)    
-
     logging.info("# Remove from Genome and Taxon")
+    deleted_ids = []
     o = open("removed_genomes.log", "w")
     for (fasta, name, taxid, gcf, acc) in tsvReader(ARGS["--genomes"], x, y):
         fasta_path = ARGS["--location"]  + "/" + fasta
@@ -58,8 +59,24 @@ if __name__ == "__main__":
             logging.error(f"Can't remove your genome because of ConsistencyError\nReason : \n{e}")
         if deleted_id:
             o.write(deleted_id  + "\n")
+            deleted_ids.append(deleted_id)
     o.close()
 
+    if ARGS["--blast"]:
+        logging.info("# Remove from Blast")
+        db.removeGenomesFromBlast(deleted_ids)
+
+    if ARGS["--motifs"]:
+        logging.info("# Remove from Motifs")
+        db.setMotifAgent(ARGS["--map"])
+        db.removeFromMotifs(deleted_ids, ARGS["--index"], ARGS["--cache"], int(ARGS["--writers"]) if ARGS["--writers"] else 1)
+
+    if ARGS["--inverted"]:
+        db.setInvertedIndex(ARGS["--inverted"])
+    if db.inverted:
+        logging.info("# Remove from inverted index")
+        db.removeFromInvertedIndex(deleted_ids)
+
     logging.info("List of deleted ids in removed_genomes.log")
 
     if ARGS["--tree"]:
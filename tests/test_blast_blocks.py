@@ -0,0 +1,55 @@
+import gzip
+import CSTB_database_manager.db.blast_blocks as blastBlocks
+
+class FakeRegistry():
+    """Blocks part of blast registry, for a single shard"""
+    def __init__(self):
+        self.registered = []
+
+    def setBlocks(self, shard, blocks, start=0):
+        self.registered = [ block for block in self.registered if block[2] < start ] + list(blocks)
+
+    def blockEnd(self, shard):
+        return (self.registered[-1][0] + self.registered[-1][1], self.registered[-1][2] + self.registered[-1][3]) if self.registered else (0, 0)
+
+    def addBlocks(self, blocks):
+        self.registered += [ block[1:] for block in blocks ]
+
+CONTENT = b"".join( f">g|rec{i}\n{'ACGT' * (i % 7 + 1)}\n".encode() for i in range(200) )
+
+def writeBlocks(fasta, monkeypatch):
+    monkeypatch.setattr(blastBlocks, "BLOCK_SIZE", 100)
+    registry = FakeRegistry()
+    with blastBlocks.BlockWriter(fasta, registry, "db_0000", "w") as writer:
+        writer.write(CONTENT[:1000])
+        writer.write(CONTENT[1000:])
+    return registry.registered
+
+def test_blocks(tmp_path, monkeypatch):
+    fasta = str(tmp_path / "db_0000.mfasta.gz")
+    blocks = writeBlocks(fasta, monkeypatch)
+    # a block compressed file is a regular gzip file
+    with gzip.open(fasta, "rb") as fp:
+        assert fp.read() == CONTENT
+    assert list(blastBlocks.scanBlocks(fasta)) == blocks
+    assert blastBlocks.readRange(fasta, blocks[3:6], 350, 120) == CONTENT[350:470]
+
+def test_cut_ranges(tmp_path, monkeypatch):
+    fasta = str(tmp_path / "db_0000.mfasta.gz")
+    blocks = writeBlocks(fasta, monkeypatch)
+    # within a block, over a block boundary, a whole block and more, last bytes
+    ranges = [ (10, 20), (190, 30), (400, 250), (len(CONTENT) - 5, 5) ]
+    newBlocks = blastBlocks.cutRanges(fasta, blocks, ranges)
+    expected, position = [], 0
+    for offset, length in ranges:
+        expected.append(CONTENT[position:offset])
+        position = offset + length
+    expected = b"".join(expected) + CONTENT[position:]
+    with gzip.open(fasta, "rb") as fp:
+        assert fp.read() == expected
+    assert newBlocks == list(blastBlocks.scanBlocks(fasta))
+    # untouched blocks are copied, not compressed again
+    assert len(newBlocks) == len(blocks) - 2
+    assert newBlocks[-2][1] == blocks[-2][1]
+    assert blastBlocks.readRange(fasta, newBlocks, 0, 50) == expected[:50]
+    assert blastBlocks.readRange(fasta, [], 0, 50) == b""
@@ -0,0 +1,71 @@
+import CSTB_database_manager.db.blast_registry as blastRegistry
+
+def writeShard(fasta, first, nb):
+    with open(fasta, "w") as fp:
+        for i in range(first, first + nb):
+            fp.write(f">g{i % 2}|rec{i}\n{'ACGT' * (i + 1)}\nTT\n")
+
+def shardRecords(registry, shard):
+    return [ tuple(record) for record in registry.shardRecords(shard) ]
+
+def test_remove_shifts_offsets(tmp_path):
+    shards = { f"db_{i:04d}": str(tmp_path / f"db_{i:04d}.mfasta") for i in range(2) }
+    for i, fasta in enumerate(shards.values()):
+        writeShard(fasta, 6 * i, 6)
+    registry = blastRegistry.connect(str(tmp_path / "db.registry"))
+    for shard, fasta in shards.items():
+        assert registry.rebuild(fasta, shard) == 6
+    untouched = shardRecords(registry, "db_0001")
+    removed = [ hashKey for hashKey, header, _, _ in registry.shardRecords("db_0000") if header.endswith(("|rec1", "|rec2", "|rec4")) ]
+    ranges = registry.ranges(removed)
+    assert registry.remove(removed) == 3
+    assert registry.remove(removed) == 0
+    # cut removed byte ranges out of multifasta, as blast database does
+    fasta = shards["db_0000"]
+    content = open(fasta, "rb").read()
+    kept, position = [], 0
+    for _, offset, length in ranges:
+        kept.append(content[position:offset])
+        position = offset + length
+    with open(fasta, "wb") as fp:
+        fp.write(b"".join(kept) + content[position:])
+    # offsets of following records were shifted as a scan of the rewritten multifasta finds them
+    assert shardRecords(registry, "db_0000") == list(blastRegistry.scanRecords(fasta))
+    assert [ header for _, header, _, _ in registry.shardRecords("db_0000") ] == [">g0|rec0", ">g1|rec3", ">g1|rec5"]
+    assert shardRecords(registry, "db_0001") == untouched
+    assert registry.uuids() == {"g0", "g1"}
+    assert len(registry) == 9
+    for hashKey, header, offset, length in registry.shardRecords("db_0000"):
+        assert blastRegistry.readRange(fasta, offset, length).startswith(header.encode() + b"\n")
+    registry.close()
+
+def test_first_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(blastRegistry, "CHECK_BLOCK", 64)
+    monkeypatch.setattr(blastRegistry, "CHECK_SAMPLE", 16)
+    fasta = str(tmp_path / "db_0000.mfasta")
+    writeShard(fasta, 0, 12)
+    content = open(fasta, "rb").read()
+    checks = list(blastRegistry.blockChecks(fasta))
+    assert len(checks) > 4
+    assert blastRegistry.firstChange(fasta, checks) is None
+    # checks resumed from a block chain the same way
+    assert list(blastRegistry.blockChecks(fasta, checks[2][0], checks[1][4])) == checks[2:]
+
+    def edit(data):
+        with open(fasta, "wb") as fp:
+            fp.write(data)
+
+    # a byte edited in third block, after its sample
+    edit(content[:2 * 64 + 40] + b"G" + content[2 * 64 + 41:])
+    assert blastRegistry.firstChange(fasta, checks) == 2 * 64
+    assert blastRegistry.firstChange(fasta, checks, full=False) is None
+    # a byte edited in its sample
+    edit(content[:2 * 64 + 3] + b"G" + content[2 * 64 + 4:])
+    assert blastRegistry.firstChange(fasta, checks, full=False) == 2 * 64
+    # appended records change at former end, truncated file at its new end
+    edit(content + b">g0|rec12\nACGT\n")
+    assert blastRegistry.firstChange(fasta, checks) == len(content)
+    edit(content[:100])
+    assert blastRegistry.firstChange(fasta, checks) == 64
+    edit(content[:128])
+    assert blastRegistry.firstChange(fasta, checks) == 128
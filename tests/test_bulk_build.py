@@ -0,0 +1,28 @@
+import os
+import pytest
+from CSTB_database_manager.engine.bulk_build import VolumeRuns
+
+def batch(i):
+    return { f"ACGT{j % 7}": {f"g{i % 3}": {"ref": [f"+({i},{j})"]}} for j in range(5) }
+
+def volumeDocs(maxFanIn, tmp_path):
+    runs = VolumeRuns(str(tmp_path), maxBufferedHits=1, maxFanIn=maxFanIn)
+    for i in range(40):
+        b = batch(i)
+        runs.add(b, ["v1" if i % 2 else "v2"] * len(b))
+    docs = { volume: list(runs.docs(volume)) for volume in runs.volumes }
+    nbRuns = { volume: len(os.listdir(f"{runs.location}/{volume}")) for volume in runs.volumes }
+    runs.close()
+    return docs, nbRuns
+
+def test_fanin(tmp_path):
+    expected, _ = volumeDocs(1000, tmp_path)
+    docs, nbRuns = volumeDocs(3, tmp_path)
+    # same documents, locations of a genome still in scan order
+    assert docs == expected
+    assert max(nbRuns.values()) <= 3
+    assert [ doc["_id"] for doc in docs["v1"] ] == sorted(doc["_id"] for doc in docs["v1"])
+
+def test_fanin_limit(tmp_path):
+    with pytest.raises(ValueError):
+        VolumeRuns(str(tmp_path), maxFanIn=1)
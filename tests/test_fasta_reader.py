@@ -0,0 +1,66 @@
+import gzip
+import pytest
+from CSTB_core.utils.io import fileHash
+from CSTB_database_manager.engine.fasta_reader import FastaDigest, FastaRecords, resolveFasta
+import CSTB_database_manager.utils.error as error
+import CSTB_database_manager.db.fingerprint as fingerprintHandler
+
+FASTA = ">seq1 first record\nACGTACGTAC\nGGTT\n>seq2 second\nTTTTCCCCAAAA\n"
+
+def writeFasta(path, compressed=False):
+    with (gzip.open(path, "wt") if compressed else open(path, "w")) as fp:
+        fp.write(FASTA)
+
+def test_digest(tmp_path):
+    fasta = str(tmp_path / "genome.fna")
+    writeFasta(fasta)
+    digest = FastaDigest(fasta)
+    assert digest.md5 == fileHash(fasta)
+    assert digest.size == {"seq1": 14, "seq2": 12}
+    assert digest.headers == {"seq1": "seq1 first record", "seq2": "seq2 second"}
+
+def test_gzip_only(tmp_path):
+    fasta = str(tmp_path / "genome.fna")
+    writeFasta(fasta + ".gz", compressed=True)
+    assert resolveFasta(fasta) == fasta + ".gz"
+    digest = FastaDigest(fasta)
+    assert digest.path == fasta + ".gz"
+    assert digest.md5 == fileHash(fasta)
+    assert digest.size == {"seq1": 14, "seq2": 12}
+
+def test_fingerprint_gzip_only(tmp_path):
+    fasta = str(tmp_path / "genome.fna")
+    writeFasta(fasta + ".gz", compressed=True)
+    cache = fingerprintHandler.connect(str(tmp_path / "fingerprints.sqlite"))
+    assert cache.get(fasta) is None
+    cache.put(FastaDigest(fasta))
+    assert cache.paths == [fasta + ".gz"]
+    summary = cache.get(fasta)
+    assert summary.md5 == fileHash(fasta) and summary.size == {"seq1": 14, "seq2": 12}
+    assert cache.validate(full=True) == {}
+    cache.close()
+
+def test_records(tmp_path):
+    fasta = str(tmp_path / "genome.fna")
+    writeFasta(fasta)
+    records = FastaRecords(fasta)
+    expected = [("seq1 first record", "ACGTACGTACGGTT", "seq1"), ("seq2 second", "TTTTCCCCAAAA", "seq2")]
+    assert list(records) == expected
+    # records are read again on each iteration
+    assert list(records) == expected
+
+def test_carriage_returns(tmp_path):
+    fasta = str(tmp_path / "genome.fna")
+    with open(fasta, "wb") as fp:
+        fp.write(FASTA.replace("\n", "\r\n").encode())
+    digest = FastaDigest(fasta)
+    assert digest.md5 == fileHash(fasta)
+    assert digest.size == {"seq1": 14, "seq2": 12}
+    assert [ record[1] for record in FastaRecords(fasta) ] == ["ACGTACGTACGGTT", "TTTTCCCCAAAA"]
+
+def test_header_conflict(tmp_path):
+    fasta = str(tmp_path / "genome.fna")
+    with open(fasta, "w") as fp:
+        fp.write(">seq1 a\nACGT\n>seq1 b\nACGT\n")
+    with pytest.raises(error.FastaHeaderConflict):
+        FastaDigest(fasta).checkHeaders()
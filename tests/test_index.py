@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from CSTB_core.utils.io import sgRNAIndexWriter
+import CSTB_database_manager.db.index as indexDBHandler
+
+CODES = [3, 17, 42, 2 ** 40 + 1]
+COUNTS = [1, 4, 2, 7]
+
+def test_binary_round_trip(tmp_path):
+    fIndex = str(tmp_path / "g1.bindex")
+    assert indexDBHandler.writeBinaryIndex(CODES, COUNTS, fIndex, 23, "twobits") == 4
+    with indexDBHandler.MotifIndex("g1", fIndex) as index:
+        assert (index.wLen, index.codec, len(index)) == (23, "twobits", 4)
+        assert index.codes.tolist() == CODES
+        assert index.counts.tolist() == COUNTS
+        assert index.count(17) == 4 and index.count(18) == 0
+        assert 2 ** 40 + 1 in index
+
+def test_chunks(tmp_path):
+    fChunks = str(tmp_path / "chunks.bindex")
+    fWhole = str(tmp_path / "whole.bindex")
+    chunks = [ (CODES[:1], COUNTS[:1]), (CODES[1:3], COUNTS[1:3]), ([], []), (CODES[3:], COUNTS[3:]) ]
+    indexDBHandler.writeBinaryIndexChunks(chunks, 4, fChunks, 23, "twobits")
+    indexDBHandler.writeBinaryIndex(CODES, COUNTS, fWhole, 23, "twobits")
+    assert open(fChunks, "rb").read() == open(fWhole, "rb").read()
+    with pytest.raises(ValueError):
+        indexDBHandler.writeBinaryIndexChunks(chunks, 5, fChunks, 23, "twobits")
+    with pytest.raises(ValueError):
+        indexDBHandler.writeBinaryIndexChunks(chunks[::-1], 4, fChunks, 23, "twobits")
+
+def test_text(tmp_path):
+    """Text index chunks are written as CSTB_core sgRNAIndexWriter, and converted to the same binary index"""
+    fCore = str(tmp_path / "core.index")
+    fChunks = str(tmp_path / "chunks.index")
+    sgRNAIndexWriter(list(zip(CODES, COUNTS)), fCore, 23, "twobits")
+    indexDBHandler.writeTextIndexChunks([ (CODES[:2], COUNTS[:2]), (CODES[2:], COUNTS[2:]) ], 4, fChunks, 23, "twobits")
+    assert open(fChunks).read() == open(fCore).read()
+    fBinary = indexDBHandler.convertTextIndex(fCore)
+    assert fBinary == str(tmp_path / "core.bindex")
+    with indexDBHandler.MotifIndex("core", fBinary) as index:
+        assert index.codes.tolist() == CODES and index.counts.tolist() == COUNTS
+    with indexDBHandler.MotifIndex("core", fCore) as index:
+        assert index.codes.tolist() == CODES and index.counts.tolist() == COUNTS
+
+def test_index_db(tmp_path):
+    folder = str(tmp_path)
+    indexDBHandler.writeBinaryIndex(CODES, COUNTS, f"{folder}/g1.bindex", 23, "twobits")
+    sgRNAIndexWriter(list(zip(CODES[:2], COUNTS[:2])), f"{folder}/g2.index", 23, "twobits")
+    indexdb = indexDBHandler.connect(folder, "binary")
+    assert indexdb.all_ids == {"g1", "g2"}
+    assert indexdb.path("g1").endswith(".bindex") and indexdb.path("g2").endswith(".index")
+    with pytest.raises(FileNotFoundError):
+        indexdb.path("g3")
+    assert indexdb.buildSketches() == 2
+    _, nbCodes = indexDBHandler.readSketch(indexdb.sketchPath("g2"))
+    assert nbCodes == 2
+    assert indexdb.nearest(indexdb.addSketch("g1", np.array(CODES, dtype=np.uint64)), 1, exclude="g1")[0][0] == "g2"
@@ -0,0 +1,62 @@
+import numpy as np
+import CSTB_database_manager.db.inverted as invertedHandler
+
+GENOMES = { "g0": [1, 5, 9], "g1": [5, 7], "g2": [2, 5, 9, 11] }
+
+def build(folder):
+    inverted = invertedHandler.connect(folder)
+    for uuid, codes in GENOMES.items():
+        inverted.add(uuid, np.array(codes, dtype=np.uint64))
+    return inverted
+
+def test_round_trip(tmp_path):
+    inverted = build(str(tmp_path))
+    # buffered genomes are searched before any flush
+    assert inverted.genomesOf([5, 3]) == {5: ["g0", "g1", "g2"]}
+    inverted.close()
+    inverted = invertedHandler.connect(str(tmp_path))
+    assert len(inverted) == 3
+    assert inverted.genomesOf([9, 11, 4]) == {9: ["g0", "g2"], 11: ["g2"]}
+    offsets, ordinals = inverted.lookup([7, 1])
+    assert offsets.tolist() == [0, 1, 2]
+    assert [ inverted.genomes[o] for o in ordinals ] == ["g1", "g0"]
+    inverted.close()
+
+def test_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(invertedHandler, "FANOUT", 2)
+    inverted = invertedHandler.connect(str(tmp_path))
+    for i in range(5):
+        inverted.add(f"g{i}", np.array([i, 100], dtype=np.uint64))
+        inverted.flush()
+    # 5 level 0 flushes make one level 2 and one level 0 segment
+    assert sorted(segment.level for segment in inverted.segments) == [0, 2]
+    assert inverted.genomesOf([100, 3]) == {100: [ f"g{i}" for i in range(5) ], 3: ["g3"]}
+    inverted.optimize()
+    assert len(inverted.segments) == 1
+    inverted.close()
+
+def test_remove(tmp_path):
+    inverted = build(str(tmp_path))
+    inverted.flush()
+    inverted.add("g3", np.array([5], dtype=np.uint64))
+    assert inverted.remove(["g1", "g3", "unknown"]) == 2
+    assert not "g1" in inverted
+    assert inverted.genomesOf([5, 7]) == {5: ["g0", "g2"]}
+    inverted.close()
+    # tombstones survive reopening, postings are dropped by merge
+    inverted = invertedHandler.connect(str(tmp_path))
+    assert len(inverted) == 2 and inverted.removed == {1, 3}
+    assert inverted.genomesOf([5, 7]) == {5: ["g0", "g2"]}
+    inverted.optimize()
+    assert not 1 in inverted.segments[0].ordinals.tolist()
+    inverted.close()
+
+def test_force(tmp_path):
+    inverted = build(str(tmp_path))
+    inverted.flush()
+    inverted.add("g1", np.array([13], dtype=np.uint64))
+    assert inverted.genomesOf([7]) == {7: ["g1"]}
+    inverted.add("g1", np.array([13], dtype=np.uint64), force=True)
+    assert inverted.genomesOf([7, 13]) == {13: ["g1"]}
+    assert len(inverted) == 3
+    inverted.close()
@@ -0,0 +1,62 @@
+import pytest
+import CSTB_database_manager.db.journal as journalHandler
+
+MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+
+def test_stages(tmp_path):
+    journal = journalHandler.connect(str(tmp_path / "journal.sqlite"))
+    assert not journal.isDone(MD5, "genome")
+    journal.done(MD5, "genome", "uuid1")
+    assert journal.isDone(MD5, "genome")
+    assert journal.uuid(MD5) == "uuid1"
+    assert journal.uuid("other") is None
+    with pytest.raises(ValueError):
+        journal.done(MD5, "unknown")
+    journal.close()
+    # stages survive reopening
+    journal = journalHandler.connect(str(tmp_path / "journal.sqlite"))
+    assert journal.isDone(MD5, "genome")
+    journal.close()
+
+def test_batches(tmp_path):
+    journal = journalHandler.connect(str(tmp_path / "journal.sqlite"))
+    assert journal.lastBatch(MD5, "stream:100") == -1
+    journal.ackBatch(MD5, "stream:100", 0)
+    journal.ackBatch(MD5, "stream:100", 3)
+    assert journal.lastBatch(MD5, "stream:100") == 3
+    # ranks of batches cut another way are meaningless
+    assert journal.lastBatch(MD5, "dict:100") == -1
+    # completed motifs stage forgets its batches
+    journal.done(MD5, "motifs", "uuid1")
+    assert journal.lastBatch(MD5, "stream:100") == -1
+    journal.close()
+
+class FakeMotifs():
+    """Motif collection failing on one batch, as an interrupted run"""
+    def __init__(self, failing=None):
+        self.failing = failing
+        self.inserted = []
+
+    def insert(self, batch, writers=1):
+        if set(batch) == self.failing:
+            return {"volume": (0, list(batch))}
+        self.inserted.append(sorted(batch))
+        return {}
+
+def test_resume(tmp_path):
+    pytest.importorskip("ete3")
+    from CSTB_database_manager.databaseManager import DatabaseManager
+    batches = [ {f"A{i}{j}": {"uuid1": {"chr": [f"+({j},{j + 2})"]}} for j in range(2)} for i in range(4) ]
+    manager = object.__new__(DatabaseManager)
+    manager.journal = journalHandler.connect(str(tmp_path / "journal.sqlite"))
+    manager.resume = True
+    manager.motifsdb = FakeMotifs(failing=set(batches[2]))
+    manager._storeMotifBatches(iter(batches), "uuid1", fasta_md5=MD5, layout="dict:2")
+    assert manager.journal.lastBatch(MD5, "dict:2") == 1
+    assert not manager.journal.isDone(MD5, "motifs")
+    # resumed run only inserts batches after the last acknowledged one
+    manager.motifsdb = FakeMotifs()
+    manager._storeMotifBatches(iter(batches), "uuid1", fasta_md5=MD5, layout="dict:2")
+    assert manager.motifsdb.inserted == [ sorted(batch) for batch in batches[2:] ]
+    assert manager.journal.isDone(MD5, "motifs")
+    manager.journal.close()
@@ -0,0 +1,71 @@
+import pickle
+import numpy as np
+import pytest
+from CSTB_database_manager.engine.motif_cache import MotifCache, MotifCacheWriter, encodeMotifs, decodeMotifs, \
+    writeMotifCache, isMotifCache, convertPickleCache
+from CSTB_core.engine.wordIntegerIndexing import getEncoding
+
+UUID = "3f2a"
+DATA = {
+    "ACGTAGG": {UUID: {"chr1": ["+(1,7)", "-(30,36)"], "chr2": ["+(4,10)"]}},
+    "TTTCCGG": {UUID: {"chr2": ["-(12,18)"]}},
+    "GATTAGG": {UUID: {"chr1": ["+(50,56)"]}},
+}
+
+def test_encoding():
+    motifs = list(DATA)
+    codes = encodeMotifs(motifs)
+    # same codes as CSTB_core twobits encoder
+    assert codes.tolist() == [ getEncoding()[1](seq) for seq in motifs ]
+    assert decodeMotifs(codes, 7) == motifs
+    with pytest.raises(ValueError):
+        encodeMotifs(["ACGTNGG"])
+
+def test_round_trip(tmp_path):
+    fCache = str(tmp_path / f"{UUID}.mcache")
+    assert writeMotifCache(DATA, UUID, fCache) == 3
+    assert isMotifCache(fCache)
+    cache = MotifCache(fCache)
+    assert (cache.uuid, cache.wLen, len(cache), cache.nb_hits) == (UUID, 7, 3, 5)
+    assert np.all(cache.codes[1:] > cache.codes[:-1])
+    assert cache.toDict() == DATA
+    assert cache.find("TTTCCGG") == {"chr2": ["-(12,18)"]}
+    assert cache.find("AAAAAAA") == {}
+    assert dict(cache.index()) == { getEncoding()[1](seq): n for seq, n in (("ACGTAGG", 3), ("TTTCCGG", 1), ("GATTAGG", 1)) }
+    cache.close()
+
+def test_batches_and_runs(tmp_path):
+    """Hits of a sgRNA added in several batches and spilled in several runs keep their order of insertion"""
+    fCache = str(tmp_path / f"{UUID}.mcache")
+    writer = MotifCacheWriter(fCache, UUID, runSize=2)
+    writer.add({"ACGTAGG": {UUID: {"chr1": ["+(1,7)"]}}, "GATTAGG": {UUID: {"chr1": ["+(50,56)"]}}})
+    writer.add({"TTTCCGG": {UUID: {"chr2": ["-(12,18)"]}}})
+    writer.add({"ACGTAGG": {UUID: {"chr1": ["-(30,36)"], "chr2": ["+(4,10)"]}}})
+    assert writer.close() == 3
+    cache = MotifCache(fCache)
+    assert cache.toDict() == DATA
+    assert [ f.name for f in tmp_path.iterdir() ] == [f"{UUID}.mcache"]
+    cache.close()
+
+def test_irregular(tmp_path):
+    writer = MotifCacheWriter(str(tmp_path / "x.mcache"), UUID)
+    with pytest.raises(ValueError):
+        writer.add({"ACGTAGG": {"other": {"chr1": ["+(1,7)"]}}})
+    with pytest.raises(ValueError):
+        writer.add({"ACGTAGG": {UUID: {"chr1": ["+(1,9)"]}}})
+    writer.discard()
+
+def test_convert_pickle(tmp_path):
+    fPickle = str(tmp_path / f"{UUID}.p")
+    items = list(DATA.items())
+    with open(fPickle, "wb") as fp:
+        pickle.dump(dict(items[:2]), fp)
+        pickle.dump(dict(items[2:]), fp)
+    fCache = convertPickleCache(fPickle)
+    assert fCache == str(tmp_path / f"{UUID}.mcache")
+    cache = MotifCache(fCache)
+    assert cache.toDict() == DATA
+    cache.close()
+    assert not isMotifCache(fPickle)
+    with pytest.raises(ValueError):
+        MotifCache(fPickle)
@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import pytest
+from CSTB_database_manager.engine.sorted_runs import SortedRuns
+
+def merge(runs, chunkSize):
+    chunks = list(runs.merged(chunkSize))
+    return chunks, [ np.concatenate(arrays) for arrays in zip(*chunks) ]
+
+@pytest.mark.parametrize("runSize", [7, 50, 10000])
+def test_merged(tmp_path, runSize):
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 40, 1000).astype(np.uint64)
+    values = np.arange(1000, dtype=np.uint32)
+    runs = SortedRuns([np.uint64, np.uint32], str(tmp_path), runSize)
+    for i in range(0, 1000, 30):
+        runs.add(keys[i:i + 30], values[i:i + 30])
+    assert runs.size == 1000
+    chunks, (mergedKeys, mergedValues) = merge(runs, 100)
+    order = np.argsort(keys, kind="stable")
+    assert np.array_equal(mergedKeys, keys[order])
+    # rows of equal keys keep their order of insertion
+    assert np.array_equal(mergedValues, values[order])
+    # a key is never split over two chunks
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous[0][-1] < chunk[0][0]
+    runs.close()
+    assert os.listdir(tmp_path) == []
+
+def test_empty(tmp_path):
+    with SortedRuns([np.uint64], str(tmp_path), 10) as runs:
+        runs.add(np.zeros(0, dtype=np.uint64))
+        assert list(runs.merged()) == []